@@ -0,0 +1,135 @@
+import os
+from typing import Dict, Iterator, List, Optional
+
+import discord
+import yaml
+
+import envs
+from Bot.Commands import COMMAND_MODULES
+
+# Every bot has these, whatever its config lists
+BASE_COMMANDS = ('default', 'help')
+
+
+class BotSettings(object):
+    """
+    What one bot identity doesn't share with the others in the process: its token, prefix, commands and the users
+    its owner-only commands answer to. Everything else (member state, GRDN, Drive, metrics, parsers and codecs) is
+    shared by every bot the process hosts.
+    """
+
+    def __init__(self, name: str, token: Optional[str], prefix: str, commands: List[str] = None,
+                 darkfyre_uid: Optional[int] = None, wenrith_uid: Optional[int] = None):
+        """
+        :param commands: Top level command IDs this bot answers to, every command in COMMAND_MODULES if None.
+        :param darkfyre_uid: Owner, for owner-only commands.
+        :param wenrith_uid: The other user GRDN answers to.
+        """
+        unknown = [cmd_id for cmd_id in commands or () if cmd_id not in COMMAND_MODULES]
+        if unknown:
+            raise ValueError(f"Bot {name} has unknown commands: {', '.join(unknown)}")
+        self.name = name
+        self.token = token
+        self.prefix = prefix
+        self.commands = commands
+        self.darkfyre_uid = darkfyre_uid
+        self.wenrith_uid = wenrith_uid
+
+    @property
+    def command_modules(self) -> Dict[str, str]:
+        """This bot's slice of COMMAND_MODULES, for its CommandRegistry."""
+        if self.commands is None:
+            return COMMAND_MODULES
+        return {cmd_id: module for cmd_id, module in COMMAND_MODULES.items()
+                if cmd_id in BASE_COMMANDS or cmd_id in self.commands}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'BotSettings':
+        """
+        One entry of a bots file. The token is given directly as `token` or, to keep it out of the file, as the name
+        of an environment variable in `token_env`.
+        """
+        name = data['name']
+        token = data.get('token') or os.getenv(data.get('token_env', ''))
+        if not token:
+            raise ValueError(f"Bot {name} has no token")
+        optional_int = (lambda value: int(value) if value is not None else None)
+        return cls(name, token, data['prefix'], data.get('commands'), optional_int(data.get('darkfyre_uid')),
+                   optional_int(data.get('wenrith_uid')))
+
+    def __repr__(self):
+        return f"BotSettings({self.name!r}, prefix={self.prefix!r}, commands={self.commands})"
+
+
+def default_settings() -> BotSettings:
+    """The single bot configured by the environment."""
+    optional_int = (lambda value: int(value) if value else None)
+    return BotSettings('default', envs.TOKEN, envs.ACTIVATION_PREFIX, None, optional_int(envs.DARKFYRE_UID),
+                       optional_int(envs.WENRITH_UID))
+
+
+def load_bot_settings(path: str) -> List[BotSettings]:
+    """
+    Reads a bots file: YAML with a `bots` list of entries for BotSettings.from_dict, e.g.
+    `bots: [{name: crew, token_env: DISCORD_TOKEN, prefix: '!cc', commands: [vote, users]}]`.
+    """
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    bots = [BotSettings.from_dict(entry) for entry in config.get('bots', [])]
+    if not bots:
+        raise ValueError(f"{path} lists no bots")
+    names = [bot.name for bot in bots]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{path} has bots with the same name")
+    return bots
+
+
+# Every client this process runs, in the order they were added, and its bot's settings
+_bots: Dict[discord.Client, BotSettings] = {}
+_default: Optional[BotSettings] = None
+
+
+def host_bot(client: discord.Client, settings: BotSettings):
+    _bots[client] = settings
+
+
+def bot_settings(client: discord.Client) -> BotSettings:
+    """The settings of the bot running on `client`. Clients that weren't hosted explicitly run the default bot."""
+    global _default
+    settings = _bots.get(client)
+    if settings is None:
+        if _default is None:
+            _default = default_settings()
+        settings = _default
+    return settings
+
+
+def hosted_clients() -> List[discord.Client]:
+    return list(_bots) or [envs.CLIENT]
+
+
+def all_clients_ready() -> bool:
+    """Whether every hosted client is logged in and has its guilds. Until then a missing guild proves nothing."""
+    return all(client.is_ready() and not client.is_closed() for client in hosted_clients())
+
+
+def find_guild(guild_id: int) -> Optional[discord.Guild]:
+    """
+    A guild as seen by the first client that's in it. Bots are meant to serve different guilds: where two are in
+    the same one, both enforce its saved mutes.
+    """
+    for client in hosted_clients():
+        guild = client.get_guild(guild_id)
+        if guild is not None:
+            return guild
+    return None
+
+
+def hosted_guilds() -> Iterator[discord.Guild]:
+    """Every guild any hosted bot is in, once."""
+    seen = set()
+    for client in hosted_clients():
+        for guild in list(client.guilds):
+            if guild.id not in seen:
+                seen.add(guild.id)
+                yield guild
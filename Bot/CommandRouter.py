@@ -0,0 +1,339 @@
+import importlib
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class ArgumentError(ValueError):
+    """A command was called with arguments that don't match its schema."""
+
+
+class Arg(object):
+    """
+    A positional argument: the next word of the message, passed through `convert`.
+    """
+
+    def __init__(self, name: str, convert: Callable[[str], Any] = str, optional=False, default=None):
+        self.name = name
+        self.convert = convert
+        self.optional = optional
+        self.default = default
+
+    @property
+    def usage(self) -> str:
+        return f"[{self.name}]" if self.optional else f"<{self.name}>"
+
+    def parse(self, rest: str) -> (Any, str):
+        parts = rest.split(None, 1)
+        if not parts:
+            if self.optional:
+                return self.default, rest
+            raise ArgumentError(f"Missing {self.usage}")
+        try:
+            value = self.convert(parts[0])
+        except ValueError:
+            raise ArgumentError(f"Invalid {self.usage}: `{parts[0]}`")
+        return value, parts[1] if len(parts) > 1 else ''
+
+
+class Flag(Arg):
+    """
+    An optional switch such as `-h`. True, and consumed, if the next word is `token`, otherwise False. Consecutive
+    flags in a schema can be given in any order.
+    """
+
+    def __init__(self, name: str, token: str):
+        super().__init__(name, optional=True, default=False)
+        self.token = token
+
+    @property
+    def usage(self) -> str:
+        return f"[{self.token}]"
+
+    def parse(self, rest: str) -> (bool, str):
+        if self.token not in rest:
+            return False, rest
+        parts = rest.split(None, 1)
+        if parts and parts[0] == self.token:
+            return True, parts[1] if len(parts) > 1 else ''
+        return False, rest
+
+
+class Rest(Arg):
+    """
+    Everything left in the message, as one string.
+    """
+
+    def __init__(self, name: str, optional=False, default=''):
+        super().__init__(name, optional=optional, default=default)
+
+    @property
+    def usage(self) -> str:
+        return f"[{self.name}...]" if self.optional else f"<{self.name}...>"
+
+    def parse(self, rest: str) -> (str, str):
+        rest = rest.strip()
+        if not rest:
+            if self.optional:
+                return self.default, ''
+            raise ArgumentError(f"Missing {self.usage}")
+        return rest, ''
+
+
+Schema = Tuple[Arg, ...]
+
+
+def parse_flags(flags: List[Flag], rest: str) -> (Dict[str, bool], str):
+    """Parse a run of flags, which may come in any order, each at most once."""
+    values = {flag.name: False for flag in flags}
+    if len(flags) == 1:
+        values[flags[0].name], rest = flags[0].parse(rest)
+        return values, rest
+    by_token = {flag.token: flag for flag in flags}
+    while any(token in rest for token in by_token):
+        parts = rest.split(None, 1)
+        flag = by_token.pop(parts[0], None) if parts else None
+        if flag is None:
+            break
+        values[flag.name] = True
+        rest = parts[1] if len(parts) > 1 else ''
+    return values, rest
+
+
+def parse_args(schema: Schema, rest: str) -> (Dict[str, Any], str):
+    """
+    Parse `rest` against `schema`.
+    :return: The parsed arguments by name, and whatever text the schema didn't consume.
+    """
+    args = {}
+    flags = []
+    for arg in schema:
+        if isinstance(arg, Flag):
+            flags.append(arg)
+            continue
+        if flags:
+            values, rest = parse_flags(flags, rest)
+            args.update(values)
+            flags = []
+        args[arg.name], rest = arg.parse(rest)
+    if flags:
+        values, rest = parse_flags(flags, rest)
+        args.update(values)
+    return args, rest
+
+
+def usage(schema: Schema) -> str:
+    return " ".join(arg.usage for arg in schema)
+
+
+class Invocation(object):
+    """
+    A message matched to a command.
+
+    `path` is the command and subcommand IDs that were matched, `action` the name of the command method to run for
+    subcommands declared in `SUBCOMMANDS` (None otherwise), `args` the arguments parsed from the command's schema and
+    `rest` the text after them.
+    """
+    __slots__ = ('message', 'command', 'path', 'action', 'args', 'rest')
+
+    def __init__(self, message, command, path: Tuple[str, ...] = (), action: str = None,
+                 args: Dict[str, Any] = None, rest: str = ''):
+        self.message = message
+        self.command = command
+        self.path = path
+        self.action = action
+        self.args = args if args is not None else {}
+        self.rest = rest
+
+    @property
+    def channel(self):
+        return self.message.channel
+
+    @property
+    def author(self):
+        return self.message.author
+
+
+class CommandRegistry(object):
+    """
+    Imports and instantiates commands on first use, from a table of ID -> 'module:Class'.
+    """
+
+    def __init__(self, client, modules: Dict[str, str]):
+        self.client = client
+        self.modules = modules
+        self.load_times: Dict[str, float] = {}
+        self._commands: Dict[str, Any] = {}
+
+    def ids(self) -> List[str]:
+        return list(self.modules)
+
+    def loaded(self, cmd_id: str) -> bool:
+        return cmd_id in self._commands
+
+    def load(self, cmd_id: str):
+        command = self._commands.get(cmd_id)
+        if command is not None:
+            return command
+        start = time.perf_counter()
+        module_name, class_name = self.modules[cmd_id].split(':')
+        command = self._commands[cmd_id] = getattr(importlib.import_module(module_name), class_name)(self.client)
+        if cmd_id == 'help':
+            # The help text is built from every command's docstring
+            command.set_help_dict(self.load_all())
+        self.load_times[cmd_id] = time.perf_counter() - start
+        return command
+
+    def load_all(self) -> Dict[str, Any]:
+        return {cmd_id: self.load(cmd_id) for cmd_id in self.modules}
+
+
+class _Route(object):
+    __slots__ = ('command', 'action', 'schema', 'path')
+
+    def __init__(self, command, action: Optional[str], schema: Schema, path: Tuple[str, ...]):
+        self.command = command
+        self.action = action
+        self.schema = schema
+        self.path = path
+
+
+class _Node(object):
+    __slots__ = ('children', 'route')
+
+    def __init__(self, route: _Route = None):
+        self.children: Dict[str, _Node] = {}
+        self.route = route
+
+
+class CommandRouter(object):
+    """
+    Matches prefixed messages to commands.
+
+    The commands are compiled into a trie of command and subcommand IDs once at startup. Routing a message walks the
+    trie one word at a time, so only the words that name the command are split off and nothing after them is
+    touched until the matched command's argument schema is parsed. The deepest match wins, so `vote mute ...` goes
+    to VoteMute and `av <anything else>` to AVCommand itself. Messages that match nothing go to the default command.
+
+    Subcommands come from a command's `cmd_dict` (child command instances) and its `SUBCOMMANDS`, which maps IDs to
+    a method name and an argument schema. A command with a `FALLBACK` hands messages that don't name one of its
+    subcommands to that subcommand instead, e.g. `vote <question>` to VotePoll.
+
+    Top level commands are added to the trie the first time a message names them, since their subcommands aren't
+    known until their module is imported.
+    """
+
+    def __init__(self, registry: CommandRegistry, prefix: str,
+                 on_command: Callable[[Invocation, float, bool], None] = None):
+        """
+        :param registry: Top level commands. Must include 'default'.
+        :param prefix: Activation prefix every routed message starts with.
+        :param on_command: Called after each command runs with the invocation, how long it took in seconds and
+            whether it raised.
+        """
+        self.registry = registry
+        self.prefix = prefix
+        self.on_command = on_command
+        self._root = _Node()
+        self._unloaded = set(registry.ids()) - {'default'}
+        self._depth = 1
+
+    @property
+    def default(self):
+        return self.registry.load('default')
+
+    @property
+    def commands(self) -> Dict[str, Any]:
+        """Every top level command, loading the ones that haven't been yet."""
+        for cmd_id in list(self._unloaded):
+            self._load(cmd_id)
+        return self.registry.load_all()
+
+    def _load(self, cmd_id: str):
+        self._add(self._root, self.registry.load(cmd_id), (cmd_id,))
+        self._unloaded.discard(cmd_id)
+        self._depth = max(len(path.split()) for path in self.routes())
+
+    def _add(self, parent: _Node, command, path: Tuple[str, ...]):
+        node = parent.children[path[-1]] = _Node(_Route(command, None, command.ARGS, path))
+        for sub_id, child in getattr(command, 'cmd_dict', {}).items():
+            self._add(node, child, path + (sub_id,))
+        for sub_id, (action, schema) in command.SUBCOMMANDS.items():
+            node.children[sub_id] = _Node(_Route(command, action, schema, path + (sub_id,)))
+        # Child commands inherit their parent's FALLBACK but have no subcommands of their own
+        if command.FALLBACK in node.children:
+            node.route = node.children[command.FALLBACK].route
+
+    def routes(self) -> List[str]:
+        """Every routable command path of the loaded commands, e.g. 'av grdn add'."""
+        result = []
+        stack = [((), self._root)]
+        while stack:
+            path, node = stack.pop()
+            if node.route is not None:
+                result.append(" ".join(path))
+            stack.extend((path + (word,), child) for word, child in node.children.items())
+        return sorted(result)
+
+    def route(self, message) -> Invocation:
+        """
+        Match a message that starts with the prefix. Raises ArgumentError if it matches a command but not that
+        command's schema.
+        """
+        # One split for the prefix and the deepest possible command path, the last item is the untouched remainder
+        words = message.content.split(None, self._depth + 1)
+        # `<prefix>word` without a space isn't a command
+        if words[0] != self.prefix:
+            return Invocation(message, self.default, rest=message.content[len(self.prefix):])
+        count = len(words)
+        children = self._root.children
+        route = None
+        i = 1
+        while i < count:
+            node = children.get(words[i])
+            if node is None:
+                if i == 1 and words[1] in self._unloaded:
+                    self._load(words[1])
+                    return self.route(message)
+                break
+            route = node.route
+            children = node.children
+            i += 1
+            if not children:
+                break
+        if i == count:
+            rest = ''
+        elif i == count - 1:
+            rest = words[i]
+        else:
+            rest = ' '.join(words[i:])
+        if route is None:
+            return Invocation(message, self.default, rest=rest)
+        if not route.schema:
+            return Invocation(message, route.command, route.path, route.action, {}, rest)
+        try:
+            args, rest = parse_args(route.schema, rest)
+        except ArgumentError as e:
+            raise ArgumentError(f"{e}. Usage: `{' '.join((self.prefix,) + route.path)} {usage(route.schema)}`")
+        return Invocation(message, route.command, route.path, route.action, args, rest.strip())
+
+    async def dispatch(self, message) -> Optional[Invocation]:
+        """
+        Route a message and run its command.
+        :return: The invocation, or None if the arguments didn't match the command.
+        """
+        try:
+            invocation = self.route(message)
+        except ArgumentError as e:
+            await self.default.send_message(message.channel, str(e))
+            return None
+        if self.on_command is None:
+            await invocation.command.execute(invocation)
+            return invocation
+        start = time.perf_counter()
+        failed = True
+        try:
+            await invocation.command.execute(invocation)
+            failed = False
+        finally:
+            self.on_command(invocation, time.perf_counter() - start, failed)
+        return invocation
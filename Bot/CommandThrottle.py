@@ -0,0 +1,160 @@
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+from envs import THROTTLE_USER, THROTTLE_CHANNEL, THROTTLE_COMMANDS, THROTTLE_IN_FLIGHT, THROTTLE_NOTICE_SECONDS
+from Bot.Metrics import get_metrics
+
+# Why a command was turned away
+USER = 'user'
+CHANNEL = 'channel'
+COMMAND = 'command'
+OVERLOAD = 'overload'
+
+Limit = Tuple[int, float]  # (commands, per seconds)
+
+THROTTLED = get_metrics().counter('bot_commands_throttled', "Commands turned away before running", ('reason',))
+
+
+def parse_limit(text: str) -> Optional[Limit]:
+    """'5/10' is 5 commands per 10 seconds. Empty or '0' is no limit."""
+    text = text.strip()
+    if not text or text == '0':
+        return None
+    count, _, per = text.partition('/')
+    return int(count), float(per or 1)
+
+
+def parse_command_limits(text: str) -> Dict[str, Limit]:
+    """'vote=2/60,av=5/30' to a limit for each command ID."""
+    limits = {}
+    for entry in text.split(','):
+        if entry.strip():
+            cmd_id, _, limit = entry.partition('=')
+            limit = parse_limit(limit)
+            if limit is not None:
+                limits[cmd_id.strip()] = limit
+    return limits
+
+
+class _Buckets(object):
+    """
+    Token buckets of one kind (per user, per channel, ...), one per key. A bucket is only kept while it's refilling,
+    so the table holds the keys active in the last `per` seconds rather than everyone ever seen.
+    """
+
+    def __init__(self, limit: Limit, max_keys: int = 10000):
+        self.capacity, per = limit
+        self.rate = self.capacity / per
+        self.per = per
+        self.max_keys = max_keys
+        self._buckets: Dict[Hashable, Tuple[float, float]] = {}  # Key to (tokens, last refill)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _tokens(self, key: Hashable, now: float) -> float:
+        tokens, last = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - last) * self.rate)
+
+    def allows(self, key: Hashable, now: float) -> bool:
+        """Whether `take` would succeed, without taking anything."""
+        return self._tokens(key, now) >= 1
+
+    def take(self, key: Hashable, now: float) -> bool:
+        tokens = self._tokens(key, now)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return False
+        if len(self._buckets) >= self.max_keys:
+            self.prune(now)
+        self._buckets[key] = (tokens - 1, now)
+        return True
+
+    def prune(self, now: float):
+        """Forget buckets that have refilled, they'd start out full anyway."""
+        for key in [key for key, (_tokens, last) in self._buckets.items() if now - last >= self.per]:
+            del self._buckets[key]
+
+
+class CommandThrottle(object):
+    """
+    Admission control in front of the command router.
+
+    A command has to get a token from its author's bucket, its channel's bucket and, for commands with a limit of
+    their own, its author's bucket for that command. While `in_flight` commands are already running, new ones are
+    shed. The check is a few dict lookups and doesn't need the message routed, so a flood costs little more than
+    receiving it.
+
+    A turned away command gets no reply, except that its author is told to slow down once every `notice_seconds`.
+    """
+
+    def __init__(self, user: Optional[Limit], channel: Optional[Limit], commands: Dict[str, Limit],
+                 in_flight: int = 0, notice_seconds: float = 30.0):
+        """
+        :param user: Commands per seconds for each user, None for no limit.
+        :param channel: Commands per seconds for each channel, None for no limit.
+        :param commands: Commands per seconds for each user, of each of these command IDs.
+        :param in_flight: Commands allowed to run at once, 0 for no limit.
+        """
+        self.users = _Buckets(user) if user else None
+        self.channels = _Buckets(channel) if channel else None
+        self.commands = {cmd_id: _Buckets(limit) for cmd_id, limit in commands.items()}
+        self.in_flight_limit = in_flight
+        self.notice_seconds = notice_seconds
+        self.in_flight = 0
+        self.rejected = {reason: 0 for reason in (USER, CHANNEL, COMMAND, OVERLOAD)}
+        self._noticed = _Buckets((1, notice_seconds)) if notice_seconds > 0 else None
+
+    def admit(self, uid: int, channel_id: int, cmd_id: str) -> Optional[str]:
+        """
+        Takes the tokens a command needs, all of them or none. On success the caller runs it and must call `release`
+        when it's done.
+        :return: None if the command may run, otherwise why not (USER, CHANNEL, COMMAND or OVERLOAD).
+        """
+        if self.in_flight_limit and self.in_flight >= self.in_flight_limit:
+            return self._reject(OVERLOAD)
+        now = time.monotonic()
+        checks = ((USER, self.users, uid), (CHANNEL, self.channels, channel_id),
+                  (COMMAND, self.commands.get(cmd_id), uid))
+        buckets = [(reason, bucket, key) for reason, bucket, key in checks if bucket is not None]
+        # Every bucket is checked before any is taken from, so a command turned away by one costs none of the others
+        for reason, bucket, key in buckets:
+            if not bucket.allows(key, now):
+                return self._reject(reason)
+        for _reason, bucket, key in buckets:
+            bucket.take(key, now)
+        self.in_flight += 1
+        return None
+
+    def release(self):
+        self.in_flight -= 1
+
+    def _reject(self, reason: str) -> str:
+        self.rejected[reason] += 1
+        THROTTLED.inc(reason)
+        return reason
+
+    def should_notify(self, uid: int) -> bool:
+        """Whether a turned away user should be told, at most once every `notice_seconds`."""
+        return self._noticed is not None and self._noticed.take(uid, time.monotonic())
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'in_flight': self.in_flight,
+            'tracked_users': len(self.users) if self.users is not None else 0,
+            'tracked_channels': len(self.channels) if self.channels is not None else 0,
+            **{f"rejected_{reason}": count for reason, count in self.rejected.items()},
+        }
+
+
+_throttle: Optional[CommandThrottle] = None
+
+
+def get_command_throttle() -> CommandThrottle:
+    """Returns the process-wide throttle, shared by every bot the process hosts."""
+    global _throttle
+    if _throttle is None:
+        _throttle = CommandThrottle(parse_limit(THROTTLE_USER), parse_limit(THROTTLE_CHANNEL),
+                                    parse_command_limits(THROTTLE_COMMANDS), THROTTLE_IN_FLIGHT,
+                                    THROTTLE_NOTICE_SECONDS)
+    return _throttle
@@ -1,18 +1,38 @@
 import discord
-from envs import LOGGER
+from typing import Dict, Optional, Tuple
+from Bot.BotHost import BotSettings, bot_settings
+from Bot.CommandRouter import Invocation, Schema
+from Bot.RestScheduler import send
 
 
 class Command(object):
     """
     Generic class for Commands
     """
-    ID = None  # type: str
+    ID: str = None
+    ARGS: Schema = ()
+    # Subcommands handled by a method of this command: {ID: (method name, argument schema)}
+    SUBCOMMANDS: Dict[str, Tuple[str, Schema]] = {}
+    # Child command that handles messages naming none of the subcommands
+    FALLBACK: Optional[str] = None
 
     def __init__(self, client: discord.Client):
         self.client = client
 
+    @property
+    def settings(self) -> BotSettings:
+        """Prefix and owners of the bot this command instance belongs to."""
+        return bot_settings(self.client)
+
     async def send_message(self, channel: discord.TextChannel, message: str, *args):
-        await channel.send(message)
+        await send(channel, message)
+
+    async def run_action(self, invocation: Invocation):
+        """Run the method for the subcommand in `invocation`."""
+        await getattr(self, invocation.action)(invocation)
 
-    async def execute(self, message: discord.Message):
-        await self.send_message(message.channel, "How did you even...?")
+    async def execute(self, invocation: Invocation):
+        if invocation.action is not None:
+            await self.run_action(invocation)
+            return
+        await self.send_message(invocation.channel, "How did you even...?")
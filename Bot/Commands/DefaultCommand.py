@@ -1,6 +1,6 @@
 import discord
 
-from envs import ACTIVATION_PREFIX
+from Bot.CommandRouter import Invocation
 from Bot.Commands.Command import Command
 
 
@@ -8,11 +8,11 @@ class DefaultCommand(Command):
     """
     Fallback command for invalid commands
     """
-    ID = 'default'  # type: str
+    ID: str = 'default'
 
     def __init__(self, client: discord.Client):
         super().__init__(client)
 
-    async def execute(self, message: discord.Message):
-        await self.send_message(message.channel, f"That is not a valid command. For a list of available commands "
-                                                 f"use `{ACTIVATION_PREFIX} help`")
+    async def execute(self, invocation: Invocation):
+        await self.send_message(invocation.channel, f"That is not a valid command. For a list of available commands "
+                                                 f"use `{self.settings.prefix} help`")
@@ -0,0 +1,51 @@
+import discord
+
+from Bot.CommandRouter import Invocation, Flag, Rest
+from Bot.Commands.Command import Command
+from Bot.Metrics import get_metrics
+
+# Discord's limit is 2000 characters, leave room for the code block
+MESSAGE_LIMIT = 1900
+
+
+class MetricsCommand(Command):
+    """
+    (Owner only) Latency and queue metrics. `metrics [-raw] [name prefix]`
+    """
+    ID: str = 'metrics'
+    ARGS = (Flag('raw', '-raw'), Rest('prefix', optional=True))
+
+    def __init__(self, client: discord.Client):
+        super().__init__(client)
+
+    async def execute(self, invocation: Invocation):
+        if invocation.author.id != self.settings.darkfyre_uid:
+            await self.send_message(invocation.channel, "You cannot access this command.")
+            return
+        metrics = get_metrics()
+        prefix = invocation.args['prefix']
+        if invocation.args['raw']:
+            lines = metrics.render(prefix).splitlines()
+        else:
+            lines = metrics.summary(prefix)
+        if not lines:
+            await self.send_message(invocation.channel, f"No metrics start with `{prefix}`")
+            return
+        for chunk in chunk_lines(lines, MESSAGE_LIMIT):
+            await self.send_message(invocation.channel, f"```\n{chunk}\n```")
+
+
+def chunk_lines(lines, limit: int):
+    """Join lines into blocks of at most `limit` characters. Longer lines are cut."""
+    chunk = []
+    size = 0
+    for line in lines:
+        line = line[:limit]
+        if chunk and size + len(line) + 1 > limit:
+            yield "\n".join(chunk)
+            chunk = []
+            size = 0
+        chunk.append(line)
+        size += len(line) + 1
+    if chunk:
+        yield "\n".join(chunk)
@@ -1,8 +1,9 @@
+import asyncio
 import discord
-import os
-import yaml
 from Bot.UserYml import UserYml
-from typing import Union, List
+from Bot.UserStore import get_user_store
+from Bot.GuildReload import GuildReloadJob, start_reload, cancel_reload, reconcile_guild
+from Bot.CommandRouter import Invocation, Flag
 from Bot.Commands.Command import Command
 
 
@@ -10,53 +11,59 @@ class UsersCommand(Command):
     """
     Command for fixing the guild's User file. Will unmute/undeafen all members.
     """
-    ID = 'users'  # type: str
+    ID: str = 'users'
+    SUBCOMMANDS = {
+        'reload': ('reload_cmd', (Flag('safe', 'safe'),)),
+        'cancel': ('cancel_cmd', ()),
+    }
 
     def __init__(self, client):
         super().__init__(client)
 
-    async def execute(self, message: discord.Message, guild=None):
-        guild = guild if guild is not None else message.guild  # type: discord.Guild
-        if 'reload' in message.content:
-            if 'safe' in message.content:
-                self.safe_reload(guild)
-            else:
-                self.reload(guild)
+    async def execute(self, invocation: Invocation):
+        if invocation.action is not None:
+            await self.run_action(invocation)
+
+    async def reload_cmd(self, invocation: Invocation):
+        guild: discord.Guild = invocation.message.guild
+        if invocation.args['safe']:
+            added, removed = await reconcile_guild(guild)
+            await self.send_message(invocation.channel, f"{added} members added, {removed} removed.")
+        else:
+            self.reload(guild, invocation.channel)
+
+    async def cancel_cmd(self, invocation: Invocation):
+        if not cancel_reload(invocation.message.guild):
+            await self.send_message(invocation.channel, "No reload is running.")
 
     @staticmethod
-    def reload(guild):
-        cur_path = os.path.dirname(os.path.dirname(__file__))
-        guilds_path = os.path.join(cur_path, 'Guilds')
-        try:
-            os.mkdir(guilds_path)
-        except FileExistsError:
-            pass
-        try:
-            os.mkdir(os.path.join(guilds_path, str(guild.id)))
-        except FileExistsError:
-            pass
-        guilds_path = os.path.join(guilds_path, f'{guild.id}')
-        user_list = [UserYml.create_user_from_member(member) for member in guild.members]
-        for user in user_list:
-            file_path = os.path.join(guilds_path, f"{user.uid}.yml")
-            with open(file_path, 'w+') as user_file:
-                user_file.write(yaml.dump(user))
+    def reload(guild, channel=None) -> GuildReloadJob:
+        """Rewrite every member's record in the background. Cancel with `users cancel`."""
+        return start_reload(guild, channel)
 
     @classmethod
-    def safe_reload(cls, guild):
-        """Reload done to make user files for anyone that joined while the bot was offline."""
-        guild_path = os.path.abspath(os.path.relpath(os.path.join('Bot', 'Guilds', str(guild.id))))
-        for member in guild.members:
-            user_path = os.path.join(guild_path, f'{member.id}.yml')
-            if not os.path.exists(user_path):
-                cls.add_user(guild, member, user_path)
+    def safe_reload(cls, guild) -> asyncio.Task:
+        """Reload done to make user files for anyone that joined or left while the bot was offline."""
+        return asyncio.get_running_loop().create_task(reconcile_guild(guild))
 
     @classmethod
-    def add_user(cls, guild, member, user_path=None):
-        if user_path is None:
-            guild_path = os.path.abspath(os.path.relpath(os.path.join('Bot', 'Guilds', str(guild.id))))
-            user_path = os.path.join(guild_path, f'{member.id}.yml')
-        with open(user_path, "w") as user_file:
-            user = UserYml.create_user_from_member(member)
-            user_file.write(yaml.dump(user))
+    def add_user(cls, guild, member):
+        store = get_user_store()
+        # Someone rejoining keeps their old record, otherwise leaving would be a way out of a mute
+        if member.id not in store.user_ids(guild.id):
+            store.put(guild.id, UserYml.create_user_from_member(member))
 
+    @classmethod
+    def remove_user(cls, guild, member):
+        """Drop a departed member's record, unless they're muted."""
+        store = get_user_store()
+        if not store.is_muted(guild.id, member.id):
+            store.delete_many(guild.id, [member.id])
+
+    @classmethod
+    def rename_user(cls, guild, user):
+        store = get_user_store()
+        record = store.get(guild.id, user.id)
+        if record is not None and record.name != user.name:
+            record.name = user.name
+            store.put(guild.id, record)
@@ -1,10 +1,15 @@
-import discord
 import asyncio
+import discord
+import time
 from typing import List, Dict
 
 from Bot.UserYml import UserYml
+from Bot.PollRegistry import Poll, get_poll_registry, POLL, MUTE, UNMUTE
+from Bot.VoteParser import parse_poll, parse_mute, VoteSyntaxError
+from Bot.CommandRouter import Invocation
 from Bot.Commands.Command import Command
-from envs import LOGGER
+from Bot.RestScheduler import get_rest_scheduler, send, COSMETIC
+from envs import LOGGER, VOTE_EARLY_CLOSE, VOTE_EARLY_CLOSE_MIN_VOTES
 
 NUMBERS = [":one:", ":two:", ":three:", ":four:", ":five:", ":six:", ":seven:", ":eight:", ":nine:", ":keycap_ten:"]
 UNICODE_NUMS = ["{}\N{COMBINING ENCLOSING KEYCAP}".format(num) for num in range(1, 10)]
@@ -21,11 +26,13 @@ class VoteCommand(Command):
     Command to create a poll.
     Vote format `!cc vote <question> | <answer 1>, <answer 2>, <answer 3>`
     """
-    ID = 'vote'  # type: str
+    ID: str = 'vote'
+    # If not a special type of vote, make a normal poll
+    FALLBACK: str = 'poll'
 
     def __init__(self, client, child=False):
         super().__init__(client)
-        self.cmd_dict = {}  # type: Dict[str, VoteCommand]
+        self.cmd_dict: Dict[str, VoteCommand] = {}
 
         # Prevent recursion in child object instances.
         if not child:
@@ -33,141 +40,84 @@ class VoteCommand(Command):
             for cls in subclasses:
                 self.cmd_dict[cls.ID] = cls(client)
 
-    async def send_message(self, channel: discord.TextChannel, message: str, *args, duration=60):
+    async def send_message(self, channel: discord.TextChannel, message: str, *args, duration=60, kind=POLL,
+                           target: discord.Member = None, mute_duration=0):
         """
-
+        Sends the poll and registers it. Votes are counted as reactions come in and the registry closes the poll
+        and acts on the result once `duration` is up.
         :param channel:
         :param message:
-        :param args:
+        :param args: Number of choices and the list of emojis to use for them. Without them only the text is sent.
         :param duration: How long to wait until declaring the vote winner. -1 if message is in error.
+        :param kind: What to do with the result, see PollRegistry.
+        :param target: Member to mute or unmute if the vote passes.
+        :param mute_duration: How long to mute the target for.
         :return:
         """
-        msg = await channel.send(message)
+        msg = await send(channel, message)
+        if len(args) < 2:
+            return  # Just a reply, no poll
         num_choices = args[0]
         emoji_list = args[1]
         # Check if valid vote called.
         if MIN_CHOICES < num_choices <= MAX_CHOICES and duration > 0:
-            for i in range(num_choices):
-                await msg.add_reaction(emoji_list[i])
-            await asyncio.sleep(duration)
-            vote_result, num_winner = await self.count_votes(msg)
-            await channel.send(vote_result)
-            return num_winner
-
-    async def execute(self, message: discord.Message, vote_string=None):
-        # Removes first two words ({ACTIVATION_PREFIX} vote)
-        vote_string = ' '.join(message.content.split(' ')[2:])
-        try:
-            cmd_id = vote_string.split(' ')[0]  # Get just the first word Ex: mute or poll
-            await self.cmd_dict[cmd_id].execute(message, vote_string)
-        except KeyError:
-            # If not a special type of vote, make a normal poll
-            await self.cmd_dict['poll'].execute(message, vote_string)
-
-    @staticmethod
-    def interpret_time(duration: str) -> int:
-        """
-        Given a string of either numbers or text form of hours, seconds, etc. (ex: 1 hour, 5 minutes, 3 seconds)
-        Convert all to an integer number of seconds.
-        :param duration:
-        :return: Integer number of seconds that the time given is.
-        """
-        duration = duration.strip().split(' ')
-
-        # If only passed 1 number, interpret number as number of seconds
-        if len(duration) == 1 and duration[0].isdigit():
-            return int(duration[0])
-
-        times = {
-            "year": 31536000,
-            "month": 2628288,
-            "week": 604800,
-            "day": 86400,
-            "hour": 3600,
-            "minute": 60,
-            "second": 1
-        }
-        result = 0
-        for i, interval in enumerate(duration):
-            if not interval.isdigit():
-                # De-pluralize, remove commas, etc.
-                for time in times.keys():
-                    if time in interval:
-                        interval = time
-                        break
-                try:
-                    result += int(duration[i - 1]) * times[interval]
-                except KeyError:
-                    pass
-
-        return result if result != 0 else 60
+            guild = getattr(channel, 'guild', None)
+            poll = Poll(msg.id, channel.id, guild.id if guild is not None else None, emoji_list[:num_choices],
+                        time.time() + duration, kind=kind, target_id=target.id if target is not None else None,
+                        mute_duration=mute_duration, quorum=self.voice_quorum(target),
+                        min_votes=VOTE_EARLY_CLOSE_MIN_VOTES)
+            # Register before reacting so no early votes are missed
+            get_poll_registry().open(self.client, poll)
+            rest = get_rest_scheduler()
+            reactions = [rest.submit(f"reaction:{channel.id}", msg.add_reaction, emoji_list[i], priority=COSMETIC)
+                         for i in range(num_choices)]
+            await asyncio.gather(*reactions)
 
     @staticmethod
-    async def count_votes(message: discord.Message) -> (str, int):
+    def voice_quorum(target: discord.Member = None):
         """
-        Counts the reactions in the message and outputs a string proclaiming the emoji with the highest number of votes.
-        :param message:
-        :return:
+        For votes about a member in a voice channel, the people in that channel (not counting bots) are the ones
+        affected, so with VOTE_EARLY_CLOSE on the vote is over as soon as most of them agree.
         """
-        msg_id = message.id
-        updated_msg = await message.channel.fetch_message(msg_id)  # Need to check current vote count of the message
-        reactions = updated_msg.reactions
-        highest = [(None, 0)]
-        num = 0
-        for i, reaction in enumerate(reactions, 1):
-            if reaction.count > highest[0][1]:
-                highest = [(reaction.emoji, reaction.count)]
-                num = i
-            elif reaction.count == highest[0][1]:
-                highest.append((reaction.emoji, reaction.count))
-
-        if len(highest) == 1:
-            return f"{highest[0][0]} wins with {highest[0][1] - 1} votes.", num
-        else:
-            result = "The result is a tie between "
-            for i, tup in enumerate(highest, 1):
-                if i == len(highest):
-                    result += f"and {tup[0]} at {tup[1] - 1} votes."
-                else:
-                    result += f"{tup[0]}, "
-            return result, 0
+        if not VOTE_EARLY_CLOSE or target is None or target.voice is None or target.voice.channel is None:
+            return None
+        return len([member for member in target.voice.channel.members if not member.bot])
 
 
 class VotePoll(VoteCommand):
     """
 
     """
-    ID = 'poll'  # type: str
+    ID: str = 'poll'
 
     def __init__(self, client, child=True):
         super().__init__(client, child=True)
 
-    async def execute(self, message: discord.Message, vote_string=None):
-        msg, n_ans, duration = self.set_vote(message, vote_string)
-        num_winner = await self.send_message(message.channel, msg, n_ans, UNICODE_NUMS, duration=duration)
+    async def execute(self, invocation: Invocation):
+        msg, n_ans, duration = self.set_vote(invocation.message, invocation.rest)
+        await self.send_message(invocation.channel, msg, n_ans, UNICODE_NUMS, duration=duration)
 
     @staticmethod
-    def set_vote(message: discord.Message, vote_string: str) -> (str, int):
-        vote_string = vote_string.split('|')
-        question = vote_string[0].strip()
-        answers = vote_string[1].strip().split(', ')
+    def set_vote(message: discord.Message, vote_string: str) -> (str, int, int):
+        """
+        :return: What the bot will say in the chat channel, the number of answers and the poll duration. Both are
+        -1 if the vote is invalid, in which case the text says why.
+        """
         try:
-            duration = VoteCommand.interpret_time(vote_string[2].strip())
-        except IndexError:
-            duration = 60
-        if question == '':
-            return "You did not ask a question.", -1
-
-        result = f"Question: **{question}**\n" \
-                 f"Votes will be tallied in {duration} seconds.\n"
-        num_answers = len(answers)
-        if 1 < num_answers <= 10:
-            LOGGER.info(f"{message.author} Created poll: {question} with answer choices {answers}, "
-                        f"with duration {duration}")
-            answers = zip(NUMBERS, answers)
-        else:
+            poll = parse_poll(vote_string)
+        except VoteSyntaxError as e:
+            return str(e), -1, -1
+        duration = poll.duration if poll.duration is not None else 60
+        if duration <= 0:
+            return "Poll duration must be more than 0 seconds.", -1, -1
+        num_answers = len(poll.answers)
+        if not MIN_CHOICES < num_answers <= MAX_CHOICES:
             return "You may only have between 2 and 10 answer choices.", -1, -1
-        result += "".join([f"{i} {ans}\n" for i, ans in answers])
+        LOGGER.info(f"{message.author} Created poll: {poll.question} with answer choices {poll.answers}, "
+                    f"with duration {duration}")
+        result = f"Question: **{poll.question}**\n" \
+                 f"Votes will be tallied in {duration} seconds.\n"
+        result += "".join([f"{i} {ans}\n" for i, ans in zip(NUMBERS, poll.answers)])
         return result, num_answers, duration
 
 
@@ -175,16 +125,15 @@ class VoteMute(VoteCommand):
     """
 
     """
-    ID = 'mute'  # type: str
+    ID: str = 'mute'
 
     def __init__(self, client, child=True):
         super().__init__(client, child=True)
 
-    async def execute(self, message: discord.Message, vote_string=None):
-        msg, member, poll_duration, mute_duration = self.set_vote(message, vote_string)
-        num_winner = await self.send_message(message.channel, msg, 2, UNICODE_YES_NO, duration=poll_duration)
-        if num_winner == 1:
-            await UserYml.mute(member, mute_duration)
+    async def execute(self, invocation: Invocation):
+        msg, member, poll_duration, mute_duration = self.set_vote(invocation.message, invocation.rest)
+        await self.send_message(invocation.channel, msg, 2, UNICODE_YES_NO, duration=poll_duration, kind=MUTE,
+                                target=member, mute_duration=mute_duration)
 
     @staticmethod
     def set_vote(message: discord.Message, vote_string: str) -> (str, discord.Member, int, int):
@@ -193,7 +142,7 @@ class VoteMute(VoteCommand):
         Durations are optional and the command may conclude at {prefix} vote mute {user}
         If durations are omitted in this way, default values (1 minute for both) will be used.
         :param message: The discord.Message object that the user sent to call the vote
-        :param vote_string: The text string of the actual message minus the ACTIVATION_PREFIX and the word "vote"
+        :param vote_string: The text string of the actual message after `{prefix} vote mute`
         :return: What the bot will say in the chat channel.
         """
         if len(message.mentions) < 1:
@@ -204,19 +153,13 @@ class VoteMute(VoteCommand):
         if type(message.channel) != discord.TextChannel:
             return "This is not a valid command to run outside a server text channel.", None, -1, -1
 
-        member = message.mentions[0]  # type: discord.Member
-        mute_duration = 60
-        poll_duration = 60
-        if "for" in vote_string:
-            durations = vote_string.split('for')[1]
-            if "|" in vote_string:
-                durations = durations.split('|')
-                mute_duration = VoteCommand.interpret_time(durations[0])
-                poll_duration = VoteCommand.interpret_time(durations[1])
-            else:
-                mute_duration = VoteCommand.interpret_time(durations)
-        elif "|" in vote_string:
-            poll_duration = VoteCommand.interpret_time(vote_string.split('|')[1])
+        member: discord.Member = message.mentions[0]
+        try:
+            args = parse_mute(vote_string)
+        except VoteSyntaxError as e:
+            return str(e), None, -1, -1
+        mute_duration = args.duration if args.duration is not None else 60
+        poll_duration = args.poll_duration if args.poll_duration is not None else 60
 
         if poll_duration < 60:
             return "Poll duration must be at least 60 seconds.", None, -1, -1
@@ -231,17 +174,18 @@ class VoteUnmute(VoteCommand):
     """
 
     """
-    ID = 'unmute'  # type: str
+    ID: str = 'unmute'
 
     def __init__(self, client, child=True):
         super().__init__(client, child=True)
 
-    async def execute(self, message: discord.Message, vote_string=None):
-        msg, member = self.set_vote(message, vote_string)
+    async def execute(self, invocation: Invocation):
+        msg, member = self.set_vote(invocation.message, invocation.rest)
         if member is not None:
-            num_winner = await self.send_message(message.channel, msg, 2, UNICODE_YES_NO, duration=60)
-            if num_winner == 1:
-                await UserYml.unmute(member)
+            await self.send_message(invocation.channel, msg, 2, UNICODE_YES_NO, duration=60, kind=UNMUTE,
+                                    target=member)
+        else:
+            await self.send_message(invocation.channel, msg, 0, UNICODE_YES_NO)
 
     @staticmethod
     def set_vote(message: discord.Message, vote_string: str) -> (str, discord.Member):
@@ -253,7 +197,7 @@ class VoteUnmute(VoteCommand):
         if type(message.channel) != discord.TextChannel:
             return "This is not a valid command to run outside a server text channel.", None
 
-        member = message.mentions[0]  # type: discord.Member
+        member: discord.Member = message.mentions[0]
         if not UserYml.get_user_obj(member).is_muted():
             return "This user is not muted.", None
         LOGGER.info(f"{message.author} voted to unmute {member}")
@@ -265,12 +209,15 @@ class VoteBanish(VoteCommand):
     """
 
     """
-    ID = 'banish'  # type: str
+    ID: str = 'banish'
 
     def __init__(self, client, child=True):
         super().__init__(client, child=True)
-        self.question = ""  # type: str
-        self.answers = []  # type: List[str]
+        self.question: str = ""
+        self.answers: List[str] = []
+
+    async def execute(self, invocation: Invocation):
+        await send(invocation.channel, "Banish votes aren't available yet.")
 
     def set_vote(self, message: discord.Message, vote_string: str) -> discord.Member:
         pass
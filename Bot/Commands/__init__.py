@@ -0,0 +1,11 @@
+# Every top level command: ID -> 'module:Class'. The router and help command find commands here instead of through
+# Command.__subclasses__(), so a command's module (and whatever it imports) is only loaded the first time it's used.
+# Subcommands live in their parent's module and are loaded with it.
+COMMAND_MODULES = {
+    'default': 'Bot.Commands.DefaultCommand:DefaultCommand',
+    'help': 'Bot.Commands.HelpCommand:HelpCommand',
+    'vote': 'Bot.Commands.VoteCommand:VoteCommand',
+    'users': 'Bot.Commands.UsersCommand:UsersCommand',
+    'av': 'Bot.Commands.AVCommand:AVCommand',
+    'metrics': 'Bot.Commands.MetricsCommand:MetricsCommand',
+}
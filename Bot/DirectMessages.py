@@ -0,0 +1,73 @@
+import asyncio
+from typing import Dict, Iterable, Optional
+
+import discord
+
+from envs import LOGGER
+from Bot.RestScheduler import get_rest_scheduler, send
+
+
+class DMChannels(object):
+    """
+    DM channels of users the bot messages directly, resolved once and kept for the life of the process.
+
+    A user's DM channel is opened once, by id, and later messages go straight to it. Concurrent first lookups of
+    the same user share one request.
+    """
+
+    def __init__(self, client: discord.Client):
+        self.client = client
+        self._channels: Dict[int, discord.DMChannel] = {}
+        self.lookups = 0  # Requests made to open channels
+
+    def cached(self, uid: int) -> Optional[discord.DMChannel]:
+        return self._channels.get(uid)
+
+    async def get(self, uid: int) -> discord.DMChannel:
+        channel = self._channels.get(uid)
+        if channel is not None:
+            return channel
+        # Opening a DM only needs the user's id, so the user is never fetched. The client returns a channel it
+        # already knows without a request.
+        self.lookups += 1
+        channel = await get_rest_scheduler().submit(f"user:{uid}", self.client.create_dm, discord.Object(id=uid),
+                                                    key=("create_dm", uid))
+        self._channels[uid] = channel
+        return channel
+
+    def forget(self, uid: int):
+        """Drop a cached channel, e.g. after the user blocked the bot."""
+        self._channels.pop(uid, None)
+
+    async def send_all(self, uids: Iterable[int], message: str):
+        """
+        Send a message to every user at once. A user who can't be messaged is logged and skipped.
+        """
+        uids = list(uids)
+        channels = await asyncio.gather(*(self.get(uid) for uid in uids), return_exceptions=True)
+        sent = []
+        for uid, channel in zip(uids, channels):
+            if isinstance(channel, Exception):
+                LOGGER.error(f"Could not open a DM with {uid}: {channel}")
+            else:
+                sent.append((uid, send(channel, message)))
+        results = await asyncio.gather(*(future for _uid, future in sent), return_exceptions=True)
+        for (uid, _future), result in zip(sent, results):
+            if isinstance(result, Exception):
+                self.failed(uid, result)
+
+    def failed(self, uid: int, error: Exception):
+        LOGGER.error(f"DM to {uid} failed: {error}")
+        if isinstance(error, (discord.NotFound, discord.Forbidden)):
+            self.forget(uid)
+
+
+_dm_channels: Dict[discord.Client, DMChannels] = {}
+
+
+def get_dm_channels(client: discord.Client) -> DMChannels:
+    """Returns the DM channel cache of a client. Each bot in the process has its own DM channels."""
+    dm_channels = _dm_channels.get(client)
+    if dm_channels is None:
+        dm_channels = _dm_channels[client] = DMChannels(client)
+    return dm_channels
@@ -0,0 +1,302 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from envs import LOGGER, DRIVE_BACKEND, DRIVE_SYNC_DEBOUNCE, FAKE_DRIVE_DIR, FAKE_DRIVE_LATENCY, GRDN_SYNC, \
+    GRDN_JOURNAL_FILE_ID, GRDN_JOURNAL_COMPACT_OPS
+from Bot.Metrics import get_metrics
+
+DOWNLOAD = 'download'
+UPLOAD = 'upload'
+LOCAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'grdn_data.pkl')
+REVISION_FIELDS = ('md5Checksum', 'headRevisionId', 'modifiedTime')
+
+SYNC_SECONDS = get_metrics().histogram('bot_drive_sync_seconds', "Drive transfers run by the sync worker",
+                                       ('kind', 'outcome'))
+
+
+def revision_path(local_path: str) -> str:
+    return local_path + '.rev.json'
+
+
+def load_revision(local_path: str) -> Optional[Dict[str, str]]:
+    """Returns the Drive revision metadata the local copy was downloaded from or uploaded as, if known."""
+    try:
+        with open(revision_path(local_path)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_revision(local_path: str, revision: Dict[str, str]):
+    revision = {field: revision[field] for field in REVISION_FIELDS if field in revision}
+    tmp_path = revision_path(local_path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(revision, f)
+    os.replace(tmp_path, revision_path(local_path))
+
+
+def revision_changed(cached: Optional[Dict[str, str]], remote: Dict[str, str]) -> bool:
+    """
+    Compares cached and remote revision metadata. The checksum decides when both sides have one, otherwise any
+    difference in revision id or modified time counts as a change.
+    """
+    if not cached:
+        return True
+    if cached.get('md5Checksum') and remote.get('md5Checksum'):
+        return cached['md5Checksum'] != remote['md5Checksum']
+    return any(cached.get(field) != remote.get(field) for field in REVISION_FIELDS)
+
+
+class FakeDriveBackend(object):
+    """
+    Local stand-in for Google Drive. The "remote" file is a copy kept in another directory and every transfer
+    blocks for `latency` seconds, so the sync path can be exercised and benchmarked without network access.
+    Metadata requests are treated as a tenth of a transfer.
+    """
+
+    def __init__(self, local_path: str, remote_dir: str, latency: float = 0.5):
+        self.local_path = local_path
+        self.remote_path = os.path.join(remote_dir, os.path.basename(local_path))
+        self.latency = latency
+        self.downloads = 0
+        self.uploads = 0
+        self.metadata_requests = 0
+        os.makedirs(remote_dir, exist_ok=True)
+
+    def get_remote_revision(self) -> Dict[str, str]:
+        time.sleep(self.latency / 10)
+        self.metadata_requests += 1
+        if not os.path.exists(self.remote_path):
+            return {}
+        with open(self.remote_path, 'rb') as f:
+            md5 = hashlib.md5(f.read()).hexdigest()
+        modified = datetime.datetime.fromtimestamp(os.path.getmtime(self.remote_path), datetime.timezone.utc)
+        return {'md5Checksum': md5, 'headRevisionId': md5, 'modifiedTime': modified.isoformat()}
+
+    def download(self) -> bool:
+        remote = self.get_remote_revision()
+        if not remote or (os.path.exists(self.local_path) and
+                          not revision_changed(load_revision(self.local_path), remote)):
+            return False
+        time.sleep(self.latency)
+        self.downloads += 1
+        tmp_path = self.local_path + '.download'
+        shutil.copyfile(self.remote_path, tmp_path)
+        os.replace(tmp_path, self.local_path)
+        save_revision(self.local_path, remote)
+        return True
+
+    def upload(self):
+        time.sleep(self.latency)
+        self.uploads += 1
+        if os.path.exists(self.local_path):
+            shutil.copyfile(self.local_path, self.remote_path)
+            save_revision(self.local_path, self.get_remote_revision())
+
+
+class FakeRemoteFile(object):
+    """
+    One file of the fake Drive, for backends that keep several. Same latencies as FakeDriveBackend, and it counts
+    the bytes moved each way.
+    """
+
+    def __init__(self, remote_dir: str, name: str, latency: float = 0.5):
+        self.remote_path = os.path.join(remote_dir, name)
+        self.latency = latency
+        self.downloads = 0
+        self.uploads = 0
+        self.metadata_requests = 0
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+        os.makedirs(remote_dir, exist_ok=True)
+
+    def _revision(self) -> Dict[str, str]:
+        if not os.path.exists(self.remote_path):
+            return {}
+        with open(self.remote_path, 'rb') as f:
+            md5 = hashlib.md5(f.read()).hexdigest()
+        modified = datetime.datetime.fromtimestamp(os.path.getmtime(self.remote_path), datetime.timezone.utc)
+        return {'md5Checksum': md5, 'headRevisionId': md5, 'modifiedTime': modified.isoformat()}
+
+    def revision(self) -> Dict[str, str]:
+        """Revision metadata of the remote file, empty if it doesn't exist."""
+        time.sleep(self.latency / 10)
+        self.metadata_requests += 1
+        return self._revision()
+
+    def download(self, local_path: str):
+        time.sleep(self.latency)
+        self.downloads += 1
+        self.bytes_downloaded += os.path.getsize(self.remote_path)
+        shutil.copyfile(self.remote_path, local_path)
+
+    def upload(self, local_path: str) -> Dict[str, str]:
+        """Replaces the remote file. Returns the revision it now has."""
+        time.sleep(self.latency)
+        self.uploads += 1
+        self.bytes_uploaded += os.path.getsize(local_path)
+        shutil.copyfile(local_path, self.remote_path)
+        return self._revision()
+
+
+class DriveSyncWorker(object):
+    """
+    Runs Drive transfers on a single background thread so commands never block the event loop on a round trip.
+
+    Uploads are debounced: every request inside the debounce window shares one future and results in a single
+    upload of whatever is on disk when the window closes. Downloads are skipped while an upload is pending, since
+    the local copy is newer than the remote one at that point. Backends check the remote revision metadata first and
+    only transfer the file body when it differs from the cached revision.
+    """
+
+    def __init__(self, backend, debounce: float = 2.0):
+        self.backend = backend
+        self.debounce = debounce
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='drive-sync')
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending_upload: Optional[asyncio.Future] = None
+        self._upload_timer: Optional[asyncio.TimerHandle] = None
+        self._upload_queued = False
+        self._pending_download: Optional[asyncio.Future] = None
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of transfers waiting to run, including an upload still inside its debounce window."""
+        depth = self._queue.qsize() if self._queue is not None else 0
+        if self._upload_timer is not None:
+            depth += 1
+        return depth
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def request_download(self) -> asyncio.Future:
+        """
+        Schedule a download. Returns a future that resolves once the local copy is up to date, with True if a new
+        revision was transferred and False if the local copy already matched Drive.
+        """
+        self.start()
+        if self._pending_upload is not None:
+            self._dispatch_upload()
+            return asyncio.ensure_future(self._after_upload(self._pending_upload))
+        if self._pending_download is None:
+            self._pending_download = asyncio.get_running_loop().create_future()
+            self._queue.put_nowait((DOWNLOAD, self._pending_download))
+        return self._pending_download
+
+    def request_upload(self) -> asyncio.Future:
+        """
+        Schedule a debounced upload of the local file. Returns a future that resolves once the upload is done, with
+        True if the backend merged changes made elsewhere into the local copy on the way (see GrdnJournal).
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        if self._pending_upload is None:
+            self._pending_upload = loop.create_future()
+            # Failures are already logged by the worker, don't warn about callers that never awaited the result
+            self._pending_upload.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if self._upload_queued:
+            # Already waiting on the worker, it will pick up this change when it reads the file
+            return self._pending_upload
+        if self._upload_timer is not None:
+            self._upload_timer.cancel()
+        self._upload_timer = loop.call_later(self.debounce, self._dispatch_upload)
+        return self._pending_upload
+
+    @staticmethod
+    async def _after_upload(upload: asyncio.Future) -> bool:
+        return await upload
+
+    def _dispatch_upload(self):
+        if self._upload_timer is not None:
+            self._upload_timer.cancel()
+            self._upload_timer = None
+        if self._pending_upload is not None and not self._upload_queued:
+            self._upload_queued = True
+            self._queue.put_nowait((UPLOAD, self._pending_upload))
+
+    async def flush(self):
+        """Push out any debounced upload immediately and wait for everything queued to finish."""
+        if self._queue is None:
+            return
+        self._dispatch_upload()
+        await self._queue.join()
+
+    async def close(self):
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+        self._executor.shutdown(wait=False)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            kind, future = await self._queue.get()
+            # Anything requested from here on needs a new transfer
+            if kind == UPLOAD and future is self._pending_upload:
+                self._pending_upload = None
+                self._upload_queued = False
+            elif kind == DOWNLOAD and future is self._pending_download:
+                self._pending_download = None
+            func = self.backend.upload if kind == UPLOAD else self.backend.download
+            start = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(self._executor, func)
+                SYNC_SECONDS.observe(time.perf_counter() - start, kind, 'ok')
+                LOGGER.info(f"Drive {kind} finished in {time.perf_counter() - start:.3f}s")
+                if not future.done():
+                    future.set_result(bool(result))
+            except Exception as e:
+                SYNC_SECONDS.observe(time.perf_counter() - start, kind, 'error')
+                LOGGER.error(f"Drive {kind} failed: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+
+_worker: Optional[DriveSyncWorker] = None
+
+
+def journal_enabled() -> bool:
+    """Whether GRDN changes are synced as a journal. On Google Drive that needs a second file to keep it in."""
+    return GRDN_SYNC == 'journal' and (DRIVE_BACKEND == 'fake' or bool(GRDN_JOURNAL_FILE_ID))
+
+
+def get_sync_worker() -> DriveSyncWorker:
+    """Returns the process-wide sync worker, creating it for the configured backend on first use."""
+    global _worker
+    if _worker is None:
+        if journal_enabled():
+            from Bot.GrdnJournal import JournalBackend, journal_path
+            if DRIVE_BACKEND == 'fake':
+                snapshot = FakeRemoteFile(FAKE_DRIVE_DIR, os.path.basename(LOCAL_PATH), FAKE_DRIVE_LATENCY)
+                journal = FakeRemoteFile(FAKE_DRIVE_DIR, os.path.basename(journal_path(LOCAL_PATH)),
+                                         FAKE_DRIVE_LATENCY)
+            else:
+                from Bot.GoogleDataRetrieval import FILE_ID, GoogleRemoteFile
+                snapshot, journal = GoogleRemoteFile(FILE_ID), GoogleRemoteFile(GRDN_JOURNAL_FILE_ID)
+            backend = JournalBackend(snapshot, journal, LOCAL_PATH, GRDN_JOURNAL_COMPACT_OPS)
+        elif DRIVE_BACKEND == 'fake':
+            backend = FakeDriveBackend(LOCAL_PATH, FAKE_DRIVE_DIR, FAKE_DRIVE_LATENCY)
+        else:
+            from Bot.GoogleDataRetrieval import GoogleDriveBackend
+            backend = GoogleDriveBackend()
+        _worker = DriveSyncWorker(backend, debounce=DRIVE_SYNC_DEBOUNCE)
+    return _worker
+
+
+async def close_sync_worker():
+    """Close the worker if anything in this process used it, without creating (and importing) a backend."""
+    if _worker is not None:
+        await _worker.close()
@@ -1,9 +1,12 @@
 import os.path
+from typing import Dict, Optional
 
 from google.oauth2 import service_account
 from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
 from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+
+from Bot.DriveSync import REVISION_FIELDS, load_revision, save_revision, revision_changed
+from Bot.Metrics import get_metrics
 
 # If modifying these scopes, delete the file token.json.
 SERVICE_ACCOUNT_FILE = "google-service-credentials.json"
@@ -12,44 +15,126 @@ FILE_ID = "1xVfyq3cHMN65bWkSEddWLdiokEuvPppH"
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 OUTPUT_PATH = os.path.join(BASE_DIR, 'data', 'grdn_data.pkl')
 
+# Time spent in each Drive API call, without the worker's queueing
+REQUEST_SECONDS = get_metrics().histogram('bot_drive_request_seconds', "Drive API calls", ('call',))
+
+_service = None
+
+
+def get_service():
+    """
+    Builds the Drive service once and reuses it. Building it means reading the credentials file and running the
+    discovery machinery, which costs about as much as the transfer itself.
+    """
+    global _service
+    if _service is None:
+        creds = service_account.Credentials.from_service_account_file(
+            SERVICE_ACCOUNT_FILE,
+            scopes=SCOPES
+        )
+        _service = build("drive", "v3", credentials=creds)
+    return _service
+
 
-def download_pickle():
-    creds = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE,
-        scopes=["https://www.googleapis.com/auth/drive"]
-    )
+def get_remote_revision() -> Dict[str, str]:
+    """Fetches only the revision metadata of the Drive file, which is much cheaper than the file itself."""
+    with REQUEST_SECONDS.time('revision'):
+        return get_service().files().get(fileId=FILE_ID, fields=",".join(REVISION_FIELDS)).execute()
 
-    service = build("drive", "v3", credentials=creds)
+
+def download_pickle(revision: Optional[Dict[str, str]] = None):
+    """
+    Downloads the Drive file into a temp file and renames it over OUTPUT_PATH once complete, then records the
+    revision it came from.
+    :param revision: Revision metadata for the download, if already fetched.
+    """
+    service = get_service()
+    if revision is None:
+        revision = get_remote_revision()
 
     request = service.files().get_media(fileId=FILE_ID)
-    fh = open(OUTPUT_PATH, "wb")
+    tmp_path = OUTPUT_PATH + ".download"
+    fh = open(tmp_path, "wb")
 
     downloader = MediaIoBaseDownload(fh, request)
 
     done = False
-    while not done:
-        status, done = downloader.next_chunk()
+    with REQUEST_SECONDS.time('download'):
+        while not done:
+            status, done = downloader.next_chunk()
 
     fh.close()
+    os.replace(tmp_path, OUTPUT_PATH)
+    save_revision(OUTPUT_PATH, revision)
     print("Downloaded:", OUTPUT_PATH)
 
 
-def upload_pickle():
-    creds = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE,
-        scopes=["https://www.googleapis.com/auth/drive"]
-    )
+def download_pickle_if_changed() -> bool:
+    """
+    Downloads the Drive file only if its revision differs from the one the local copy came from.
+    :return: True if a new revision was downloaded.
+    """
+    remote = get_remote_revision()
+    if os.path.exists(OUTPUT_PATH) and not revision_changed(load_revision(OUTPUT_PATH), remote):
+        return False
+    download_pickle(remote)
+    return True
+
 
-    service = build("drive", "v3", credentials=creds)
+def upload_pickle():
+    service = get_service()
     print("Uploading: ", OUTPUT_PATH)
     if os.path.exists(OUTPUT_PATH):
         print("Path exists")
         print("Size: ", os.path.getsize(OUTPUT_PATH))
         media = MediaFileUpload(OUTPUT_PATH, mimetype="application/octet-stream")
 
-    updated = service.files().update(
-        fileId=FILE_ID,
-        media_body=media
-    ).execute()
+    with REQUEST_SECONDS.time('upload'):
+        updated = service.files().update(
+            fileId=FILE_ID,
+            media_body=media,
+            fields=",".join(("id",) + REVISION_FIELDS)
+        ).execute()
+    # What we just uploaded is what's on Drive now, so the next check shouldn't download it again
+    save_revision(OUTPUT_PATH, updated)
 
     print("Updated remote file:", updated["id"])
+
+
+class GoogleRemoteFile(object):
+    """One Drive file, for backends that keep several. Every call blocks, like GoogleDriveBackend's."""
+
+    def __init__(self, file_id: str):
+        self.file_id = file_id
+
+    def revision(self) -> Dict[str, str]:
+        with REQUEST_SECONDS.time('revision'):
+            return get_service().files().get(fileId=self.file_id, fields=",".join(REVISION_FIELDS)).execute()
+
+    def download(self, local_path: str):
+        request = get_service().files().get_media(fileId=self.file_id)
+        with open(local_path, "wb") as fh:
+            downloader = MediaIoBaseDownload(fh, request)
+            done = False
+            with REQUEST_SECONDS.time('download'):
+                while not done:
+                    status, done = downloader.next_chunk()
+
+    def upload(self, local_path: str) -> Dict[str, str]:
+        """Replaces the file's content. Returns the revision it now has."""
+        media = MediaFileUpload(local_path, mimetype="application/octet-stream")
+        with REQUEST_SECONDS.time('upload'):
+            return get_service().files().update(fileId=self.file_id, media_body=media,
+                                                fields=",".join(("id",) + REVISION_FIELDS)).execute()
+
+
+class GoogleDriveBackend(object):
+    """
+    Drive backend used by the sync worker. Both calls block, so they must only be run from the worker's executor.
+    """
+
+    def download(self) -> bool:
+        return download_pickle_if_changed()
+
+    def upload(self):
+        upload_pickle()
@@ -0,0 +1,136 @@
+import bisect
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> Set[str]:
+    return set(_WORD.findall(text.lower()))
+
+
+def trigrams(key: str) -> Set[str]:
+    padded = f"  {key.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class GrdnIndex(object):
+    """
+    Search structures over the GRDN knowledge base, kept up to date one entry at a time.
+
+    - An inverted index from each word to the keys whose key or text contain it, for `search`.
+    - The keys in sorted order, for prefix completion by binary search.
+    - An index from each key trigram to the keys containing it, for fuzzy completion. Only keys sharing a trigram
+      with the query are compared, rather than every key.
+
+    Adding, changing or removing an entry only touches that entry's words and trigrams.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = {}
+        self._words: Dict[str, Set[str]] = {}
+        self._key_words: Dict[str, Set[str]] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        self._key_grams: Dict[str, Set[str]] = {}
+        self._sorted_keys: List[str] = []
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, key: str):
+        return key in self._words
+
+    @classmethod
+    def build(cls, data: Dict[str, str]) -> 'GrdnIndex':
+        index = cls()
+        for key, value in data.items():
+            index.put(key, value)
+        return index
+
+    def put(self, key: str, value: str):
+        """Index a new entry, or re-index the text of an existing one."""
+        key_words = tokenize(key)
+        words = key_words | tokenize(value)
+        old = self._words.get(key)
+        if old is None:
+            bisect.insort(self._sorted_keys, key)
+            grams = trigrams(key)
+            for gram in grams:
+                self._grams.setdefault(gram, set()).add(key)
+            self._key_grams[key] = grams
+            old = set()
+        for word in old - words:
+            self._discard(word, key)
+        for word in words - old:
+            self._postings.setdefault(word, set()).add(key)
+        self._words[key] = words
+        self._key_words[key] = key_words
+
+    def remove(self, key: str):
+        words = self._words.pop(key, None)
+        if words is None:
+            return
+        del self._key_words[key]
+        for word in words:
+            self._discard(word, key)
+        for gram in self._key_grams.pop(key):
+            keys = self._grams.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._grams[gram]
+        del self._sorted_keys[bisect.bisect_left(self._sorted_keys, key)]
+
+    def _discard(self, word: str, key: str):
+        keys = self._postings.get(word)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._postings[word]
+
+    def search(self, query: str, visible: Optional[Set[str]] = None, limit=10) -> List[str]:
+        """
+        Keys whose key or text contain the words of `query`, best first. Each word scores two points if it's in
+        the key itself and one if it's only in the text. Ties are alphabetical.
+        :param visible: Only return these keys, if given.
+        """
+        scores: Dict[str, int] = {}
+        for word in tokenize(query):
+            for key in self._postings.get(word, ()):
+                if visible is None or key in visible:
+                    # Two points for a word in the key itself, one for a word in its text
+                    scores[key] = scores.get(key, 0) + (2 if word in self._key_words[key] else 1)
+        return [key for key, _score in sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]]
+
+    def complete(self, prefix: str, visible: Optional[Set[str]] = None, limit=10) -> List[str]:
+        """Keys starting with `prefix`, in order."""
+        result = []
+        i = bisect.bisect_left(self._sorted_keys, prefix)
+        while i < len(self._sorted_keys) and len(result) < limit:
+            key = self._sorted_keys[i]
+            if not key.startswith(prefix):
+                break
+            if visible is None or key in visible:
+                result.append(key)
+            i += 1
+        return result
+
+    def fuzzy(self, text: str, visible: Optional[Set[str]] = None, limit=5, cutoff=0.3) -> List[str]:
+        """Keys that look like `text`, by trigram similarity, most similar first."""
+        grams = trigrams(text)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for key in self._grams.get(gram, ()):
+                shared[key] = shared.get(key, 0) + 1
+        scored: List[Tuple[float, str]] = []
+        for key, count in shared.items():
+            if visible is not None and key not in visible:
+                continue
+            similarity = count / (len(grams) + len(self._key_grams[key]) - count)  # Jaccard
+            if similarity >= cutoff:
+                scored.append((-similarity, key))
+        return [key for _similarity, key in sorted(scored)[:limit]]
+
+    def suggest(self, text: str, visible: Optional[Set[str]] = None, limit=5) -> List[str]:
+        """Prefix matches if there are any, otherwise fuzzy matches. For "did you mean" replies."""
+        return self.complete(text, visible, limit) or self.fuzzy(text, visible, limit)
@@ -0,0 +1,279 @@
+import itertools
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from envs import LOGGER
+from Bot.DriveSync import load_revision, save_revision, revision_changed
+
+DATA_KEY = "data"
+KNOWN_DATA_KEY = "known_data"
+# Ids of the journal entries a snapshot already contains, so they aren't applied twice
+FOLDED_KEY = "journal_folded"
+
+ADD = 'add'
+APPEND = 'append'
+REPLACE = 'replace'
+DELETE = 'delete'
+REVEAL = 'reveal'
+
+# Entry ids are unique across bot instances, so journals from several of them can be merged
+_instance = uuid.uuid4().hex[:12]
+_sequence = itertools.count()
+
+# The store appends to the local journal from the event loop's executor while the sync worker merges and compacts
+# it on its own thread
+journal_lock = threading.RLock()
+
+
+def make_op(kind: str, key: str, value: str = None, hidden=False) -> Dict:
+    op = {'id': f"{_instance}-{next(_sequence)}", 'ts': time.time(), 'op': kind, 'key': key}
+    if value is not None:
+        op['value'] = value
+    if hidden:
+        op['hidden'] = True
+    return op
+
+
+def apply_op(data: Dict[str, str], known: Set[str], op: Dict) -> bool:
+    """
+    Applies one journal entry to a knowledge base. Entries that no longer fit, like an append to a key another
+    instance deleted in the meantime, are skipped.
+    :return: Whether the entry was applied.
+    """
+    kind, key = op['op'], op['key']
+    if kind == ADD:
+        if key in data:
+            return False
+        data[key] = op['value']
+        if not op.get('hidden'):
+            known.add(key)
+        return True
+    if key not in data:
+        return False
+    if kind == APPEND:
+        data[key] = data[key] + " " + op['value']
+    elif kind == REPLACE:
+        data[key] = op['value']
+    elif kind == DELETE:
+        del data[key]
+        known.discard(key)
+    elif kind == REVEAL:
+        known.add(key)
+    else:
+        return False
+    return True
+
+
+def ordered(ops: Iterable[Dict]) -> List[Dict]:
+    """Entries in the order they were made, whichever instance made them."""
+    return sorted(ops, key=lambda op: (op['ts'], op['id']))
+
+
+def read_journal(path: str) -> List[Dict]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+    ops = []
+    for line in lines:
+        try:
+            ops.append(json.loads(line))
+        except ValueError:
+            # The end of an append cut short by a crash, the rest of the journal is still good
+            LOGGER.warning(f"Skipping unreadable line in {path}")
+    return ops
+
+
+def encode_ops(ops: Iterable[Dict]) -> bytes:
+    return "".join(json.dumps(op) + "\n" for op in ops).encode('utf-8')
+
+
+def append_journal(path: str, ops: List[Dict]):
+    """Appends entries to the local journal and syncs them to disk. Costs the size of the entries."""
+    payload = encode_ops(ops)
+    with journal_lock:
+        with open(path, 'ab') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def write_atomic(path: str, payload: bytes):
+    """Writes a file to a temp file in the same directory and renames it over the old one."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.grdn-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_snapshot(path: str) -> Dict:
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        snapshot = {}
+    snapshot.setdefault(DATA_KEY, {})
+    return snapshot
+
+
+def replay(snapshot: Dict, ops: Iterable[Dict]) -> Tuple[Dict[str, str], Set[str]]:
+    """The knowledge base a snapshot and the journal entries it doesn't already contain add up to."""
+    folded = set(snapshot.get(FOLDED_KEY, ()))
+    data = dict(snapshot[DATA_KEY])
+    known = set(snapshot.get(KNOWN_DATA_KEY, []))
+    for op in ordered(ops):
+        if op['id'] not in folded:
+            apply_op(data, known, op)
+    return data, known
+
+
+def journal_path(snapshot_path: str) -> str:
+    return os.path.splitext(snapshot_path)[0] + '.journal'
+
+
+class JournalBackend(object):
+    """
+    Sync worker backend for GRDN's snapshot and journal layout.
+
+    Drive holds two files: the pickle snapshot and a journal of the changes made since it was written, one JSON entry
+    per line. Uploading a change only uploads the journal, so its cost grows with the changes made since the last
+    compaction rather than with the knowledge base. Once the journal holds `compact_ops` entries they are folded into
+    a new snapshot and the journal starts over.
+
+    Drive's API can't make an update conditional on the revision it replaces, so every write checks the remote
+    revisions first. If another instance or a manual edit changed either file since this one last saw it, the remote
+    side is downloaded and merged before anything is written: journals are merged by entry id and a new snapshot
+    becomes the base local entries are replayed on. An overwrite in the moment between check and write is repaired
+    the same way by the next sync of the instance that lost its entries, since it keeps them until a snapshot
+    contains them.
+    """
+
+    def __init__(self, snapshot_remote, journal_remote, snapshot_path: str, compact_ops: int = 500):
+        """
+        :param snapshot_remote: Remote snapshot file, e.g. a FakeRemoteFile or GoogleRemoteFile.
+        :param journal_remote: Remote journal file.
+        :param snapshot_path: Local snapshot. The local journal is kept next to it.
+        :param compact_ops: Journal entries to fold into a new snapshot at once.
+        """
+        self.snapshot_remote = snapshot_remote
+        self.journal_remote = journal_remote
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path(snapshot_path)
+        self.compact_ops = compact_ops
+        self._uploaded: Optional[Set[str]] = None  # Entry ids in the remote journal as of the last upload
+
+    def _pull(self) -> bool:
+        """
+        Brings remote changes into the local snapshot and journal.
+        :return: Whether there were any.
+        """
+        changed = False
+        remote = self.snapshot_remote.revision()
+        if remote and (not os.path.exists(self.snapshot_path) or
+                       revision_changed(load_revision(self.snapshot_path), remote)):
+            download_path = self.snapshot_path + '.download'
+            self.snapshot_remote.download(download_path)
+            with journal_lock:
+                os.replace(download_path, self.snapshot_path)
+                save_revision(self.snapshot_path, remote)
+                # Someone compacted. Entries the new snapshot contains are done with.
+                folded = set(load_snapshot(self.snapshot_path).get(FOLDED_KEY, ()))
+                ops = read_journal(self.journal_path)
+                write_atomic(self.journal_path, encode_ops(op for op in ops if op['id'] not in folded))
+            self._uploaded = None
+            changed = True
+        elif not remote and os.path.exists(self.snapshot_path):
+            # Nothing on Drive yet, ours is the base everyone else's entries apply to
+            save_revision(self.snapshot_path, self.snapshot_remote.upload(self.snapshot_path))
+
+        remote = self.journal_remote.revision()
+        if remote and revision_changed(load_revision(self.journal_path), remote):
+            download_path = self.journal_path + '.download'
+            self.journal_remote.download(download_path)
+            theirs = read_journal(download_path)
+            os.remove(download_path)
+            folded = set(load_snapshot(self.snapshot_path).get(FOLDED_KEY, ()))
+            with journal_lock:
+                ours = read_journal(self.journal_path)
+                seen = {op['id'] for op in ours} | folded
+                new = [op for op in theirs if op['id'] not in seen]
+                if new:
+                    write_atomic(self.journal_path, encode_ops(ordered(ours + new)))
+                    changed = True
+                save_revision(self.journal_path, remote)
+            self._uploaded = {op['id'] for op in theirs}
+        return changed
+
+    def _push_journal(self, ops: List[Dict]):
+        """Uploads the local journal if it has entries the remote one lacks."""
+        ids = {op['id'] for op in ops}
+        if ids == self._uploaded:
+            return
+        upload_path = self.journal_path + '.upload'
+        with open(upload_path, 'wb') as f:
+            f.write(encode_ops(ops))
+        try:
+            save_revision(self.journal_path, self.journal_remote.upload(upload_path))
+        finally:
+            os.remove(upload_path)
+        self._uploaded = ids
+
+    def download(self) -> bool:
+        return self._pull()
+
+    def upload(self) -> bool:
+        """
+        Merges remote changes, then uploads the journal, compacting it if it has grown long enough.
+        :return: Whether remote changes were merged, in which case the store needs to reload.
+        """
+        merged = self._pull()
+        with journal_lock:
+            ops = read_journal(self.journal_path)
+        self._push_journal(ops)
+        if len(ops) >= self.compact_ops:
+            merged = self.compact() or merged
+        return merged
+
+    def compact(self) -> bool:
+        """
+        Folds the journal into a new snapshot, uploads it and empties the journal.
+        :return: Whether remote changes were merged first.
+        """
+        merged = self._pull()
+        with journal_lock:
+            snapshot = load_snapshot(self.snapshot_path)
+            ops = read_journal(self.journal_path)
+            data, known = replay(snapshot, ops)
+            # Earlier ids are kept for a while, for instances whose journals still hold them
+            folded = list(snapshot.get(FOLDED_KEY, ()))[-self.compact_ops * 9:] + [op['id'] for op in ops]
+            snapshot.update({DATA_KEY: data, KNOWN_DATA_KEY: sorted(known), FOLDED_KEY: folded})
+            compact_path = self.snapshot_path + '.compact'
+            write_atomic(compact_path, pickle.dumps(snapshot))
+        # If the remote journal was emptied first, entries only it held would be lost if the snapshot upload failed.
+        # The other way round, a crash in between leaves a journal whose entries the snapshot says it contains.
+        revision = self.snapshot_remote.upload(compact_path)
+        with journal_lock:
+            os.replace(compact_path, self.snapshot_path)
+            save_revision(self.snapshot_path, revision)
+            folded = set(folded)
+            rest = [op for op in read_journal(self.journal_path) if op['id'] not in folded]
+            write_atomic(self.journal_path, encode_ops(rest))
+        self._uploaded = None
+        self._push_journal(rest)
+        LOGGER.info(f"Compacted {len(ops)} GRDN journal entries into a snapshot of {len(data)} keys")
+        return merged
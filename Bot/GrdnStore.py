@@ -0,0 +1,235 @@
+import asyncio
+import os
+import pickle
+from typing import Dict, List, Optional, Set
+
+from envs import LOGGER, GRDN_FLUSH_INTERVAL
+from Bot.DriveSync import get_sync_worker, journal_enabled
+from Bot.GrdnIndex import GrdnIndex
+from Bot.GrdnJournal import DATA_KEY, KNOWN_DATA_KEY, ADD, APPEND, REPLACE, DELETE, REVEAL, journal_lock, \
+    journal_path, make_op, read_journal, append_journal, write_atomic, load_snapshot, replay
+
+GRDN_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'grdn_data.pkl')
+
+
+class GrdnStore(object):
+    """
+    Process-wide, in-memory copy of the GRDN knowledge base.
+
+    The pickle is loaded once and every read is served from memory. Mutations only mark the store dirty; a
+    background task writes the pickle atomically (temp file + rename) every `flush_interval` seconds and on
+    shutdown, then hands the file to the Drive sync worker. All mutations are plain synchronous calls on the event
+    loop, so two commands can no longer interleave a read-modify-write of the same file.
+
+    Known keys are held as a set (the pickle still stores a list) and every entry is indexed for search and key
+    completion. Both are built when the pickle is loaded and then updated by each mutation.
+
+    With `journal` set the pickle is only a snapshot. Each mutation is recorded as an entry that the flush appends to
+    a journal next to it, and the sync worker uploads the journal and folds it into the snapshot (see GrdnJournal).
+    """
+
+    def __init__(self, path: str = GRDN_DATA_PATH, flush_interval: float = 5.0, journal=False):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.journal = journal
+        self.journal_path = journal_path(path)
+        self._data_dict: Optional[Dict] = None
+        self._known: Set[str] = set()
+        self._index = GrdnIndex()
+        self._pending: List[Dict] = []  # Journal entries not yet flushed
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty
+
+    @property
+    def data(self) -> Dict[str, str]:
+        return self._load()[DATA_KEY]
+
+    @property
+    def known_data(self) -> Set[str]:
+        self._load()
+        return self._known
+
+    @property
+    def index(self) -> GrdnIndex:
+        self._load()
+        return self._index
+
+    def _load(self) -> Dict:
+        if self._data_dict is None:
+            self.reload()
+        return self._data_dict
+
+    def reload(self):
+        """
+        Re-read the pickle and journal from disk, e.g. after a download replaced them. Unflushed changes are kept
+        on top when journaling and discarded otherwise.
+        """
+        with journal_lock:
+            data_dict = load_snapshot(self.path)
+            ops = read_journal(self.journal_path)
+        if not self.journal:
+            # Left over from running with the journal, the next flush writes it into the pickle
+            self._dirty = bool(ops)
+        data, self._known = replay(data_dict, ops + self._pending)
+        data_dict[DATA_KEY] = data
+        data_dict.pop(KNOWN_DATA_KEY, None)
+        self._index = GrdnIndex.build(data)
+        self._data_dict = data_dict
+        if self.journal:
+            self._dirty = bool(self._pending)
+
+    def _record(self, kind: str, key: str, value: str = None, hidden=False):
+        if self.journal:
+            self._pending.append(make_op(kind, key, value, hidden))
+        self._dirty = True
+
+    def get(self, key: str) -> Optional[str]:
+        return self.data.get(key)
+
+    def is_known(self, key: str) -> bool:
+        return key in self.known_data
+
+    def hidden_keys(self) -> List[str]:
+        known = self.known_data
+        return [key for key in self.data if key not in known]
+
+    def search(self, query: str, include_hidden=False, limit=10) -> List[str]:
+        """Keys whose key or text contain the words in `query`, best match first."""
+        return self.index.search(query, None if include_hidden else self.known_data, limit)
+
+    def suggest(self, key: str, include_hidden=False, limit=5) -> List[str]:
+        """Keys starting with `key`, or failing that keys that look like it."""
+        return self.index.suggest(key, None if include_hidden else self.known_data, limit)
+
+    def add(self, key: str, value: str, hidden=False) -> bool:
+        """Add a new key. Returns False if the key already exists."""
+        if key in self.data:
+            return False
+        self.data[key] = value
+        self._index.put(key, value)
+        if not hidden:
+            self._known.add(key)
+        self._record(ADD, key, value, hidden)
+        return True
+
+    def append(self, key: str, value: str):
+        """Append text to an existing key. Raises KeyError if the key doesn't exist."""
+        self.data[key] = self.data[key] + " " + value
+        self._index.put(key, self.data[key])
+        self._record(APPEND, key, value)
+
+    def replace(self, key: str, value: str):
+        """Replace the text of an existing key. Raises KeyError if the key doesn't exist."""
+        if key not in self.data:
+            raise KeyError(key)
+        self.data[key] = value
+        self._index.put(key, value)
+        self._record(REPLACE, key, value)
+
+    def delete(self, key: str):
+        """Delete a key. Raises KeyError if the key doesn't exist."""
+        del self.data[key]
+        self._index.remove(key)
+        self._known.discard(key)
+        self._record(DELETE, key)
+
+    def reveal(self, key: str) -> bool:
+        """Mark a key as known. Returns False if it already was. Raises KeyError if the key doesn't exist."""
+        if key not in self.data:
+            raise KeyError(key)
+        if key in self.known_data:
+            return False
+        self._known.add(key)
+        self._record(REVEAL, key)
+        return True
+
+    def flush(self) -> bool:
+        """
+        Write the store to disk if it has changed. When journaling only the new entries are appended to the journal.
+        Otherwise the pickle is written to a temp file in the same directory and renamed over the old one, so readers
+        never see a half written file.
+        :return: True if anything was written.
+        """
+        if not self._dirty:
+            return False
+        self._write(self._dump())
+        self._dirty = False
+        return True
+
+    def _dump(self):
+        if self.journal:
+            ops, self._pending = self._pending, []
+            return ops
+        return pickle.dumps({**self._data_dict, KNOWN_DATA_KEY: sorted(self._known)})
+
+    def _write(self, payload):
+        if self.journal:
+            append_journal(self.journal_path, payload)
+            return
+        with journal_lock:
+            write_atomic(self.path, payload)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+    async def flush_async(self) -> bool:
+        """Like flush, but the disk write happens in an executor. The snapshot is taken on the event loop."""
+        if not self._dirty:
+            return False
+        payload = self._dump()
+        self._dirty = False
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, payload)
+        except Exception:
+            if self.journal:
+                self._pending[:0] = payload
+            self._dirty = True
+            raise
+        return True
+
+    def _upload(self):
+        get_sync_worker().request_upload().add_done_callback(self._uploaded)
+
+    def _uploaded(self, upload: asyncio.Future):
+        # The upload merged entries made by another instance, or a snapshot someone else wrote
+        if not upload.cancelled() and upload.exception() is None and upload.result():
+            self.reload()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                if await self.flush_async():
+                    self._upload()
+            except Exception as e:
+                LOGGER.error(f"GRDN flush failed: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self.flush():
+            self._upload()
+
+
+_store: Optional[GrdnStore] = None
+
+
+def get_grdn_store() -> GrdnStore:
+    """Returns the process-wide GRDN store."""
+    global _store
+    if _store is None:
+        _store = GrdnStore(flush_interval=GRDN_FLUSH_INTERVAL, journal=journal_enabled())
+    return _store
+
+
+async def close_grdn_store():
+    """Close the store if anything in this process used it."""
+    if _store is not None:
+        await _store.close()
@@ -0,0 +1,288 @@
+import asyncio
+import glob
+import gzip
+import json
+import os
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import discord
+
+from envs import LOGGER, DATETIME_DEFAULT, GUILD_ARCHIVE_DIR, GUILD_ARCHIVE_DAYS, GUILD_LIFECYCLE_INTERVAL
+from Bot.BotHost import all_clients_ready, find_guild, hosted_guilds
+from Bot.UserCodec import make_user
+from Bot.UserStore import UserStore, get_user_store
+from Bot.GuildReload import cancel_reload, reconcile_guild
+from Bot.MemberCache import get_member_cache, lazy_members
+from Bot.MuteScheduler import get_mute_scheduler, UNMUTE, UNDEAFEN
+from Bot.PollRegistry import get_poll_registry
+from Bot.Sharding import get_shard_plan
+
+ARCHIVE_FORMAT = 1
+
+# Archiving, purging and compaction run here, one at a time, next to the store but off the event loop
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='guild-lifecycle')
+
+
+def write_archive(store: UserStore, guild_id: int, archive_dir: str = GUILD_ARCHIVE_DIR) -> str:
+    """
+    Writes a guild's member records and polls to one gzipped JSON bundle.
+    :param store: Backend to read from. Called from the lifecycle executor, so not the cached store.
+    :return: The bundle's path.
+    """
+    users = store.users(guild_id)
+    bundle = {
+        'format': ARCHIVE_FORMAT,
+        'guild_id': guild_id,
+        'archived_at': datetime.now().isoformat(),
+        'users': [[user.name, user.uid, user.muted.isoformat(), user.deafened.isoformat()] for user in users],
+        'polls': [poll for poll in store.polls() if poll.get('guild_id') == guild_id],
+    }
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{guild_id}-{datetime.now():%Y%m%dT%H%M%S}.json.gz")
+    with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+        json.dump(bundle, f)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def read_archive(path: str) -> Dict:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        bundle = json.load(f)
+    if bundle.get('format') != ARCHIVE_FORMAT:
+        raise ValueError(f"{path} is not a guild archive this version can read")
+    return bundle
+
+
+def restore_archive(store: UserStore, path: str) -> Dict:
+    """Puts an archived guild's records and polls back. Returns the bundle."""
+    bundle = read_archive(path)
+    guild_id = bundle['guild_id']
+    store.put_many(guild_id, [make_user(name, uid, datetime.fromisoformat(muted), datetime.fromisoformat(deafened))
+                              for name, uid, muted, deafened in bundle['users']])
+    for poll in bundle['polls']:
+        store.put_poll(poll['message_id'], poll)
+    return bundle
+
+
+def left_marker_path(guild_id: int, archive_dir: str = GUILD_ARCHIVE_DIR) -> str:
+    return os.path.join(archive_dir, f"{guild_id}.left")
+
+
+def mark_left(guild_id: int, removed: bool, archive_dir: str = GUILD_ARCHIVE_DIR):
+    """
+    Records that the bot isn't in a guild any more, so a later pass can archive it.
+    :param removed: Whether Discord said so (on_guild_remove), rather than the guild only being found missing.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    with open(left_marker_path(guild_id, archive_dir), 'w') as f:
+        json.dump({'since': time.time(), 'removed': removed}, f)
+
+
+def left_markers(archive_dir: str = GUILD_ARCHIVE_DIR) -> Dict[int, Dict]:
+    """Every guild's left marker, by guild id."""
+    markers = {}
+    for path in glob.glob(os.path.join(archive_dir, "*.left")):
+        try:
+            with open(path) as f:
+                markers[int(os.path.basename(path).split('.')[0])] = json.load(f)
+        except (OSError, ValueError):
+            pass
+    return markers
+
+
+def clear_left(guild_id: int, archive_dir: str = GUILD_ARCHIVE_DIR):
+    try:
+        os.remove(left_marker_path(guild_id, archive_dir))
+    except FileNotFoundError:
+        pass
+
+
+def guild_archives(guild_id: int = None, archive_dir: str = GUILD_ARCHIVE_DIR) -> List[str]:
+    """Archive bundles, oldest first, of one guild or of every guild."""
+    pattern = f"{guild_id}-*.json.gz" if guild_id is not None else "*-*.json.gz"
+    return sorted(glob.glob(os.path.join(archive_dir, pattern)))
+
+
+class GuildLifecycle(object):
+    """
+    Keeps member state proportional to the guilds the bot is in and the members they have.
+
+    When the bot leaves a guild, the guild's state is written to an archive bundle and deleted from the store.
+    Rejoining within `retention` seconds puts it back, so saved mutes survive a kick and re-invite. Every `interval`
+    seconds a pass:
+    - archives guilds the store still has but the bot left while it was offline
+    - deletes archives older than `retention`
+    - drops records of members who left, as `users reload safe` does (not with MEMBER_CACHE=lazy)
+    - compacts the store a step at a time
+
+    Store reads and writes run on the lifecycle executor, the event loop only waits on them. A guild counts as left
+    once none of the bots the process hosts is in it. Not finding a guild isn't enough to archive it, since a client
+    that failed to log in or hasn't received its guilds yet finds none. A guild is archived once Discord said the bot
+    was removed, which leaves a marker until the archive is written, or once it was missing on two passes in a row
+    while every client was ready.
+    """
+
+    def __init__(self, archive_dir: str = GUILD_ARCHIVE_DIR, retention: float = GUILD_ARCHIVE_DAYS * 86400,
+                 interval: float = GUILD_LIFECYCLE_INTERVAL):
+        self.archive_dir = archive_dir
+        self.retention = retention
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, delay: float = 600):
+        """Run a pass `delay` seconds from now, then every `interval` seconds."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(delay))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self, delay: float):
+        await asyncio.sleep(delay)
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                LOGGER.error(f"Guild lifecycle pass failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def _in_executor(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+    async def archive(self, guild_id: int) -> str:
+        """Archive a guild's state and delete it from the store."""
+        store = get_user_store()
+        path = await self._in_executor(write_archive, store.backend, guild_id, self.archive_dir)
+        await store.delete_guild_async(guild_id, _executor)
+        LOGGER.info(f"Archived guild {guild_id} to {path}")
+        return path
+
+    async def guild_removed(self, guild: discord.Guild) -> Optional[str]:
+        """
+        A bot left or was removed from a guild. Unless another bot in the process is still in it, stop working on it
+        and archive it.
+        :return: The archive's path, if it was archived.
+        """
+        if find_guild(guild.id) is not None:
+            return None
+        # If archiving fails or the bot stops first, the next pass finishes it
+        await self._in_executor(mark_left, guild.id, True, self.archive_dir)
+        cancel_reload(guild)
+        get_mute_scheduler().cancel_guild(guild.id)
+        get_poll_registry().drop_guild(guild.id)
+        get_member_cache().forget_guild(guild.id)
+        path = await self.archive(guild.id)
+        await self._in_executor(clear_left, guild.id, self.archive_dir)
+        return path
+
+    async def guild_joined(self, guild: discord.Guild) -> bool:
+        """
+        Puts back the state of a guild the bot was in before, if it's still archived.
+        :return: Whether anything was restored.
+        """
+        await self._in_executor(clear_left, guild.id, self.archive_dir)
+        archives = await self._in_executor(guild_archives, guild.id, self.archive_dir)
+        if not archives:
+            return False
+        store = get_user_store()
+        bundle = await self._in_executor(restore_archive, store.backend, archives[-1])
+        store.invalidate(guild.id)
+        for path in archives:
+            await self._in_executor(os.remove, path)
+        scheduler = get_mute_scheduler()
+        for name, uid, muted, deafened in bundle['users']:
+            for kind, until in ((UNMUTE, muted), (UNDEAFEN, deafened)):
+                until = datetime.fromisoformat(until)
+                if until != DATETIME_DEFAULT:
+                    scheduler.schedule(guild.id, uid, kind, until)
+        LOGGER.info(f"Restored {len(bundle['users'])} members of guild {guild.id} from {archives[-1]}")
+        return True
+
+    def purge(self) -> List[str]:
+        """Delete archives older than the retention period. Runs in the executor."""
+        cutoff = time.time() - self.retention
+        purged = []
+        for path in guild_archives(archive_dir=self.archive_dir):
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                purged.append(path)
+        return purged
+
+    async def run_once(self) -> Dict[str, int]:
+        """One pass of the lifecycle job. Returns what it did."""
+        plan = get_shard_plan()
+        store = get_user_store()
+        summary = {'archived': 0, 'missing': 0, 'purged': 0, 'dropped': 0, 'compaction_steps': 0}
+
+        # Guilds the bot left while it was offline. Shard workers only look at their own guilds.
+        stored = await self._in_executor(store.backend.guild_ids)
+        markers = await self._in_executor(left_markers, self.archive_dir)
+        ready = all_clients_ready()
+        for guild_id in sorted(stored | set(markers)):
+            if not plan.owns_guild(guild_id):
+                continue
+            marker = markers.get(guild_id)
+            if find_guild(guild_id) is not None or guild_id not in stored:
+                if marker is not None:
+                    await self._in_executor(clear_left, guild_id, self.archive_dir)
+                continue
+            if marker is not None and (marker.get('removed') or ready):
+                await self.archive(guild_id)
+                await self._in_executor(clear_left, guild_id, self.archive_dir)
+                summary['archived'] += 1
+            elif marker is None and ready:
+                # Archived on the next pass if it's still missing then
+                await self._in_executor(mark_left, guild_id, False, self.archive_dir)
+                summary['missing'] += 1
+
+        if not lazy_members():
+            # Lazy mode has no member lists, and paging them in over REST every day is what it avoids
+            for guild in list(hosted_guilds()):
+                _added, removed = await reconcile_guild(guild)
+                summary['dropped'] += removed
+
+        # The archive directory and the database are shared by every shard worker
+        if plan.owns_global:
+            summary['purged'] = len(await self._in_executor(self.purge))
+            while True:
+                summary['compaction_steps'] += 1
+                if not await self._in_executor(store.compact_step):
+                    break
+                await asyncio.sleep(0.05)  # Let the bot's own writes in between steps
+
+        LOGGER.info(f"Guild lifecycle pass: {summary}")
+        return summary
+
+
+_lifecycle: Optional[GuildLifecycle] = None
+
+
+def get_guild_lifecycle() -> GuildLifecycle:
+    """Returns the process-wide guild lifecycle job."""
+    global _lifecycle
+    if _lifecycle is None:
+        _lifecycle = GuildLifecycle()
+    return _lifecycle
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="python -m Bot.GuildLifecycle", description="Inspect and restore guild archives")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    subparsers.add_parser('list', help="List archive bundles")
+    restore_parser = subparsers.add_parser('restore', help="Put an archived guild back into the store")
+    restore_parser.add_argument('path', help="Archive bundle")
+    args = parser.parse_args()
+
+    if args.action == 'list':
+        for archive in guild_archives():
+            print(f"{archive}  {os.path.getsize(archive)} bytes")
+    else:
+        restored = restore_archive(get_user_store().backend, args.path)
+        get_user_store().close()
+        print(f"Restored {len(restored['users'])} members and {len(restored['polls'])} polls of guild "
+              f"{restored['guild_id']}")
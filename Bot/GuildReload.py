@@ -0,0 +1,171 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional
+
+import discord
+
+from envs import LOGGER
+from Bot.UserYml import UserYml
+from Bot.UserStore import get_user_store
+from Bot.RestScheduler import send, COSMETIC
+from Bot.MemberCache import lazy_members
+
+# Store writes for reloads run here, one at a time, so a big guild can't starve other disk work
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='guild-reload')
+_jobs: Dict[int, 'GuildReloadJob'] = {}
+_reconciles: Dict[int, asyncio.Task] = {}
+
+
+def member_total(guild: discord.Guild) -> int:
+    if lazy_members() and not guild.chunked:
+        return guild.member_count or 0
+    return len(guild.members)
+
+
+async def member_chunks(guild: discord.Guild, chunk_size: int) -> AsyncIterator[List[discord.Member]]:
+    """
+    Yields the guild's members `chunk_size` at a time. With MEMBER_CACHE=lazy the client doesn't have the member
+    list, so it's paged in over REST and only one chunk is held at a time.
+    """
+    if lazy_members() and not guild.chunked:
+        chunk = []
+        async for member in guild.fetch_members(limit=None):
+            chunk.append(member)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+        return
+    members = list(guild.members)
+    for i in range(0, len(members), chunk_size):
+        yield members[i:i + chunk_size]
+
+
+class GuildReloadJob(object):
+    """
+    Rebuilds a guild's member records in the background.
+
+    Members are processed in chunks of `chunk_size`. Each chunk's records are built on the event loop (cheap) and
+    written by the reload executor (not cheap), and the job yields to the loop between chunks, so a 100k member
+    guild never holds the loop for more than one chunk's worth of record building.
+    """
+
+    def __init__(self, guild: discord.Guild, channel: discord.TextChannel = None, chunk_size=500,
+                 progress_interval=5.0):
+        """
+        :param guild: Guild to reload.
+        :param channel: Where to report progress, if anywhere.
+        :param chunk_size: Members per chunk.
+        :param progress_interval: Minimum number of seconds between progress messages.
+        """
+        self.guild = guild
+        self.channel = channel
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self.done = 0
+        self.total = 0
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self) -> asyncio.Task:
+        self.task = asyncio.get_running_loop().create_task(self.run())
+        return self.task
+
+    def cancel(self) -> bool:
+        if self.running:
+            self.task.cancel()
+            return True
+        return False
+
+    async def report(self, text: str):
+        if self.channel is not None:
+            try:
+                await send(self.channel, text, COSMETIC)
+            except discord.HTTPException as e:
+                LOGGER.info(e)
+
+    async def run(self):
+        store = get_user_store()
+        self.total = member_total(self.guild)
+        start = last_report = time.monotonic()
+        try:
+            async for members in member_chunks(self.guild, self.chunk_size):
+                users = [UserYml.create_user_from_member(member) for member in members]
+                await store.put_many_async(self.guild.id, users, _executor)
+                self.done += len(users)
+                if time.monotonic() - last_report >= self.progress_interval and self.done < self.total:
+                    last_report = time.monotonic()
+                    await self.report(f"Reloaded {self.done}/{self.total} members...")
+                # Let everything else run before the next chunk
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            LOGGER.info(f"Reload of guild {self.guild.id} cancelled after {self.done}/{self.total} members")
+            await self.report(f"Reload cancelled after {self.done}/{self.total} members.")
+            raise
+        finally:
+            if _jobs.get(self.guild.id) is self:
+                del _jobs[self.guild.id]
+        self.total = self.done
+        LOGGER.info(f"Reloaded {self.total} members of guild {self.guild.id} in {time.monotonic() - start:.2f}s")
+        await self.report(f"Reload finished, {self.total} members updated.")
+
+
+def start_reload(guild: discord.Guild, channel: discord.TextChannel = None) -> GuildReloadJob:
+    """
+    Starts a reload of the guild in the background, replacing one that's already running for it.
+    """
+    cancel_reload(guild)
+    job = GuildReloadJob(guild, channel)
+    _jobs[guild.id] = job
+    job.start()
+    return job
+
+
+def cancel_reload(guild: discord.Guild) -> bool:
+    job = _jobs.get(guild.id)
+    return job is not None and job.cancel()
+
+
+async def reconcile_guild(guild: discord.Guild, chunk_size=500) -> (int, int):
+    """
+    Brings the guild's records in line with its member list without touching anyone that didn't change.
+
+    The ids with records are loaded once per process (and kept current afterwards), so on a reconnect this is an
+    in-memory set difference and the writes are proportional to how many members joined or left. Records of
+    departed members that are still muted are kept, so leaving and rejoining doesn't clear a mute. Callers that
+    ask while the guild is already being reconciled wait for that run, which matters when each run pages the member
+    list in over REST.
+    :return: Number of records added and removed.
+    """
+    task = _reconciles.get(guild.id)
+    if task is None:
+        task = _reconciles[guild.id] = asyncio.get_running_loop().create_task(_reconcile(guild, chunk_size))
+        task.add_done_callback(lambda _task: _reconciles.pop(guild.id, None))
+    return await asyncio.shield(task)
+
+
+async def _reconcile(guild: discord.Guild, chunk_size: int) -> (int, int):
+    store = get_user_store()
+    # A copy: members who join while this runs are added to the live set, and must not count as departed
+    known_ids = set(await store.user_ids_async(guild.id, _executor))
+    current = set()
+    added = 0
+    async for members in member_chunks(guild, chunk_size):
+        current.update(member.id for member in members)
+        users = [UserYml.create_user_from_member(member) for member in members if member.id not in known_ids]
+        if users:
+            await store.put_many_async(guild.id, users, _executor)
+            added += len(users)
+
+    muted = store.muted_ids(guild.id)
+    departed = [uid for uid in known_ids if uid not in current and uid not in muted]
+    if departed:
+        await store.delete_many_async(guild.id, departed, _executor)
+    if added or departed:
+        LOGGER.info(f"Guild {guild.id}: {added} members added, {len(departed)} removed")
+    return added, len(departed)
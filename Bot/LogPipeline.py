@@ -0,0 +1,181 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+# Attributes every LogRecord has. Anything else on a record came from `extra` and becomes a field of its JSON line.
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger and message, then any `extra` fields the call passed, e.g.
+    `LOGGER.info("Command ran", extra={'category': 'command', 'guild': guild.id, 'latency_ms': 12.5})`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': f"{self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}.{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through at most `rate` records per second of each category, with bursts of up to `burst`. A record's
+    category is its `category` extra field, or its logger's name. Warnings and errors are never dropped.
+
+    The next record let through after some were dropped carries how many in its `sampled_out` field.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.dropped = 0
+        self._buckets: Dict[str, tuple] = {}  # Category to (tokens, last refill)
+        self._skipped: Dict[str, int] = {}  # Category to records dropped since the last one let through
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno >= logging.WARNING:
+            return True
+        category = getattr(record, 'category', record.name)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(category, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[category] = (tokens, now)
+                self._skipped[category] = self._skipped.get(category, 0) + 1
+                self.dropped += 1
+                return False
+            self._buckets[category] = (tokens - 1, now)
+            skipped = self._skipped.pop(category, 0)
+        if skipped:
+            record.sampled_out = skipped
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread. If the writer has fallen `queue_size` records behind, records are counted
+    and dropped instead of blocking the caller.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the message and traceback text cross to the writer, so nothing it reads can change under it
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # The queue may be full when stopping, wait for room rather than lose the stop signal
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline(object):
+    """
+    Routes every log record through a bounded queue to a background thread that formats and writes it, so logging
+    never waits on the disk. Records are sampled per category before they're queued, and the file is rotated by
+    size or, with `rotate_when`, by time.
+    """
+
+    def __init__(self, path: str, fmt: str = 'json', max_bytes: int = 10 * 1024 * 1024, rotate_when: str = '',
+                 backups: int = 5, queue_size: int = 10000, sample_rate: float = 20, sample_burst: int = 100,
+                 text_format: str = '%(asctime)s:%(levelname)s:%(name)s: %(message)s'):
+        """
+        :param path: Log file.
+        :param fmt: 'json' for one JSON object per line, 'text' for `text_format`.
+        :param max_bytes: Size to rotate the file at, when not rotating by time. 0 never rotates.
+        :param rotate_when: Rotate by time instead, e.g. 'midnight' or 'H' (see TimedRotatingFileHandler).
+        :param backups: Rotated files to keep.
+        :param queue_size: Records waiting to be written before new ones are dropped.
+        :param sample_rate: Records per second let through for each category below WARNING. 0 keeps everything.
+        :param sample_burst: Records of a category let through at once before sampling kicks in.
+        """
+        if rotate_when:
+            self.file_handler = logging.handlers.TimedRotatingFileHandler(path, when=rotate_when, backupCount=backups,
+                                                                          encoding='utf-8')
+        else:
+            self.file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                                     encoding='utf-8')
+        self.file_handler.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(text_format))
+        self.queue = queue.Queue(queue_size)
+        self.sampler = SamplingFilter(sample_rate, sample_burst)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.handler.addFilter(self.sampler)
+        self.listener = _Listener(self.queue, self.file_handler)
+        self._running = False
+
+    def start(self, level: int = logging.INFO):
+        """Send the root logger's records through the pipeline and start the writer thread."""
+        root = logging.getLogger()
+        root.addHandler(self.handler)
+        root.setLevel(level)
+        self.listener.start()
+        self._running = True
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Write whatever is still queued and stop the writer thread."""
+        if not self._running:
+            return
+        self._running = False
+        logging.getLogger().removeHandler(self.handler)
+        self.listener.stop()
+        self.file_handler.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'queued': self.queue.qsize(),
+            'dropped_full': self.handler.dropped,
+            'sampled_out': self.sampler.dropped,
+        }
+
+
+_pipeline: Optional[LogPipeline] = None
+
+
+def setup_logging(path: str, level: int = logging.INFO, **options) -> LogPipeline:
+    """Starts the process-wide log pipeline. `options` are LogPipeline's."""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = LogPipeline(path, **options)
+        _pipeline.start(level)
+    return _pipeline
+
+
+def get_log_pipeline() -> Optional[LogPipeline]:
+    """Returns the process-wide log pipeline, or None if logging wasn't set up through it."""
+    return _pipeline
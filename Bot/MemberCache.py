@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import discord
+
+from envs import LOGGER, MEMBER_CACHE, MEMBER_CACHE_SIZE, MEMBER_CACHE_TTL
+from Bot.RestScheduler import get_rest_scheduler, MODERATION
+
+
+class MemberCache(object):
+    """
+    Members the client doesn't keep, fetched when they're needed.
+
+    With MEMBER_CACHE=lazy the client only caches members who are in a voice channel, so a mute running out or a
+    poll closing may be about someone it doesn't have. Those are fetched over REST and kept in an LRU bounded by
+    `max_size` members and `ttl` seconds. Concurrent fetches of the same member share one request. With the full
+    member cache, everyone is found in the client's cache and nothing is fetched.
+    """
+
+    def __init__(self, max_size: int = MEMBER_CACHE_SIZE, ttl: float = MEMBER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._members: OrderedDict[Tuple[int, int], Tuple[float, discord.Member]] = OrderedDict()
+        self.hits = 0
+        self.fetches = 0
+
+    def __len__(self):
+        return len(self._members)
+
+    def get(self, guild: discord.Guild, uid: int) -> Optional[discord.Member]:
+        """The member if the client or this cache has them, without fetching."""
+        member = guild.get_member(uid)
+        if member is not None:
+            return member
+        key = (guild.id, uid)
+        entry = self._members.get(key)
+        if entry is None:
+            return None
+        expires, member = entry
+        if expires <= time.monotonic():
+            del self._members[key]
+            return None
+        self._members.move_to_end(key)
+        self.hits += 1
+        return member
+
+    async def fetch(self, guild: discord.Guild, uid: int) -> Optional[discord.Member]:
+        """The member, fetched if they aren't cached. None if they're no longer in the guild."""
+        member = self.get(guild, uid)
+        if member is not None:
+            return member
+        self.fetches += 1
+        try:
+            # Whoever needs a member here is about to moderate them, so it goes in the moderation lane
+            member = await get_rest_scheduler().submit(f"member:{guild.id}", guild.fetch_member, uid,
+                                                       priority=MODERATION, key=('fetch_member', guild.id, uid))
+        except discord.NotFound:
+            return None
+        except discord.HTTPException as e:
+            LOGGER.info(f"Could not fetch member {uid} of guild {guild.id}: {e}")
+            return None
+        self.put(member)
+        return member
+
+    def put(self, member: discord.Member):
+        key = (member.guild.id, member.id)
+        self._members[key] = (time.monotonic() + self.ttl, member)
+        self._members.move_to_end(key)
+        while len(self._members) > self.max_size:
+            self._members.popitem(last=False)
+
+    def update(self, member: discord.Member):
+        """Replace a cached member with a newer copy, e.g. from a member update event."""
+        if (member.guild.id, member.id) in self._members:
+            self.put(member)
+
+    def forget(self, guild_id: int, uid: int):
+        self._members.pop((guild_id, uid), None)
+
+    def forget_guild(self, guild_id: int):
+        for key in [key for key in self._members if key[0] == guild_id]:
+            del self._members[key]
+
+
+def lazy_members() -> bool:
+    """Whether the client was told not to keep every guild's member list."""
+    return MEMBER_CACHE == 'lazy'
+
+
+_member_cache: Optional[MemberCache] = None
+
+
+def get_member_cache() -> MemberCache:
+    """Returns the process-wide member cache."""
+    global _member_cache
+    if _member_cache is None:
+        _member_cache = MemberCache()
+    return _member_cache
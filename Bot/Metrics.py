@@ -0,0 +1,294 @@
+import asyncio
+import bisect
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from envs import LOGGER, METRICS_HOST, METRICS_PORT, METRICS_LOOP_INTERVAL
+
+# Seconds. From a cached lookup up to a slow Drive transfer.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ''
+
+
+class _Metric(ABC):
+    TYPE: str = None
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()  # Drive transfers and store writes report from executor threads
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        ...
+
+    def summary(self) -> List[str]:
+        """Short, human readable lines for the chat command."""
+        return [line for line in self.render() if not line.startswith('#')]
+
+
+class Counter(_Metric):
+    TYPE = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                                for key, value in values]
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down. Either `set` it, or give a `func` that is called at scrape time.
+    `func` returns a number, or a dict of label value tuples to numbers for a labelled gauge.
+    """
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), func: Callable = None):
+        super().__init__(name, documentation, labels)
+        self.func = func
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self) -> List[str]:
+        if self.func is None:
+            with self._lock:
+                values = sorted(self._values.items())
+            return self.header() + [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                                    for key, value in values]
+        try:
+            values = self.func()
+            values = sorted(values.items()) if isinstance(values, dict) else [((), values)]
+            return self.header() + [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                                    for key, value in values]
+        except Exception as e:
+            # One broken gauge shouldn't take the rest down with it
+            LOGGER.error(f"Metric {self.name} failed: {e}")
+            return []
+
+
+class Histogram(_Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: a count for each bucket (not cumulative) and one for +Inf, then the sum
+        self._series: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return sum(series[:-1]) if series is not None else 0
+
+    def quantile(self, q: float, *label_values) -> Optional[float]:
+        """Upper bound of the bucket holding the `q` quantile, or None if nothing was observed."""
+        with self._lock:
+            series = list(self._series.get(label_values, ()))
+        if not series:
+            return None
+        target = q * sum(series[:-1])
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+            seen += count
+            if seen >= target:
+                return bound
+        return math.inf
+
+    def summary(self) -> List[str]:
+        with self._lock:
+            keys = sorted(self._series)
+        lines = []
+        for key in keys:
+            count = self.count(*key)
+            mean = self._series[key][-1] / count if count else 0.0
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} count={count} mean={mean * 1000:.1f}ms "
+                         f"p50{self._bound(self.quantile(0.5, *key))} p99{self._bound(self.quantile(0.99, *key))}")
+        return lines
+
+    def _bound(self, bound: float) -> str:
+        if math.isinf(bound):
+            return f">{self.buckets[-1] * 1000:g}ms"
+        return f"<={bound * 1000:g}ms"
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = self.header()
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), values[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Metrics(object):
+    """
+    Process-wide metrics, rendered in the Prometheus text format.
+
+    Modules declare their metrics once at import time (`get_metrics().histogram(...)`); declaring a name again
+    returns the existing metric. Besides rendering on demand (the `metrics` command), `start` runs an event loop
+    lag monitor and, if METRICS_PORT is set, serves `/metrics` over HTTP on METRICS_HOST.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._monitor: Optional[asyncio.Task] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.loop_lag = self.histogram('bot_event_loop_lag_seconds', "How late the event loop woke a sleeping task",
+                                       buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+    def _declare(self, cls, name: str, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} is already declared as a {metric.TYPE}")
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._declare(Counter, name, documentation, labels)
+
+    def gauge(self, name: str, documentation: str, labels: Tuple[str, ...] = (), func: Callable = None) -> Gauge:
+        gauge = self._declare(Gauge, name, documentation, labels)
+        if func is not None:
+            gauge.func = func
+        return gauge
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._declare(Histogram, name, documentation, labels, buckets)
+
+    def render(self, prefix: str = '') -> str:
+        lines = []
+        for name in sorted(self._metrics):
+            if name.startswith(prefix):
+                lines += self._metrics[name].render()
+        return "\n".join(lines) + "\n"
+
+    def summary(self, prefix: str = '') -> List[str]:
+        lines = []
+        for name in sorted(self._metrics):
+            if name.startswith(prefix):
+                lines += self._metrics[name].summary()
+        return lines
+
+    def start(self, port: int = METRICS_PORT, host: str = METRICS_HOST):
+        """Start the loop lag monitor, and the HTTP exporter if `port` is set. Call from the running loop."""
+        if self._monitor is None or self._monitor.done():
+            self._monitor = asyncio.get_running_loop().create_task(self._watch_loop(METRICS_LOOP_INTERVAL))
+        if port and self._server is None:
+            asyncio.get_running_loop().create_task(self._serve(host, port))
+
+    async def stop(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _watch_loop(self, interval: float):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, loop.time() - start - interval))
+
+    async def _serve(self, host: str, port: int):
+        try:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        except OSError as e:
+            LOGGER.error(f"Metrics exporter could not listen on {host}:{port}: {e}")
+            return
+        LOGGER.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            # Skip the headers, nothing in them matters here
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?', 1)[0] == '/metrics':
+                status, body = '200 OK', self.render().encode()
+            else:
+                status, body = '404 Not Found', b"Not found, try /metrics\n"
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+_metrics: Optional[Metrics] = None
+
+
+def get_metrics() -> Metrics:
+    """Returns the process-wide metrics."""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
@@ -0,0 +1,144 @@
+import asyncio
+import heapq
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import discord
+
+from envs import LOGGER
+from Bot.UserStore import get_user_store
+from Bot.Sharding import get_shard_plan
+
+UNMUTE = 'unmute'
+UNDEAFEN = 'undeafen'
+
+TimerKey = Tuple[int, int, str]  # (guild_id, uid, kind)
+Handler = Callable[[int, int], Awaitable[None]]
+
+
+class MuteScheduler(object):
+    """
+    Fires mute and deafen expiries from a single task.
+
+    Pending expiries are kept in a min-heap of (deadline, guild_id, uid, kind) tuples, and the task sleeps until the
+    earliest one, so the cost per pending mute is one tuple and one dict entry no matter how many there are. The
+    deadlines themselves are the `muted`/`deafened` fields already saved in the user store, which is what `restore`
+    rebuilds the heap from after a restart.
+
+    Rescheduling or cancelling doesn't touch the heap. The current deadline for each key lives in `_deadlines` and
+    heap entries that no longer match it are skipped when they come up. Once those outnumber the live ones, the heap
+    is rebuilt from `_deadlines`, so it doesn't grow with every mute that was cancelled early.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, int, str]] = []
+        self._deadlines: Dict[TimerKey, float] = {}
+        self._handlers: Dict[str, Handler] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        self._restored: Set[discord.Client] = set()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def register(self, kind: str, handler: Handler):
+        """Set the coroutine function called with (guild_id, uid) when a `kind` timer expires."""
+        self._handlers[kind] = handler
+
+    def schedule(self, guild_id: int, uid: int, kind: str, deadline: datetime):
+        deadline = deadline.timestamp()
+        key = (guild_id, uid, kind)
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, guild_id, uid, kind))
+        self._compact()
+        # Only wake the task if this is now the earliest deadline
+        if self._wakeup is not None and self._heap[0][0] == deadline:
+            self._wakeup.set()
+
+    def cancel(self, guild_id: int, uid: int, kind: str):
+        self._deadlines.pop((guild_id, uid, kind), None)
+        self._compact()
+
+    def cancel_guild(self, guild_id: int):
+        for key in [key for key in self._deadlines if key[0] == guild_id]:
+            del self._deadlines[key]
+        self._compact()
+
+    def _compact(self):
+        """Rebuild the heap from the live deadlines once most of its entries are stale."""
+        if len(self._heap) > 2 * len(self._deadlines):
+            self._heap = [(deadline, *key) for key, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def restore(self, client: discord.Client):
+        """
+        Schedule every mute and deafen saved in the user store for the guilds a client is in and this process owns.
+        Called as each client connects, since an expiry only fires once its guild can be found. Only does anything the
+        first time for each client.
+        """
+        if client in self._restored:
+            return
+        self._restored.add(client)
+        count = 0
+        plan = get_shard_plan()
+        for guild_id, uid, muted, deafened in get_user_store().pending_expiries():
+            if not plan.owns_guild(guild_id) or client.get_guild(guild_id) is None:
+                continue
+            if muted is not None:
+                self.schedule(guild_id, uid, UNMUTE, muted)
+                count += 1
+            if deafened is not None:
+                self.schedule(guild_id, uid, UNDEAFEN, deafened)
+                count += 1
+        LOGGER.info(f"Restored {count} pending mute/deafen expiries of {client.user}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                deadline, guild_id, uid, kind = heapq.heappop(self._heap)
+                key = (guild_id, uid, kind)
+                if self._deadlines.get(key) != deadline:
+                    continue  # Rescheduled or cancelled since this entry was pushed
+                del self._deadlines[key]
+                task = asyncio.get_running_loop().create_task(self._fire(key))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, key: TimerKey):
+        guild_id, uid, kind = key
+        handler = self._handlers.get(kind)
+        if handler is None:
+            LOGGER.error(f"No handler registered for {kind} timers")
+            return
+        try:
+            await handler(guild_id, uid)
+        except Exception as e:
+            LOGGER.error(f"{kind} of {uid} in guild {guild_id} failed: {e}")
+
+
+_scheduler: Optional[MuteScheduler] = None
+
+
+def get_mute_scheduler() -> MuteScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = MuteScheduler()
+    return _scheduler
@@ -0,0 +1,228 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Set
+
+import discord
+
+from envs import LOGGER
+from Bot.UserStore import get_user_store
+from Bot.Sharding import get_shard_plan
+from Bot.BotHost import hosted_clients
+from Bot.UserYml import UserYml
+from Bot.MemberCache import get_member_cache
+from Bot.RestScheduler import get_rest_scheduler, send
+
+POLL = 'poll'
+MUTE = 'mute'
+UNMUTE = 'unmute'
+
+
+def normalize_emoji(emoji) -> str:
+    # Discord may or may not add the emoji variation selector to keycaps and symbols
+    return str(emoji).replace('\ufe0f', '')
+
+
+class Poll(object):
+    """
+    An open poll. Everything needed to finish it is kept here and saved in the user store, so it can be closed
+    by a different process than the one that opened it.
+    """
+
+    def __init__(self, message_id: int, channel_id: int, guild_id: Optional[int], emojis: List[str], deadline: float,
+                 kind=POLL, target_id: int = None, mute_duration: float = 0, quorum: int = None,
+                 min_votes: int = 0, counts: List[int] = None):
+        """
+        :param emojis: Reaction for each answer, in order.
+        :param deadline: Epoch time the poll closes at.
+        :param kind: What to do with the result, POLL, MUTE or UNMUTE.
+        :param target_id: Member to (un)mute for MUTE and UNMUTE polls.
+        :param quorum: Number of eligible voters. The poll closes early once an answer has a majority of them and at
+            least `min_votes` votes. None to always run until the deadline.
+        :param counts: Votes per answer, not counting the bot's own reactions.
+        """
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.emojis = emojis
+        self.deadline = deadline
+        self.kind = kind
+        self.target_id = target_id
+        self.mute_duration = mute_duration
+        self.quorum = quorum
+        self.min_votes = min_votes
+        self.counts = counts if counts is not None else [0] * len(emojis)
+        self._index = {normalize_emoji(emoji): i for i, emoji in enumerate(emojis)}
+
+    def to_dict(self) -> Dict:
+        return {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Poll':
+        return cls(**data)
+
+    def vote(self, emoji, delta: int) -> bool:
+        """Count a reaction being added (1) or removed (-1). Returns False for reactions that aren't answers."""
+        i = self._index.get(normalize_emoji(emoji))
+        if i is None:
+            return False
+        self.counts[i] = max(self.counts[i] + delta, 0)
+        return True
+
+    def decided(self) -> bool:
+        top = max(self.counts)
+        return self.quorum is not None and top >= self.min_votes and top * 2 > self.quorum
+
+    def result(self) -> (str, int):
+        """
+        :return: Text announcing the winner, and the winner's 1-based answer number (0 for a tie).
+        """
+        top = max(self.counts)
+        winners = [i for i, count in enumerate(self.counts) if count == top]
+        if len(winners) == 1:
+            return f"{self.emojis[winners[0]]} wins with {top} votes.", winners[0] + 1
+        result = "The result is a tie between "
+        result += ", ".join(self.emojis[i] for i in winners[:-1])
+        result += f", and {self.emojis[winners[-1]]} at {top} votes."
+        return result, 0
+
+
+class PollRegistry(object):
+    """
+    Every open poll, keyed by message id.
+
+    Votes are counted live from raw reaction events, so closing a poll is a dict lookup rather than a message
+    refetch, and an open poll is a dict entry plus a timer handle rather than a sleeping coroutine. Open polls are
+    saved in the user store and picked back up by `restore` after a restart.
+
+    Each poll is answered by the client of the bot that posted it, when the process hosts several.
+    """
+
+    def __init__(self):
+        self.polls: Dict[int, Poll] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._clients: Dict[int, discord.Client] = {}
+        self._restored: Set[discord.Client] = set()
+        self._closing: Set[asyncio.Task] = set()
+        self._closing_ids: Set[int] = set()  # Polls with a close under way, so it's only started once
+
+    def __len__(self):
+        return len(self.polls)
+
+    def open(self, client: discord.Client, poll: Poll):
+        self._clients[poll.message_id] = client
+        self.polls[poll.message_id] = poll
+        get_user_store().put_poll(poll.message_id, poll.to_dict())
+        self._schedule(poll)
+
+    def drop_guild(self, guild_id: int):
+        """Stop tracking a guild's polls, e.g. once the bot has left it. Their saved copies are left alone."""
+        for message_id in [message_id for message_id, poll in self.polls.items() if poll.guild_id == guild_id]:
+            del self.polls[message_id]
+            del self._clients[message_id]
+            timer = self._timers.pop(message_id, None)
+            if timer is not None:
+                timer.cancel()
+
+    def _schedule(self, poll: Poll):
+        loop = asyncio.get_running_loop()
+        delay = max(poll.deadline - time.time(), 0)
+        self._timers[poll.message_id] = loop.call_later(delay, self._start_close, poll.message_id)
+
+    def _start_close(self, message_id: int):
+        if message_id in self._closing_ids:
+            return
+        self._closing_ids.add(message_id)
+        # Keep a reference so the task isn't garbage collected halfway through closing
+        task = asyncio.get_running_loop().create_task(self.close(message_id))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+        task.add_done_callback(lambda _: self._closing_ids.discard(message_id))
+
+    def on_reaction(self, payload: discord.RawReactionActionEvent, delta: int):
+        poll = self.polls.get(payload.message_id)
+        if poll is None or payload.user_id == self._clients[poll.message_id].user.id:
+            return
+        if poll.vote(payload.emoji, delta) and poll.decided():
+            # Votes keep coming in until the close runs; later deciding ones find it already started
+            timer = self._timers.pop(poll.message_id, None)
+            if timer is not None:
+                timer.cancel()
+            self._start_close(poll.message_id)
+
+    async def close(self, message_id: int):
+        poll = self.polls.pop(message_id, None)
+        if poll is None:
+            return
+        client = self._clients.pop(message_id)
+        timer = self._timers.pop(message_id, None)
+        if timer is not None:
+            timer.cancel()
+        get_user_store().delete_poll(message_id)
+
+        text, winner = poll.result()
+        channel = client.get_channel(poll.channel_id)
+        if channel is None:
+            LOGGER.info(f"Channel for poll {message_id} is gone, not announcing the result")
+        else:
+            try:
+                await send(channel, text)
+            except discord.HTTPException as e:
+                # The vote still counts
+                LOGGER.info(f"Could not announce the result of poll {message_id}: {e}")
+
+        if poll.kind in (MUTE, UNMUTE) and winner == 1:
+            guild = client.get_guild(poll.guild_id)
+            member = await get_member_cache().fetch(guild, poll.target_id) if guild is not None else None
+            if member is None:
+                return
+            if poll.kind == MUTE:
+                await UserYml.mute(member, poll.mute_duration)
+            else:
+                await UserYml.unmute(member)
+
+    async def restore(self, client: discord.Client):
+        """
+        Resume the polls a client's bot posted in a previous run. Their reactions are fetched once, since votes cast
+        while the bot was offline never produced an event. Polls in guilds owned by another process or another bot
+        are left to it, and polls in DMs to the first bot hosted. Only does anything the first time for each client.
+        """
+        if client in self._restored:
+            return
+        self._restored.add(client)
+        plan = get_shard_plan()
+        restored = 0
+        for data in get_user_store().polls():
+            poll = Poll.from_dict(data)
+            if poll.message_id in self.polls or not plan.owns_guild(poll.guild_id):
+                continue
+            if poll.guild_id is None and client is not hosted_clients()[0]:
+                continue
+            if poll.guild_id is not None and client.get_guild(poll.guild_id) is None:
+                # Another bot's, or a guild the bot has left, which the guild lifecycle job archives
+                continue
+            channel = client.get_channel(poll.channel_id)
+            try:
+                message = await get_rest_scheduler().submit(f"message:{channel.id}", channel.fetch_message,
+                                                            poll.message_id)
+            except (AttributeError, discord.HTTPException):
+                LOGGER.info(f"Poll {poll.message_id} can no longer be found, dropping it")
+                get_user_store().delete_poll(poll.message_id)
+                continue
+            poll.counts = [0] * len(poll.emojis)
+            for reaction in message.reactions:
+                poll.vote(reaction.emoji, reaction.count - (1 if reaction.me else 0))
+            self.polls[poll.message_id] = poll
+            self._clients[poll.message_id] = client
+            self._schedule(poll)
+            restored += 1
+        LOGGER.info(f"Restored {restored} open polls of {client.user}")
+
+
+_registry: Optional[PollRegistry] = None
+
+
+def get_poll_registry() -> PollRegistry:
+    global _registry
+    if _registry is None:
+        _registry = PollRegistry()
+    return _registry
@@ -0,0 +1,252 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+from envs import REST_CONCURRENCY
+
+# Priority lanes, lower goes first
+MODERATION = 0  # Mutes, unmutes, anything a vote or an admin is waiting on
+MESSAGE = 1  # Replies and notifications
+COSMETIC = 2  # Reactions and progress updates
+
+LANE_NAMES = {MODERATION: 'moderation', MESSAGE: 'message', COSMETIC: 'cosmetic'}
+
+# (requests, per seconds) for each route prefix. Routes are '<prefix>:<id>', e.g. 'message:<channel id>'.
+ROUTE_LIMITS = {
+    'message': (5, 5.0),
+    'reaction': (1, 0.25),
+    'member': (10, 10.0),
+    'user': (5, 1.0),
+}
+DEFAULT_LIMIT = (5, 5.0)
+
+
+class _Bucket(object):
+    """Token bucket for one route."""
+
+    def __init__(self, capacity: int, per: float):
+        self.capacity = capacity
+        self.rate = capacity / per
+        self.per = per
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token. Returns 0 on success, otherwise how many seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        return now - self.updated >= (self.capacity - self.tokens) / self.rate
+
+
+class _Job(object):
+    __slots__ = ('route', 'func', 'args', 'kwargs', 'priority', 'key', 'serial', 'future', 'queued_at', 'released')
+
+    def __init__(self, route, func, args, kwargs, priority, key, serial, future):
+        self.route = route
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.key = key
+        self.serial = serial
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.released = False  # Already holds a token for its route
+
+
+class RestScheduler(object):
+    """
+    Single funnel for outbound Discord requests.
+
+    Requests wait in a priority queue and are run by `concurrency` workers, so a burst of reactions can't delay a
+    mute. Each route has a token bucket sized to Discord's published limits. Once a route is out of tokens its
+    requests wait in a per-route line, in order, and are released one token at a time, so one busy channel neither
+    holds a worker nor stalls the others. Requests submitted with the same `key` while one is still queued share its
+    result instead of being sent twice. Requests with the same `serial` key run one at a time in the order they were
+    submitted, whatever their lane, so a member's unmute can't overtake the mute before it.
+
+    A route's bucket is only kept while it's refilling or has requests waiting on it, so the table holds the routes
+    used recently rather than every channel and member ever touched.
+
+    discord.py still handles any 429s that get through; this keeps bursts from producing them in the first place.
+    """
+
+    def __init__(self, concurrency: int = 4, max_buckets: int = 10000):
+        self.concurrency = concurrency
+        self.max_buckets = max_buckets
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._buckets: Dict[str, _Bucket] = {}
+        self._pending: Dict[Hashable, _Job] = {}
+        self._waiting: Dict[str, Deque[_Job]] = {}
+        # Serial key to its requests in order, the first one queued or running and the rest held back
+        self._serial: Dict[Hashable, Deque[_Job]] = {}
+        self._seq = itertools.count()
+        self._deferred = 0
+        self.coalesced = 0
+        self.wait_count = {lane: 0 for lane in LANE_NAMES}
+        self.wait_total = {lane: 0.0 for lane in LANE_NAMES}
+        self.wait_max = {lane: 0.0 for lane in LANE_NAMES}
+
+    @property
+    def queue_depth(self) -> int:
+        return (self._queue.qsize() if self._queue is not None else 0) + self._deferred
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue_depth': self.queue_depth,
+            'coalesced': self.coalesced,
+            'wait': {LANE_NAMES[lane]: {
+                'count': self.wait_count[lane],
+                'mean': self.wait_total[lane] / self.wait_count[lane] if self.wait_count[lane] else 0.0,
+                'max': self.wait_max[lane],
+            } for lane in LANE_NAMES},
+        }
+
+    def start(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        self._workers = [task for task in self._workers if not task.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._workers) < self.concurrency:
+            self._workers.append(loop.create_task(self._work()))
+
+    def stop(self):
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+
+    def submit(self, route: str, func: Callable[..., Awaitable], *args, priority=MESSAGE, key: Hashable = None,
+               serial: Hashable = None, **kwargs) -> asyncio.Future:
+        """
+        Queue `func(*args, **kwargs)`.
+        :param route: Rate limit bucket, '<prefix>:<id>' with a prefix from ROUTE_LIMITS.
+        :param priority: MODERATION, MESSAGE or COSMETIC.
+        :param key: Requests with equal keys that are queued at the same time are only sent once.
+        :param serial: Requests with equal serial keys run one at a time, in order. A request only shares the result
+            of an equal `key` if nothing with its serial key was submitted in between.
+        :return: Future for the request's result.
+        """
+        self.start()
+        line = self._serial.get(serial) if serial is not None else None
+        if key is not None:
+            job = self._pending.get(key)
+            if job is not None and (line is None or line[-1] is job):
+                self.coalesced += 1
+                return job.future
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(route, func, args, kwargs, priority, key, serial, future)
+        if key is not None:
+            self._pending[key] = job
+        if line is not None:
+            # Runs once the requests before it are done
+            line.append(job)
+            self._deferred += 1
+            return future
+        if serial is not None:
+            self._serial[serial] = deque([job])
+        self._put(job)
+        return future
+
+    def _put(self, job: _Job):
+        self._queue.put_nowait((job.priority, next(self._seq), job))
+
+    def _release(self, route: str):
+        """Move the next request waiting on `route` back to the queue once the route has a token for it."""
+        waiting = self._waiting[route]
+        delay = self._bucket(route).take()
+        if delay:
+            asyncio.get_running_loop().call_later(delay, self._release, route)
+            return
+        job = waiting.popleft()
+        self._deferred -= 1
+        job.released = True
+        self._put(job)
+        if waiting:
+            asyncio.get_running_loop().call_soon(self._release, route)
+        else:
+            del self._waiting[route]
+
+    def _next_serial(self, job: _Job):
+        """Queue the request that was waiting for `job` to finish, if any."""
+        line = self._serial[job.serial]
+        line.popleft()
+        if line:
+            self._deferred -= 1
+            self._put(line[0])
+        else:
+            del self._serial[job.serial]
+
+    def _bucket(self, route: str) -> _Bucket:
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self.prune()
+            bucket = self._buckets[route] = _Bucket(*ROUTE_LIMITS.get(route.split(':', 1)[0], DEFAULT_LIMIT))
+        return bucket
+
+    def prune(self):
+        """Forget buckets that have refilled and have nothing waiting, they'd start out full anyway."""
+        now = time.monotonic()
+        for route in [route for route, bucket in self._buckets.items()
+                      if route not in self._waiting and bucket.full(now)]:
+            del self._buckets[route]
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _priority, _seq, job = await self._queue.get()
+            if not job.released:
+                waiting = self._waiting.get(job.route)
+                if waiting is not None:
+                    # Keep requests on a limited route in order
+                    waiting.append(job)
+                    self._deferred += 1
+                    continue
+                delay = self._bucket(job.route).take()
+                if delay:
+                    self._waiting[job.route] = deque([job])
+                    self._deferred += 1
+                    loop.call_later(delay, self._release, job.route)
+                    continue
+            if job.key is not None and self._pending.get(job.key) is job:
+                del self._pending[job.key]
+            wait = time.monotonic() - job.queued_at
+            self.wait_count[job.priority] += 1
+            self.wait_total[job.priority] += wait
+            self.wait_max[job.priority] = max(self.wait_max[job.priority], wait)
+            try:
+                result = await job.func(*job.args, **job.kwargs)
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                if job.serial is not None:
+                    self._next_serial(job)
+
+
+_scheduler: Optional[RestScheduler] = None
+
+
+def get_rest_scheduler() -> RestScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RestScheduler(REST_CONCURRENCY)
+    return _scheduler
+
+
+def send(channel, content: str, priority=MESSAGE) -> asyncio.Future:
+    """Send a message to a channel (or user) through the scheduler."""
+    return get_rest_scheduler().submit(f"message:{channel.id}", channel.send, content, priority=priority)
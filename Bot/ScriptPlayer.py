@@ -0,0 +1,75 @@
+import asyncio
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import discord
+
+from Bot.DirectMessages import DMChannels
+from Bot.RestScheduler import COSMETIC, get_rest_scheduler, send
+
+
+class Step(object):
+    """
+    One message of a script.
+    :param text: Message to send.
+    :param pause: Seconds from this step to the next one.
+    :param append: Continues the previous message (e.g. a progress dot). When the player edits in place, the text
+        is added to the previous message instead of being sent on its own.
+    """
+    __slots__ = ('text', 'pause', 'append')
+
+    def __init__(self, text: str, pause: float = 0.0, append=False):
+        self.text = text
+        self.pause = pause
+        self.append = append
+
+
+class ScriptPlayer(object):
+    """
+    Plays a timed sequence of DMs to several users.
+
+    Each step goes out to every recipient at once and the pauses are measured from the start of one step to the
+    next, so slow requests don't stretch the script. A recipient whose message fails is dropped from the rest of it.
+    """
+
+    def __init__(self, dms: DMChannels, uids: Iterable[int], edit_in_place=False, time_scale=1.0):
+        self.dms = dms
+        self.uids = list(uids)
+        self.edit_in_place = edit_in_place
+        self.time_scale = time_scale
+
+    async def play(self, steps: Sequence[Step]):
+        channels = await asyncio.gather(*(self.dms.get(uid) for uid in self.uids), return_exceptions=True)
+        recipients: List[Tuple[int, discord.DMChannel]] = []
+        for uid, channel in zip(self.uids, channels):
+            if isinstance(channel, Exception):
+                self.dms.failed(uid, channel)
+            else:
+                recipients.append((uid, channel))
+
+        last: Dict[int, Tuple[discord.Message, str]] = {}  # Last message sent to each user, and its text
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        for step in steps:
+            results = await asyncio.gather(*(self._play_step(channel, step, last.get(uid))
+                                             for uid, channel in recipients), return_exceptions=True)
+            remaining = []
+            for (uid, channel), result in zip(recipients, results):
+                if isinstance(result, Exception):
+                    self.dms.failed(uid, result)
+                else:
+                    last[uid] = result
+                    remaining.append((uid, channel))
+            recipients = remaining
+            if not recipients:
+                return
+            deadline += step.pause * self.time_scale
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+
+    async def _play_step(self, channel: discord.DMChannel, step: Step, last) -> Tuple[discord.Message, str]:
+        if self.edit_in_place and step.append and last is not None:
+            message, content = last
+            content += step.text
+            await get_rest_scheduler().submit(f"message:{channel.id}", message.edit, content=content,
+                                              priority=COSMETIC)
+            return message, content
+        return await send(channel, step.text), step.text
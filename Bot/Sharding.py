@@ -0,0 +1,139 @@
+import os
+import signal
+import subprocess
+import time
+from typing import Dict, List, Optional
+
+from envs import LOGGER, SHARD_COUNT, SHARD_IDS, SHARD_WORKER
+
+
+def shard_for(guild_id: int, shard_count: int) -> int:
+    """The shard Discord delivers a guild's events to."""
+    return (guild_id >> 22) % shard_count
+
+
+def split_shards(shard_count: int, processes: int) -> List[List[int]]:
+    """Contiguous, as even as possible ranges of shard ids, one per process."""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class ShardPlan(object):
+    """
+    Which guilds this process owns.
+
+    Discord only sends a process events for guilds on its shards, and member state, mutes and polls are only ever
+    written in response to those events, so owning a guild's shard means owning its records. State restored at
+    startup (mute expiries, open polls) is filtered the same way so no two processes act on one guild.
+
+    Global state, DMs and the GRDN knowledge base, belongs to whichever process runs shard 0, since that's where
+    Discord sends DMs.
+    """
+
+    def __init__(self, shard_count: int = 0, shard_ids: List[int] = None, worker: int = 0):
+        self.shard_count = shard_count
+        self.shard_ids = set(shard_ids) if shard_ids else set(range(shard_count))
+        self.worker = worker
+
+    @property
+    def enabled(self) -> bool:
+        return self.shard_count > 0
+
+    @property
+    def owns_global(self) -> bool:
+        return not self.enabled or 0 in self.shard_ids
+
+    def owns_guild(self, guild_id: Optional[int]) -> bool:
+        """Whether this process owns a guild's state. None is for DMs."""
+        if not self.enabled:
+            return True
+        if guild_id is None:
+            return self.owns_global
+        return shard_for(guild_id, self.shard_count) in self.shard_ids
+
+    def __str__(self):
+        if not self.enabled:
+            return "unsharded"
+        return f"worker {self.worker}, shards {sorted(self.shard_ids)} of {self.shard_count}"
+
+
+_plan: Optional[ShardPlan] = None
+
+
+def get_shard_plan() -> ShardPlan:
+    """Returns this process's shard plan, from SHARD_COUNT, SHARD_IDS and SHARD_WORKER."""
+    global _plan
+    if _plan is None:
+        _plan = ShardPlan(SHARD_COUNT, SHARD_IDS, SHARD_WORKER)
+    return _plan
+
+
+class ShardLauncher(object):
+    """
+    Runs `command` once per shard range as separate processes, each with SHARD_COUNT, SHARD_IDS and SHARD_WORKER
+    set, and restarts any that crash. Ctrl-C or SIGTERM stops them all and waits for them to save their state.
+    """
+
+    def __init__(self, command: List[str], shard_count: int, processes: int, restart_delay: float = 5.0,
+                 stop_timeout: float = 30.0):
+        self.command = command
+        self.shard_count = shard_count
+        self.ranges = split_shards(shard_count, processes)
+        self.restart_delay = restart_delay
+        self.stop_timeout = stop_timeout
+        self.workers: Dict[int, subprocess.Popen] = {}
+
+    def spawn(self, worker: int) -> subprocess.Popen:
+        env = dict(os.environ, SHARD_COUNT=str(self.shard_count), SHARD_WORKER=str(worker),
+                   SHARD_IDS=",".join(str(shard_id) for shard_id in self.ranges[worker]))
+        # In their own session so a Ctrl-C in the terminal only reaches the launcher, which stops each worker once
+        process = subprocess.Popen(self.command, env=env, start_new_session=True)
+        LOGGER.info(f"Started shard worker {worker} (shards {self.ranges[worker]}) as pid {process.pid}")
+        self.workers[worker] = process
+        return process
+
+    def run(self):
+        """Start every worker and supervise them until they all exit cleanly or the launcher is stopped."""
+        print(f"Running {self.shard_count} shards in {len(self.ranges)} processes")
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        restarts: Dict[int, float] = {}  # Worker to when it may start again
+        try:
+            for worker in range(len(self.ranges)):
+                self.spawn(worker)
+            while self.workers or restarts:
+                time.sleep(0.5)
+                for worker, process in list(self.workers.items()):
+                    code = process.poll()
+                    if code is None:
+                        continue
+                    del self.workers[worker]
+                    if code != 0:
+                        LOGGER.error(f"Shard worker {worker} exited with {code}, restarting in {self.restart_delay}s")
+                        restarts[worker] = time.monotonic() + self.restart_delay
+                for worker, when in list(restarts.items()):
+                    if time.monotonic() >= when:
+                        del restarts[worker]
+                        self.spawn(worker)
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self):
+        # Workers treat SIGTERM like Ctrl-C and save their state before exiting
+        for process in self.workers.values():
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.monotonic() + self.stop_timeout
+        for worker, process in self.workers.items():
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                LOGGER.error(f"Shard worker {worker} didn't stop within {self.stop_timeout}s, killing it")
+                process.kill()
+        self.workers.clear()
@@ -0,0 +1,82 @@
+import importlib
+import sys
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+# Imported one at a time, in dependency order, so each one's time doesn't include the ones before it
+IMPORT_PHASES = ['asyncio', 'discord', 'yaml', 'sqlite3', 'envs', 'Bot.UserStore', 'Bot.UserYml', 'Bot.PollRegistry',
+                 'Bot.bot']
+
+
+class StartupProfile(object):
+    """
+    Where the time between starting the process and being able to answer a command goes: each import phase, the
+    connection to Discord, and the first dispatch of each command (including loading its module).
+
+    Does nothing unless enabled, which `main.py --profile-startup` does.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.start = time.perf_counter()
+        self.phases: List[Tuple[str, float, int]] = []
+        self.marks: List[Tuple[str, float]] = []
+        self._dispatched = set()
+
+    def enable(self, start: float = None):
+        """
+        :param start: perf_counter() value the process started at, if taken earlier than this.
+        """
+        self.enabled = True
+        if start is not None:
+            self.start = start
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a block and count the modules it imported."""
+        modules = len(sys.modules)
+        start = time.perf_counter()
+        yield
+        if self.enabled:
+            self.phases.append((name, time.perf_counter() - start, len(sys.modules) - modules))
+
+    def import_modules(self, names: List[str] = None):
+        for name in names if names is not None else IMPORT_PHASES:
+            with self.phase(f"import {name}"):
+                importlib.import_module(name)
+
+    def mark(self, name: str):
+        """Record how long after process start `name` happened."""
+        if self.enabled:
+            self.marks.append((name, time.perf_counter() - self.start))
+
+    def report(self) -> str:
+        lines = ["Startup profile:"]
+        lines += [f"  {name:<32} {seconds * 1000:9.1f} ms  ({modules} modules)" for name, seconds, modules
+                  in self.phases]
+        lines += [f"  {name:<32} {seconds * 1000:9.1f} ms after start" for name, seconds in self.marks]
+        return "\n".join(lines)
+
+    def first_dispatch(self, path: Tuple[str, ...], seconds: float, load_seconds: Optional[float]) -> Optional[str]:
+        """
+        Record a dispatch. Returns a line describing it if it's the first one for this command path.
+        :param load_seconds: Time spent loading the command's module for this dispatch, if it was loaded.
+        """
+        if not self.enabled or path in self._dispatched:
+            return None
+        self._dispatched.add(path)
+        line = f"First dispatch of `{' '.join(path) or 'default'}`: {seconds * 1000:.1f} ms"
+        if load_seconds is not None:
+            line += f" (loading the command: {load_seconds * 1000:.1f} ms)"
+        return line
+
+
+_profile: Optional[StartupProfile] = None
+
+
+def get_startup_profile() -> StartupProfile:
+    global _profile
+    if _profile is None:
+        _profile = StartupProfile()
+    return _profile
@@ -0,0 +1,146 @@
+import struct
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import yaml
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+USER_TAG = u'!User'
+
+
+def make_user(name, uid, muted, deafened):
+    # Imported here since UserYml goes through the store, which uses these codecs
+    from Bot.UserYml import UserYml
+    return UserYml(name, uid, muted, deafened)
+
+
+class _UserFields(dict):
+    """A record's fields, dumped as a `!User` mapping without registering UserYml itself on the dumper."""
+
+
+class UserCodec(ABC):
+    """
+    Converts a UserYml record to bytes and back.
+    """
+    NAME: str = None
+    EXTENSION: str = None
+
+    @abstractmethod
+    def encode(self, user) -> bytes:
+        ...
+
+    @abstractmethod
+    def decode(self, data: bytes):
+        ...
+
+
+class YamlCodec(UserCodec):
+    """
+    The `!User` YAML document format. Uses libyaml's C loader and dumper when PyYAML was built with them, and only
+    ever the safe loader, which builds UserYml records from the `!User` tag without running arbitrary constructors.
+    Documents written by the old `yaml.dump(user)` code are read as is.
+    """
+    NAME = 'yaml'
+    EXTENSION = 'yml'
+
+    def __init__(self, use_libyaml=True):
+        use_libyaml = use_libyaml and yaml.__with_libyaml__
+        base_loader = yaml.CSafeLoader if use_libyaml else yaml.SafeLoader
+        base_dumper = yaml.CSafeDumper if use_libyaml else yaml.SafeDumper
+        self.loader = type('UserLoader', (base_loader,), {})
+        self.dumper = type('UserDumper', (base_dumper,), {})
+        self.loader.add_constructor(USER_TAG, self._construct)
+        self.dumper.add_representer(_UserFields, self._represent)
+
+    @staticmethod
+    def _construct(loader, node):
+        fields = loader.construct_mapping(node)
+        return make_user(fields['name'], fields['uid'], fields['muted'], fields['deafened'])
+
+    def encode(self, user) -> bytes:
+        fields = _UserFields(deafened=user.deafened, muted=user.muted, name=user.name, uid=user.uid)
+        return yaml.dump(fields, Dumper=self.dumper).encode('utf-8')
+
+    @staticmethod
+    def _represent(dumper, fields):
+        return dumper.represent_mapping(USER_TAG, dict(fields))
+
+    def decode(self, data: bytes):
+        return yaml.load(data, Loader=self.loader)
+
+
+class StructCodec(UserCodec):
+    """
+    Compact binary format: uid, muted and deafened as epoch timestamps in a fixed struct, followed by the UTF-8 name.
+    """
+    NAME = 'struct'
+    EXTENSION = 'bin'
+    HEADER = struct.Struct('<QddH')
+
+    def encode(self, user) -> bytes:
+        name = user.name.encode('utf-8')
+        return self.HEADER.pack(user.uid, user.muted.timestamp(), user.deafened.timestamp(), len(name)) + name
+
+    def decode(self, data: bytes):
+        uid, muted, deafened, name_len = self.HEADER.unpack_from(data)
+        name = data[self.HEADER.size:self.HEADER.size + name_len].decode('utf-8')
+        return make_user(name, uid, datetime.fromtimestamp(muted), datetime.fromtimestamp(deafened))
+
+
+class MsgpackCodec(UserCodec):
+    """
+    msgpack array of [uid, name, muted, deafened] with epoch timestamps. Only available if msgpack is installed.
+    """
+    NAME = 'msgpack'
+    EXTENSION = 'msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError("The msgpack codec requires the msgpack package")
+
+    def encode(self, user) -> bytes:
+        return msgpack.packb([user.uid, user.name, user.muted.timestamp(), user.deafened.timestamp()])
+
+    def decode(self, data: bytes):
+        uid, name, muted, deafened = msgpack.unpackb(data)
+        return make_user(name, uid, datetime.fromtimestamp(muted), datetime.fromtimestamp(deafened))
+
+
+CODECS = {
+    YamlCodec.NAME: YamlCodec,
+    StructCodec.NAME: StructCodec,
+    MsgpackCodec.NAME: MsgpackCodec,
+}
+
+_codecs: Dict[str, UserCodec] = {}
+
+
+def get_codec(name: str) -> UserCodec:
+    """Returns a shared instance of the named codec."""
+    codec = _codecs.get(name)
+    if codec is None:
+        codec = _codecs[name] = CODECS[name]()
+    return codec
+
+
+def available_codecs() -> List[UserCodec]:
+    """Every codec that can run here. msgpack is left out if its package isn't installed."""
+    codecs = []
+    for name in CODECS:
+        try:
+            codecs.append(get_codec(name))
+        except RuntimeError:
+            pass
+    return codecs
+
+
+def codec_for_extension(extension: str) -> Optional[UserCodec]:
+    for name, cls in CODECS.items():
+        if cls.EXTENSION == extension:
+            return get_codec(name)
+    return None
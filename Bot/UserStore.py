@@ -0,0 +1,604 @@
+import asyncio
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from argparse import ArgumentParser
+from collections import OrderedDict
+from concurrent.futures import Executor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from envs import LOGGER, USER_STORE_BACKEND, USER_STORE_PATH, USER_CACHE_SIZE, USER_CACHE_TTL, DATETIME_DEFAULT, \
+    USER_CODEC
+from Bot.UserCodec import UserCodec, available_codecs, get_codec, codec_for_extension, make_user
+from Bot.Metrics import get_metrics
+
+GUILDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Guilds')
+STORE_SECONDS = get_metrics().histogram('bot_user_store_seconds', "Member state backend reads and writes", ('op',))
+
+
+class UserStore(ABC):
+    """
+    Storage for per-member state, keyed by (guild_id, user_id).
+    """
+
+    @abstractmethod
+    def get(self, guild_id: int, uid: int):
+        ...
+
+    def put(self, guild_id: int, user):
+        self.put_many(guild_id, [user])
+
+    @abstractmethod
+    def put_many(self, guild_id: int, users: Iterable):
+        ...
+
+    @abstractmethod
+    def delete_many(self, guild_id: int, uids: Iterable[int]):
+        ...
+
+    @abstractmethod
+    def user_ids(self, guild_id: int) -> Set[int]:
+        ...
+
+    @abstractmethod
+    def users(self, guild_id: int) -> List:
+        ...
+
+    def muted_ids(self, guild_id: int) -> Set[int]:
+        """Ids of members with a saved mute, including ones that have expired but haven't been lifted yet."""
+        return {user.uid for user in self.users(guild_id) if user.is_muted()}
+
+    def pending_expiries(self) -> List[Tuple[int, int, Optional[datetime], Optional[datetime]]]:
+        """
+        Every saved mute or deafen across all guilds.
+        :return: (guild_id, uid, muted, deafened) tuples, with None for whichever of the two isn't set.
+        """
+        result = []
+        for guild_id in self.guild_ids():
+            for user in self.users(guild_id):
+                muted = user.muted if user.muted != DATETIME_DEFAULT else None
+                deafened = user.deafened if user.deafened != DATETIME_DEFAULT else None
+                if muted is not None or deafened is not None:
+                    result.append((guild_id, user.uid, muted, deafened))
+        return result
+
+    @abstractmethod
+    def guild_ids(self) -> Set[int]:
+        ...
+
+    @abstractmethod
+    def put_poll(self, message_id: int, poll: Dict):
+        """Save an open poll. `poll` must be JSON serializable."""
+
+    @abstractmethod
+    def delete_poll(self, message_id: int):
+        ...
+
+    @abstractmethod
+    def polls(self) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def delete_guild(self, guild_id: int):
+        """Delete the guild's records and polls."""
+
+    def compact_step(self) -> bool:
+        """
+        Reclaim some of the space left behind by deleted records. Each call does a bounded amount of work.
+        :return: Whether there's more to reclaim.
+        """
+        return False
+
+    def close(self):
+        pass
+
+
+class SqliteUserStore(UserStore):
+    """
+    Default backend. All guilds live in one SQLite database in WAL mode, so a lookup is an indexed read and a full
+    guild reload is a single transaction.
+    """
+
+    def __init__(self, path: str = USER_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._compact_conn: Optional[sqlite3.Connection] = None
+        # Only takes effect when the database is created. Older ones are switched over by their first compaction.
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS users ("
+                           "guild_id INTEGER NOT NULL, "
+                           "uid INTEGER NOT NULL, "
+                           "name TEXT NOT NULL, "
+                           "muted TEXT NOT NULL, "
+                           "deafened TEXT NOT NULL, "
+                           "PRIMARY KEY (guild_id, uid)) WITHOUT ROWID")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS polls ("
+                           "message_id INTEGER PRIMARY KEY, "
+                           "data TEXT NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def _to_user(row):
+        name, uid, muted, deafened = row
+        return make_user(name, uid, datetime.fromisoformat(muted), datetime.fromisoformat(deafened))
+
+    def get(self, guild_id: int, uid: int):
+        with self._lock:
+            row = self._conn.execute("SELECT name, uid, muted, deafened FROM users WHERE guild_id = ? AND uid = ?",
+                                     (guild_id, uid)).fetchone()
+        return self._to_user(row) if row is not None else None
+
+    def put_many(self, guild_id: int, users: Iterable):
+        rows = [(guild_id, user.uid, user.name, user.muted.isoformat(), user.deafened.isoformat()) for user in users]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO users (guild_id, uid, name, muted, deafened) "
+                                   "VALUES (?, ?, ?, ?, ?)", rows)
+
+    def delete_many(self, guild_id: int, uids: Iterable[int]):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM users WHERE guild_id = ? AND uid = ?",
+                                   [(guild_id, uid) for uid in uids])
+
+    def user_ids(self, guild_id: int) -> Set[int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT uid FROM users WHERE guild_id = ?", (guild_id,)).fetchall()
+        return {row[0] for row in rows}
+
+    def users(self, guild_id: int) -> List:
+        with self._lock:
+            rows = self._conn.execute("SELECT name, uid, muted, deafened FROM users WHERE guild_id = ?",
+                                      (guild_id,)).fetchall()
+        return [self._to_user(row) for row in rows]
+
+    def muted_ids(self, guild_id: int) -> Set[int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT uid FROM users WHERE guild_id = ? AND muted != ?",
+                                      (guild_id, DATETIME_DEFAULT.isoformat())).fetchall()
+        return {row[0] for row in rows}
+
+    def pending_expiries(self) -> List[Tuple[int, int, Optional[datetime], Optional[datetime]]]:
+        default = DATETIME_DEFAULT.isoformat()
+        with self._lock:
+            rows = self._conn.execute("SELECT guild_id, uid, muted, deafened FROM users "
+                                      "WHERE muted != ? OR deafened != ?", (default, default)).fetchall()
+        return [(guild_id, uid,
+                 datetime.fromisoformat(muted) if muted != default else None,
+                 datetime.fromisoformat(deafened) if deafened != default else None)
+                for guild_id, uid, muted, deafened in rows]
+
+    def guild_ids(self) -> Set[int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT guild_id FROM users").fetchall()
+        return {row[0] for row in rows}
+
+    def put_poll(self, message_id: int, poll: Dict):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO polls (message_id, data) VALUES (?, ?)",
+                               (message_id, json.dumps(poll)))
+
+    def delete_poll(self, message_id: int):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM polls WHERE message_id = ?", (message_id,))
+
+    def polls(self) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM polls").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delete_guild(self, guild_id: int):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM users WHERE guild_id = ?", (guild_id,))
+            polls = self._conn.execute("SELECT message_id, data FROM polls").fetchall()
+            self._conn.executemany("DELETE FROM polls WHERE message_id = ?",
+                                   [(message_id,) for message_id, data in polls
+                                    if json.loads(data).get('guild_id') == guild_id])
+
+    def compact_step(self, pages: int = 512) -> bool:
+        """
+        Frees up to `pages` unused pages and truncates the WAL once there are none left. Runs on its own connection
+        so the bot's reads carry on meanwhile. A database created before incremental vacuuming was enabled gets one
+        full VACUUM first, once at least a quarter of it is unused.
+        """
+        if self._compact_conn is None:
+            self._compact_conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn = self._compact_conn
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if free and free * 4 >= conn.execute("PRAGMA page_count").fetchone()[0]:
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+        elif free:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            if free > pages:
+                return True
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return False
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            if self._compact_conn is not None:
+                self._compact_conn.close()
+
+
+class YamlUserStore(UserStore):
+    """
+    Legacy backend. One file per member under `Bot/Guilds/<guild_id>/`, as `!User` YAML documents (`<user_id>.yml`)
+    by default or in another codec's format. Files in any known format are read, so switching codecs doesn't
+    require a migration.
+    """
+
+    def __init__(self, path: str = GUILDS_PATH, codec: UserCodec = None):
+        self.path = path
+        self.codec = codec if codec is not None else get_codec(USER_CODEC)
+        # Message id to the guild whose polls file holds it, None for the root file
+        self._poll_files: Dict[int, Optional[int]] = {}
+
+    def guild_path(self, guild_id: int) -> str:
+        return os.path.join(self.path, str(guild_id))
+
+    def user_path(self, guild_id: int, uid: int, codec: UserCodec = None) -> str:
+        codec = codec if codec is not None else self.codec
+        return os.path.join(self.guild_path(guild_id), f"{uid}.{codec.EXTENSION}")
+
+    def _other_codecs(self) -> List[UserCodec]:
+        return [codec for codec in available_codecs() if codec.NAME != self.codec.NAME]
+
+    def get(self, guild_id: int, uid: int):
+        # A record is only ever in one format, the configured codec's unless it was written before a switch
+        for codec in [self.codec] + self._other_codecs():
+            try:
+                with open(self.user_path(guild_id, uid, codec), 'rb') as user_file:
+                    return codec.decode(user_file.read())
+            except FileNotFoundError:
+                pass
+        return None
+
+    def put_many(self, guild_id: int, users: Iterable):
+        os.makedirs(self.guild_path(guild_id), exist_ok=True)
+        others = self._other_codecs()
+        for user in users:
+            with open(self.user_path(guild_id, user.uid), 'wb') as user_file:
+                user_file.write(self.codec.encode(user))
+            # Drop the copy written before a codec switch, or it would be read again after switching back
+            for codec in others:
+                try:
+                    os.remove(self.user_path(guild_id, user.uid, codec))
+                except FileNotFoundError:
+                    pass
+
+    def _user_files(self, guild_id: int) -> List[Tuple[int, str]]:
+        try:
+            names = os.listdir(self.guild_path(guild_id))
+        except FileNotFoundError:
+            return []
+        files = []
+        for name in names:
+            uid, _, extension = name.partition('.')
+            if uid.isdigit() and codec_for_extension(extension) is not None:
+                files.append((int(uid), name))
+        return files
+
+    def delete_many(self, guild_id: int, uids: Iterable[int]):
+        uids = set(uids)
+        for uid, name in self._user_files(guild_id):
+            if uid in uids:
+                os.remove(os.path.join(self.guild_path(guild_id), name))
+
+    def user_ids(self, guild_id: int) -> Set[int]:
+        return {uid for uid, _name in self._user_files(guild_id)}
+
+    def users(self, guild_id: int) -> List:
+        return [user for user in (self.get(guild_id, uid) for uid in self.user_ids(guild_id)) if user is not None]
+
+    def guild_ids(self) -> Set[int]:
+        try:
+            return {int(name) for name in os.listdir(self.path) if name.isdigit()}
+        except FileNotFoundError:
+            return set()
+
+    def _polls_path(self, guild_id: Optional[int] = None) -> str:
+        # Each guild's polls live with its members so sharded processes never rewrite the same file. DM polls, and
+        # polls saved before that, are in the root file.
+        return os.path.join(self.path if guild_id is None else self.guild_path(guild_id), 'polls.json')
+
+    def _read_polls(self, guild_id: Optional[int] = None) -> Dict[str, Dict]:
+        try:
+            with open(self._polls_path(guild_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_polls(self, polls: Dict[str, Dict], guild_id: Optional[int] = None):
+        if not polls:
+            try:
+                os.remove(self._polls_path(guild_id))
+            except FileNotFoundError:
+                pass
+            return
+        os.makedirs(os.path.dirname(self._polls_path(guild_id)), exist_ok=True)
+        with open(self._polls_path(guild_id), 'w') as f:
+            json.dump(polls, f)
+
+    def put_poll(self, message_id: int, poll: Dict):
+        guild_id = self._poll_files.get(message_id, poll.get('guild_id'))
+        polls = self._read_polls(guild_id)
+        polls[str(message_id)] = poll
+        self._write_polls(polls, guild_id)
+        self._poll_files[message_id] = guild_id
+
+    def delete_poll(self, message_id: int):
+        if message_id in self._poll_files:
+            candidates = [self._poll_files.pop(message_id)]
+        else:
+            candidates = [None] + sorted(self.guild_ids())
+        for guild_id in candidates:
+            polls = self._read_polls(guild_id)
+            if polls.pop(str(message_id), None) is not None:
+                self._write_polls(polls, guild_id)
+                return
+
+    def polls(self) -> List[Dict]:
+        polls = []
+        for guild_id in [None] + sorted(self.guild_ids()):
+            for message_id, poll in self._read_polls(guild_id).items():
+                self._poll_files[int(message_id)] = guild_id
+                polls.append(poll)
+        return polls
+
+    def delete_guild(self, guild_id: int):
+        for _uid, name in self._user_files(guild_id):
+            os.remove(os.path.join(self.guild_path(guild_id), name))
+        try:
+            os.remove(os.path.join(self.guild_path(guild_id), 'polls.json'))
+        except FileNotFoundError:
+            pass
+        try:
+            os.rmdir(self.guild_path(guild_id))
+        except OSError:
+            pass
+
+    def compact_step(self) -> bool:
+        """Removes guild directories left empty, so listing guilds only sees ones with records."""
+        for guild_id in self.guild_ids():
+            try:
+                os.rmdir(self.guild_path(guild_id))
+            except OSError:
+                pass  # Not empty
+        return False
+
+
+class CachedUserStore(UserStore):
+    """
+    Read-through cache in front of another backend.
+
+    Records are kept in an LRU bounded by `max_size` entries and `ttl` seconds. Writes go through the cache and
+    refresh any cached copy, so it never serves stale data written by this process. The ids of every member with a
+    record are also kept per guild once loaded, which makes membership reconciliation a set difference. Each guild
+    also gets a precomputed set of muted member ids, so the voice join path can skip the lookup entirely for the
+    (almost always) unmuted member.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, backend: UserStore, max_size: int = 10000, ttl: float = 600):
+        self.backend = backend
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache: OrderedDict[Tuple[int, int], Tuple[float, object]] = OrderedDict()
+        self._muted: Dict[int, Set[int]] = {}
+        self._members: Dict[int, Set[int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    @staticmethod
+    def _timed(op: str, func, *args):
+        """Call the backend, recording how long it took. Cache hits never get here."""
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            STORE_SECONDS.observe(time.perf_counter() - start, op)
+
+    def _remember(self, key: Tuple[int, int], user):
+        self._cache[key] = (time.monotonic() + self.ttl, user)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, guild_id: int, uid: int):
+        key = (guild_id, uid)
+        entry = self._cache.get(key)
+        if entry is not None:
+            expires, user = entry
+            if expires > time.monotonic():
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return None if user is self._MISSING else copy.copy(user)
+            del self._cache[key]
+            self.expirations += 1
+        self.misses += 1
+        user = self._timed('get', self.backend.get, guild_id, uid)
+        self._remember(key, self._MISSING if user is None else user)
+        return copy.copy(user)
+
+    def is_muted(self, guild_id: int, uid: int) -> bool:
+        """Whether the member has a saved mute. Costs no I/O after the guild's first call."""
+        return uid in self.muted_ids(guild_id)
+
+    def put_many(self, guild_id: int, users: Iterable):
+        users = list(users)
+        self._timed('put_many', self.backend.put_many, guild_id, users)
+        self._refresh(guild_id, users)
+
+    async def put_many_async(self, guild_id: int, users: Iterable, executor: Executor = None):
+        """Like put_many, but the backend write runs in `executor`. The cache is only touched on the event loop."""
+        users = list(users)
+        await asyncio.get_running_loop().run_in_executor(executor, self._timed, 'put_many', self.backend.put_many,
+                                                         guild_id, users)
+        self._refresh(guild_id, users)
+
+    def delete_many(self, guild_id: int, uids: Iterable[int]):
+        uids = list(uids)
+        self._timed('delete_many', self.backend.delete_many, guild_id, uids)
+        self._forget(guild_id, uids)
+
+    async def delete_many_async(self, guild_id: int, uids: Iterable[int], executor: Executor = None):
+        uids = list(uids)
+        await asyncio.get_running_loop().run_in_executor(executor, self._timed, 'delete_many',
+                                                         self.backend.delete_many, guild_id, uids)
+        self._forget(guild_id, uids)
+
+    def _forget(self, guild_id: int, uids: List[int]):
+        muted = self._muted.get(guild_id, set())
+        members = self._members.get(guild_id, set())
+        for uid in uids:
+            self._cache.pop((guild_id, uid), None)
+            muted.discard(uid)
+            members.discard(uid)
+
+    def _refresh(self, guild_id: int, users: List):
+        members = self._members.get(guild_id)
+        if members is not None:
+            members.update(user.uid for user in users)
+        muted = self._muted.get(guild_id)
+        for user in users:
+            # Only refresh entries that are already cached, so a bulk reload doesn't churn the whole LRU
+            if (guild_id, user.uid) in self._cache:
+                self._remember((guild_id, user.uid), copy.copy(user))
+            if muted is not None:
+                if user.is_muted():
+                    muted.add(user.uid)
+                else:
+                    muted.discard(user.uid)
+
+    def invalidate(self, guild_id: int, uid: int = None):
+        """Drop cached records for one member, or for a whole guild if no uid is given."""
+        if uid is not None:
+            self._cache.pop((guild_id, uid), None)
+        else:
+            for key in [key for key in self._cache if key[0] == guild_id]:
+                del self._cache[key]
+            self._members.pop(guild_id, None)
+        self._muted.pop(guild_id, None)
+
+    def user_ids(self, guild_id: int) -> Set[int]:
+        """Ids of members with a record. Loaded once per guild and kept up to date, don't modify the result."""
+        members = self._members.get(guild_id)
+        if members is None:
+            members = self._members[guild_id] = self._timed('user_ids', self.backend.user_ids, guild_id)
+        return members
+
+    async def user_ids_async(self, guild_id: int, executor: Executor = None) -> Set[int]:
+        """Like user_ids, but the first load for a guild runs in `executor`."""
+        if guild_id not in self._members:
+            members = await asyncio.get_running_loop().run_in_executor(executor, self._timed, 'user_ids',
+                                                                       self.backend.user_ids, guild_id)
+            self._members.setdefault(guild_id, members)
+        return self._members[guild_id]
+
+    def users(self, guild_id: int) -> List:
+        return self._timed('users', self.backend.users, guild_id)
+
+    def muted_ids(self, guild_id: int) -> Set[int]:
+        muted = self._muted.get(guild_id)
+        if muted is None:
+            muted = self._muted[guild_id] = self._timed('muted_ids', self.backend.muted_ids, guild_id)
+        return muted
+
+    def pending_expiries(self) -> List[Tuple[int, int, Optional[datetime], Optional[datetime]]]:
+        return self._timed('pending_expiries', self.backend.pending_expiries)
+
+    def guild_ids(self) -> Set[int]:
+        return self.backend.guild_ids()
+
+    def put_poll(self, message_id: int, poll: Dict):
+        self._timed('put_poll', self.backend.put_poll, message_id, poll)
+
+    def delete_poll(self, message_id: int):
+        self._timed('delete_poll', self.backend.delete_poll, message_id)
+
+    def polls(self) -> List[Dict]:
+        return self._timed('polls', self.backend.polls)
+
+    def delete_guild(self, guild_id: int):
+        self._timed('delete_guild', self.backend.delete_guild, guild_id)
+        self.invalidate(guild_id)
+
+    async def delete_guild_async(self, guild_id: int, executor: Executor = None):
+        await asyncio.get_running_loop().run_in_executor(executor, self._timed, 'delete_guild',
+                                                         self.backend.delete_guild, guild_id)
+        self.invalidate(guild_id)
+
+    def compact_step(self) -> bool:
+        """Safe to call from another thread, it only touches the backend."""
+        return self._timed('compact', self.backend.compact_step)
+
+    def close(self):
+        self.backend.close()
+
+
+BACKENDS = {
+    'sqlite': SqliteUserStore,
+    'yaml': YamlUserStore,
+}
+
+_store: Optional[CachedUserStore] = None
+
+
+def get_user_store() -> CachedUserStore:
+    """Returns the process-wide, cached user store for the backend selected by USER_STORE_BACKEND."""
+    global _store
+    if _store is None:
+        _store = CachedUserStore(BACKENDS[USER_STORE_BACKEND](), max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+    return _store
+
+
+def migrate(source: UserStore, target: UserStore) -> int:
+    """
+    Copies every guild from one backend to another, one transaction per guild.
+    :return: Number of records copied.
+    """
+    count = 0
+    for guild_id in sorted(source.guild_ids()):
+        users = source.users(guild_id)
+        target.put_many(guild_id, users)
+        count += len(users)
+        LOGGER.info(f"Migrated {len(users)} users for guild {guild_id}")
+    return count
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="python -m Bot.UserStore",
+                            description="Migrate the legacy Bot/Guilds YAML tree into the SQLite user store")
+    parser.add_argument('--guilds', default=GUILDS_PATH, help="Legacy YAML guilds directory")
+    parser.add_argument('--db', default=USER_STORE_PATH, help="SQLite database to write")
+    args = parser.parse_args()
+
+    sqlite_store = SqliteUserStore(args.db)
+    total = migrate(YamlUserStore(args.guilds), sqlite_store)
+    sqlite_store.close()
+    print(f"Migrated {total} users into {args.db}")
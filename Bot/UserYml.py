@@ -1,10 +1,13 @@
 from __future__ import annotations
-import os
 import discord
 import yaml
-import asyncio
 from datetime import datetime, timedelta
+from typing import Optional
 from envs import DATETIME_DEFAULT, LOGGER
+from Bot.UserStore import get_user_store
+from Bot.MuteScheduler import get_mute_scheduler, UNMUTE
+from Bot.RestScheduler import get_rest_scheduler, MODERATION
+from Bot.MemberCache import get_member_cache
 
 
 class UserYml(yaml.YAMLObject):
@@ -12,36 +15,48 @@ class UserYml(yaml.YAMLObject):
 
     def __init__(self, name: str, uid: discord.User.id, muted=DATETIME_DEFAULT, deafened=DATETIME_DEFAULT):
         self.name = name
-        self.uid = uid  # type: int
+        self.uid: int = uid
         self.muted = muted
         self.deafened = deafened
 
     def __repr__(self):
         return f"{self.__class__.__name__!s}(uid={self.uid!r}, muted={self.muted!r}, deafened={self.deafened!r})"
 
-    def get_discord_member(self, guild: discord.Guild) -> discord.Member:
-        return guild.get_member(self.uid)
+    def get_discord_member(self, guild: discord.Guild) -> Optional[discord.Member]:
+        return get_member_cache().get(guild, self.uid)
+
+    async def fetch_discord_member(self, guild: discord.Guild) -> Optional[discord.Member]:
+        """Like get_discord_member, but fetches the member if they aren't cached."""
+        return await get_member_cache().fetch(guild, self.uid)
 
     def is_muted(self):
         return self.muted != DATETIME_DEFAULT
 
+    def is_deafened(self):
+        return self.deafened != DATETIME_DEFAULT
+
     @classmethod
-    async def mute(cls, member: discord.Member, secs: int):
+    async def mute(cls, member: discord.Member, secs: float):
         user = cls.get_user_obj(member)
         await user._mute(member, secs)
 
-    async def _mute(self, member: discord.Member, secs: int):
+    async def _mute(self, member: discord.Member, secs: float):
         LOGGER.info(f"{member.display_name} was muted for {secs} seconds.")
-        await self.connection_check(member.edit, mute=True)
-        self.muted = datetime.now() + timedelta(seconds=secs)
+        # Before muting, so a duration that can't be scheduled doesn't leave the member muted for good
+        expiry = datetime.now() + timedelta(seconds=secs)
+        await self.edit_member(member, mute=True)
+        self.muted = expiry
         self.update_file(member.guild)
+        get_mute_scheduler().schedule(member.guild.id, self.uid, UNMUTE, self.muted)
 
-        await asyncio.sleep(secs)
-
-        unmuted = await self.connection_check(member.edit, mute=False)
+    @classmethod
+    async def expire_mute(cls, member: discord.Member):
+        """Called by the scheduler once a mute runs out."""
+        user = cls.get_user_obj(member)
+        unmuted = await user.edit_member(member, mute=False)
         if unmuted:  # Only update file if successful unmute. This lets the user be properly unmuted later.
-            self.muted = DATETIME_DEFAULT
-            self.update_file(member.guild)
+            user.muted = DATETIME_DEFAULT
+            user.update_file(member.guild)
 
     @classmethod
     async def unmute(cls, member: discord.Member):
@@ -50,36 +65,51 @@ class UserYml(yaml.YAMLObject):
 
     async def _unmute(self, member: discord.Member):
         LOGGER.info(f"{member.display_name} was unmuted.")
-        await self.connection_check(member.edit, mute=False)
+        await self.edit_member(member, mute=False)
         self.muted = DATETIME_DEFAULT
         self.update_file(member.guild)
+        get_mute_scheduler().cancel(member.guild.id, self.uid, UNMUTE)
 
-    def update_file(self, guild: discord.Guild):
+    @classmethod
+    async def expire_deafen(cls, member: discord.Member):
+        """Called by the scheduler once a deafen saved in the user store runs out."""
+        user = cls.get_user_obj(member)
+        if await user.edit_member(member, deafen=False):
+            user.deafened = DATETIME_DEFAULT
+            user.update_file(member.guild)
 
-        guild_path = os.path.abspath(os.path.relpath(os.path.join('Bot', 'Guilds', str(guild.id))))
-        user_path = os.path.join(guild_path, str(self.uid))
-        with open(f'{user_path}.yml', "w") as user_file:
-            user_file.write(yaml.dump(self))
+    def update_file(self, guild: discord.Guild):
+        get_user_store().put(guild.id, self)
 
     @staticmethod
-    async def connection_check(async_func, *args, **kwargs) -> bool:
+    async def connection_check(async_func, *args, route='member', key=None, serial=None, **kwargs) -> bool:
+        """
+        Run a moderation request through the REST scheduler. Returns False instead of raising if Discord refuses it.
+        """
         try:
-            await async_func(*args, **kwargs)
+            await get_rest_scheduler().submit(route, async_func, *args, priority=MODERATION, key=key, serial=serial,
+                                              **kwargs)
             return True
         except discord.HTTPException as e:
             LOGGER.info(e)
             return False
 
+    @classmethod
+    async def edit_member(cls, member: discord.Member, **kwargs) -> bool:
+        # A member's edits are sent in order, one at a time. An edit identical to the last one queued is sent once.
+        serial = ('edit', member.guild.id, member.id)
+        key = serial + tuple(sorted(kwargs.items()))
+        return await cls.connection_check(member.edit, route=f"member:{member.guild.id}", key=key, serial=serial,
+                                          **kwargs)
+
     @staticmethod
     def create_user_from_member(member: discord.Member):
         return UserYml(member.name, member.id)
 
-    @staticmethod
-    def get_user_file(guild: discord.Guild, member: discord.Member):
-        dir_path = os.path.abspath(os.path.relpath(os.path.join('Bot', 'Guilds', str(guild.id), str(member.id)+".yml")))
-        return dir_path
-
     @classmethod
     def get_user_obj(cls, member: discord.Member) -> UserYml:
-        with open(cls.get_user_file(member.guild, member)) as user_file:
-            return yaml.load(user_file, Loader=yaml.Loader)
+        user = get_user_store().get(member.guild.id, member.id)
+        if user is None:
+            # Member joined while we weren't watching, start them off with a clean record
+            user = cls.create_user_from_member(member)
+        return user
@@ -0,0 +1,129 @@
+import re
+from functools import lru_cache
+from typing import List, Optional
+
+# Seconds per unit
+UNITS = {
+    'y': 31536000,
+    'mo': 2628288,
+    'w': 604800,
+    'd': 86400,
+    'h': 3600,
+    'm': 60,
+    's': 1,
+}
+# Accepted spellings of each unit
+_UNIT_WORDS = {
+    'years': 'y', 'year': 'y', 'yrs': 'y', 'yr': 'y', 'y': 'y',
+    'months': 'mo', 'month': 'mo', 'mo': 'mo',
+    'weeks': 'w', 'week': 'w', 'wks': 'w', 'wk': 'w', 'w': 'w',
+    'days': 'd', 'day': 'd', 'd': 'd',
+    'hours': 'h', 'hour': 'h', 'hrs': 'h', 'hr': 'h', 'h': 'h',
+    'minutes': 'm', 'minute': 'm', 'mins': 'm', 'min': 'm', 'm': 'm',
+    'seconds': 's', 'second': 's', 'secs': 's', 'sec': 's', 's': 's',
+}
+MAX_DURATION_LENGTH = 64
+MAX_DURATION = UNITS['y']  # Longer mutes and polls are mistakes, and would overflow datetime arithmetic
+
+# One `<number> <unit word>` term, with whatever separates it from the previous one
+_TERM = re.compile(r'(?:\s*(?:,|and\b))?\s*(\d+)\s*([a-z]+)', re.IGNORECASE)
+_ISO = re.compile(r'P(?:(\d+)Y)?(?:(\d+)M)?(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?',
+                  re.IGNORECASE)
+_ISO_UNITS = (UNITS['y'], UNITS['mo'], UNITS['w'], UNITS['d'], UNITS['h'], UNITS['m'], UNITS['s'])
+
+_FOR = re.compile(r'\s+for\s+', re.IGNORECASE)
+
+
+class VoteSyntaxError(ValueError):
+    """A vote command or duration that doesn't follow the grammar. The message is meant for the user."""
+
+
+@lru_cache(maxsize=1024)
+def parse_duration(text: str) -> int:
+    """
+    Parse a duration into seconds. Accepts a bare number of seconds ("90"), number and unit terms in any
+    spelling ("1h30m", "2 days, 3 hours", "1 hour and 5 minutes") and ISO-8601 durations ("PT1H30M").
+
+    Results are memoized, since the same few durations ("5 minutes", "1 hour") come up again and again.
+    :raises VoteSyntaxError: For anything else, durations longer than MAX_DURATION_LENGTH characters or longer than
+        MAX_DURATION.
+    """
+    seconds = _parse_seconds(text.strip())
+    if seconds > MAX_DURATION:
+        raise VoteSyntaxError("Durations can be at most a year.")
+    return seconds
+
+
+def _parse_seconds(text: str) -> int:
+    if not text:
+        raise VoteSyntaxError("No duration given.")
+    if len(text) > MAX_DURATION_LENGTH:
+        raise VoteSyntaxError(f"Durations can be at most {MAX_DURATION_LENGTH} characters.")
+    if text.isdigit():
+        return int(text)
+
+    if text[0] in 'pP':
+        match = _ISO.fullmatch(text)
+        if match is not None and match.lastindex is not None:
+            return sum(int(value) * unit for value, unit in zip(match.groups(), _ISO_UNITS) if value is not None)
+        raise VoteSyntaxError(f"`{text}` is not a valid duration.")
+
+    seconds = 0
+    pos = 0
+    while pos < len(text):
+        match = _TERM.match(text, pos)
+        unit = _UNIT_WORDS.get(match.group(2).lower()) if match is not None else None
+        if unit is None:
+            raise VoteSyntaxError(f"`{text}` is not a valid duration. Try something like `1h30m` or `2 days`.")
+        seconds += int(match.group(1)) * UNITS[unit]
+        pos = match.end()
+    return seconds
+
+
+class PollArgs(object):
+    __slots__ = ('question', 'answers', 'duration')
+
+    def __init__(self, question: str, answers: List[str], duration: Optional[int]):
+        self.question = question
+        self.answers = answers
+        self.duration = duration
+
+
+class MuteArgs(object):
+    __slots__ = ('target', 'duration', 'poll_duration')
+
+    def __init__(self, target: str, duration: Optional[int], poll_duration: Optional[int]):
+        self.target = target
+        self.duration = duration
+        self.poll_duration = poll_duration
+
+
+def parse_poll(text: str) -> PollArgs:
+    """
+    Parse `<question> | <answer 1>, <answer 2>, ... [| <duration>]`.
+    :raises VoteSyntaxError:
+    """
+    sections = text.split('|')
+    if not 2 <= len(sections) <= 3:
+        raise VoteSyntaxError("Vote format is `vote <question> | <answer 1>, <answer 2>, ... [| <duration>]`")
+    question = sections[0].strip()
+    if not question:
+        raise VoteSyntaxError("You did not ask a question.")
+    answers = [answer.strip() for answer in sections[1].split(',')] if not sections[1].isspace() else []
+    duration = sections[2] if len(sections) == 3 and sections[2] and not sections[2].isspace() else None
+    return PollArgs(question, answers, parse_duration(duration) if duration is not None else None)
+
+
+def parse_mute(text: str) -> MuteArgs:
+    """
+    Parse `<member> [for <duration>] [| <poll duration>]`.
+    :raises VoteSyntaxError:
+    """
+    sections = text.split('|')
+    if len(sections) > 2:
+        raise VoteSyntaxError("Vote format is `vote mute <@member> [for <duration>] [| <poll duration>]`")
+    words = _FOR.split(sections[0], 1)
+    duration = words[1] if len(words) == 2 and words[1] and not words[1].isspace() else None
+    poll = sections[1] if len(sections) == 2 and sections[1] and not sections[1].isspace() else None
+    return MuteArgs(words[0].strip(), parse_duration(duration) if duration is not None else None,
+                    parse_duration(poll) if poll is not None else None)
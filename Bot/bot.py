@@ -1,104 +1,339 @@
-import os
+import time
+import signal
+import logging
 import discord
 import envs
 import asyncio
-from typing import Dict
+from contextlib import AsyncExitStack
 from datetime import datetime, timedelta
+from typing import Dict
 
-from envs import CLIENT, LOGGER
-from Bot.Commands.Command import Command
+from envs import LOGGER
+from Bot.BotHost import BotSettings, bot_settings, default_settings, find_guild, host_bot, hosted_clients, \
+    load_bot_settings
+from Bot.CommandRouter import CommandRouter, CommandRegistry
 from Bot.UserYml import UserYml
-
-# Required so that all other commands are correctly listed as subclasses of the Command class
-# Might be worth rewriting to be dynamic
-from Bot.Commands.DefaultCommand import DefaultCommand
-from Bot.Commands.HelpCommand import HelpCommand
-from Bot.Commands.VoteCommand import VoteCommand
+from Bot.UserStore import get_user_store
+from Bot.DriveSync import close_sync_worker
+from Bot.GrdnStore import close_grdn_store
+from Bot.MuteScheduler import get_mute_scheduler, UNMUTE, UNDEAFEN
+from Bot.PollRegistry import get_poll_registry
+from Bot.RestScheduler import get_rest_scheduler, send, COSMETIC
+from Bot.CommandThrottle import get_command_throttle, OVERLOAD
+from Bot.StartupProfile import get_startup_profile
+from Bot.Metrics import get_metrics
+from Bot.Sharding import get_shard_plan
+from Bot.MemberCache import get_member_cache, lazy_members
+from Bot.LogPipeline import get_log_pipeline
+from Bot.GuildLifecycle import get_guild_lifecycle
+# Member events use its helpers, the command itself is still loaded through the registry
 from Bot.Commands.UsersCommand import UsersCommand
-from Bot.Commands.AVCommand import AVCommand
 
+COMMAND_SECONDS = get_metrics().histogram('bot_command_seconds', "Time to run a command",
+                                          ('command', 'subcommand', 'outcome'))
 
-def command_factory() -> Dict[str, Command]:
+
+def command_factory(client: discord.Client = None) -> CommandRouter:
     """
-    Gets all command types and returns them in a dict with their id as keys
-    and the class instance itself as the value.
+    Creates the router for a bot's commands, every command in COMMAND_MODULES unless its settings list fewer. Commands
+    are imported, instantiated and compiled into the router the first time they're used. Command modules are imported
+    once per process, whichever bot uses them first.
+    :param client: The bot's client, envs.CLIENT if not given.
     :return:
     """
+    client = client or envs.CLIENT
+    settings = bot_settings(client)
+    return CommandRouter(CommandRegistry(client, settings.command_modules), settings.prefix, on_command=record_command)
 
-    subclasses = Command.__subclasses__()
-    cmd_dict = {}
-    for cls in subclasses:
-        cmd_dict[cls.ID] = cls(CLIENT)
-    cmd_dict['help'].set_help_dict(cmd_dict)
-    return cmd_dict
 
+def message_fields(msg: discord.Message) -> dict:
+    """Log fields identifying where a message came from."""
+    guild = getattr(msg, 'guild', None)
+    return {'guild': guild.id if guild is not None else None, 'channel': msg.channel.id, 'author': msg.author.id}
 
-async def message_handler(command_dict: Dict[str, Command], msg: discord.Message):
-    word_list = msg.content.split()
-    try:
-        await command_dict[word_list[1]].execute(msg)
-    except (KeyError, IndexError) as e:
-        await command_dict['default'].execute(msg)
-        LOGGER.error(e)
+
+def record_command(invocation, seconds: float, failed: bool):
+    path = invocation.path or ('default',)
+    outcome = 'error' if failed else 'ok'
+    COMMAND_SECONDS.observe(seconds, path[0], " ".join(path[1:]), outcome)
+    # Failures aren't sampled. Their traceback is logged by discord.py.
+    level = logging.WARNING if failed else logging.INFO
+    LOGGER.log(level, f"{invocation.message.content} ran in {seconds * 1000:.1f}ms",
+               extra=dict(message_fields(invocation.message), bot=bot_settings(invocation.command.client).name,
+                          category='command', command=path[0],
+                          subcommand=" ".join(path[1:]), outcome=outcome, latency_ms=round(seconds * 1000, 3)))
+
+
+def register_metrics():
+    """Gauges read when metrics are rendered."""
+    metrics = get_metrics()
+    metrics.gauge('bot_gateway_latency_seconds', "Discord gateway heartbeat latency of each bot", ('bot',),
+                  func=lambda: {(bot_settings(client).name,): client.latency for client in hosted_clients()})
+    if envs.SHARD_COUNT:
+        metrics.gauge('bot_shard_latency_seconds', "Gateway heartbeat latency of each shard this process runs",
+                      ('bot', 'shard'), func=lambda: {(bot_settings(client).name, shard_id): latency
+                                                      for client in hosted_clients()
+                                                      for shard_id, latency in client.latencies})
+    metrics.gauge('bot_asyncio_tasks', "Tasks on the event loop", func=lambda: len(asyncio.all_tasks()))
+    metrics.gauge('bot_open_polls', "Polls waiting to close", func=lambda: len(get_poll_registry()))
+    metrics.gauge('bot_pending_mutes', "Mute and deafen expiries waiting to fire",
+                  func=lambda: len(get_mute_scheduler()))
+    metrics.gauge('bot_rest_queue_depth', "Discord requests waiting to be sent",
+                  func=lambda: get_rest_scheduler().queue_depth)
+    metrics.gauge('bot_rest_wait_seconds', "Time Discord requests waited before being sent", ('lane', 'stat'),
+                  func=lambda: {(lane, stat): value for lane, wait in get_rest_scheduler().stats()['wait'].items()
+                                for stat, value in wait.items() if stat != 'count'})
+    metrics.gauge('bot_user_cache', "Member state cache", ('stat',),
+                  func=lambda: {(stat,): value for stat, value in get_user_store().stats().items()})
+    metrics.gauge('bot_member_cache', "Members fetched on demand with MEMBER_CACHE=lazy", ('stat',),
+                  func=lambda: {('size',): len(get_member_cache()), ('hits',): get_member_cache().hits,
+                                ('fetches',): get_member_cache().fetches})
+    metrics.gauge('bot_commands_in_flight', "Commands running now",
+                  func=lambda: get_command_throttle().in_flight)
+    metrics.gauge('bot_log_records', "Log records waiting to be written, and dropped by a full queue or sampling",
+                  ('stat',), func=lambda: {(stat,): value for stat, value in log_pipeline_stats().items()})
+
+
+def log_pipeline_stats() -> Dict[str, int]:
+    pipeline = get_log_pipeline()
+    return pipeline.stats() if pipeline is not None else {}
+
+
+async def message_handler(router: CommandRouter, msg: discord.Message):
+    profile = get_startup_profile()
+    if not profile.enabled:
+        if await router.dispatch(msg) is None:
+            log_rejected(msg)
+        return
+    loaded = set(router.registry.load_times)
+    start = time.perf_counter()
+    invocation = await router.dispatch(msg)
+    if invocation is None:
+        log_rejected(msg)
+    else:
+        new = [cmd_id for cmd_id in router.registry.load_times if cmd_id not in loaded]
+        load_time = sum(router.registry.load_times[cmd_id] for cmd_id in new) if new else None
+        line = profile.first_dispatch(invocation.path, time.perf_counter() - start, load_time)
+        if line is not None:
+            print(line)
+            LOGGER.info(line)
+
+
+def command_id(content: str, prefix: str) -> str:
+    """The top level command a prefixed message names, without routing it."""
+    words = content[len(prefix):].split(None, 1)
+    return words[0] if words else ''
+
+
+async def throttled(msg: discord.Message, prefix: str) -> bool:
+    """
+    Whether a command has to be turned away. Turned away commands are logged (sampled like the rest) and their
+    author is told at most once in a while, so a flood doesn't turn into a flood of replies.
+    """
+    throttle = get_command_throttle()
+    reason = throttle.admit(msg.author.id, msg.channel.id, command_id(msg.content, prefix))
+    if reason is None:
+        return False
+    LOGGER.info(f"{msg.content} throttled ({reason})",
+                extra=dict(message_fields(msg), category='command.throttled', reason=reason))
+    if throttle.should_notify(msg.author.id):
+        text = "I'm busy, try again in a moment." if reason == OVERLOAD else "You're sending commands too fast, " \
+                                                                             "try again in a few seconds."
+        await send(msg.channel, f"{msg.author.mention} {text}", priority=COSMETIC)
+    return True
+
+
+def log_rejected(msg: discord.Message):
+    # Mistyped commands are one short line each, and sampled with the rest of their category
+    LOGGER.info(f"{msg.content} rejected", extra=dict(message_fields(msg), category='command.rejected'))
 
 
 async def on_voice_join(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
-    user = UserYml.get_user_obj(member)  # type: UserYml
+    # Nearly everyone joining isn't muted, and checking that doesn't touch the disk
+    if not get_user_store().is_muted(member.guild.id, member.id):
+        return
+    user: UserYml = UserYml.get_user_obj(member)
     if user.is_muted():  # Saved date-time of User is not DATETIME_DEFAULT
         if user.muted <= datetime.now():  # User is muted and should not be anymore
             await user.unmute(member)
         elif not after.mute:  # User file says they should be muted, but they actually aren't.
-            secs = user.muted - datetime.now()  # type: timedelta
-            await user.mute(member, secs.seconds)
+            secs: timedelta = user.muted - datetime.now()
+            await user.mute(member, secs.total_seconds())
+
+
+def expiry_handler(expire):
+    """
+    Wraps a UserYml expire method as a scheduler handler. Members that can't be found (left the guild, or the guild
+    is gone) keep their saved state, which on_voice_join applies when they're next seen. Members the client doesn't
+    cache are fetched.
+    """
+    async def handler(guild_id: int, uid: int):
+        guild = find_guild(guild_id)
+        member = await get_member_cache().fetch(guild, uid) if guild is not None else None
+        if member is not None:
+            await expire(member)
+    return handler
 
 
 async def on_voice_leave(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
     pass
 
 
-def load_bot(args):
-    cmd_dict = command_factory()
+def register_events(router: CommandRouter):
+    """
+    Registers the Discord event handlers on the client of the router's bot. Split from load_bot so the offline
+    benchmarks can drive the handlers with a stand-in client.
+    """
+    client = router.registry.client
+    prefix = router.prefix
 
-    @CLIENT.event
+    @client.event
     async def on_ready():
         print('Connected.')
-        LOGGER.info(f'{envs.CLIENT.user} has connected to Discord!')
-        for guild in CLIENT.guilds:
+        LOGGER.info(f'{client.user} has connected to Discord! ({get_shard_plan()})')
+        profile = get_startup_profile()
+        if profile.enabled and not profile.marks:
+            profile.mark('Connected.')
+            print(profile.report())
+            LOGGER.info(profile.report())
+        scheduler = get_mute_scheduler()
+        scheduler.register(UNMUTE, expiry_handler(UserYml.expire_mute))
+        scheduler.register(UNDEAFEN, expiry_handler(UserYml.expire_deafen))
+        scheduler.restore(client)
+        scheduler.start()
+        get_guild_lifecycle().start()
+        await get_poll_registry().restore(client)
+        if lazy_members():
+            # There are no member lists to reconcile with. Records are created as members show up, and
+            # `users reload` pages through a guild's members when asked to.
+            return
+        for guild in client.guilds:
             UsersCommand.safe_reload(guild=guild)
 
-    @CLIENT.event
+    @client.event
     async def on_message(message):
         # Ignore messages sent by self
-        if message.author == envs.CLIENT.user:
+        if message.author == client.user:
             return
 
-        if message.content.startswith(envs.ACTIVATION_PREFIX):
-            LOGGER.info(f'{message.content} received')
-            if message.content.endswith(envs.ACTIVATION_PREFIX):
-                await message.channel.send(f'For help, please type `{envs.ACTIVATION_PREFIX} help`')
+        if message.content.startswith(prefix):
+            if await throttled(message, prefix):
                 return
-            await message_handler(cmd_dict, message)
+            try:
+                # Commands are logged once they've run, with how long they took
+                if message.content.endswith(prefix):
+                    await send(message.channel, f'For help, please type `{prefix} help`')
+                    return
+                await message_handler(router, message)
+            finally:
+                get_command_throttle().release()
 
-    @CLIENT.event
+    @client.event
     async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
         if before.channel is None and after.channel is not None:
             await on_voice_join(member, before, after)
         elif before.channel is not None and after.channel is None:
             await on_voice_leave(member, before, after)
 
-    @CLIENT.event
+    @client.event
+    async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
+        get_poll_registry().on_reaction(payload, 1)
+
+    @client.event
+    async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
+        get_poll_registry().on_reaction(payload, -1)
+
+    @client.event
     async def on_guild_join(guild: discord.Guild):
-        await UsersCommand.reload(guild=guild)
+        # A guild the bot was in before gets its old records back, mutes included, before the new members are added
+        await get_guild_lifecycle().guild_joined(guild)
+        UsersCommand.safe_reload(guild=guild)
 
-    @CLIENT.event
+    @client.event
     async def on_guild_remove(guild: discord.Guild):
-        cur_path = os.path.dirname(__file__)
-        file_path = os.path.relpath(f'.\\Guilds\\{guild.id}', cur_path)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        await get_guild_lifecycle().guild_removed(guild)
 
-    @CLIENT.event
+    @client.event
     async def on_member_join(member: discord.Member):
-        await UsersCommand.add_user(member.guild, member)
+        UsersCommand.add_user(member.guild, member)
+
+    @client.event
+    async def on_member_remove(member: discord.Member):
+        get_member_cache().forget(member.guild.id, member.id)
+        UsersCommand.remove_user(member.guild, member)
+
+    @client.event
+    async def on_raw_member_remove(payload: discord.RawMemberRemoveEvent):
+        # on_member_remove is only sent for members the client had cached, which with MEMBER_CACHE=lazy is few
+        if isinstance(payload.user, discord.Member):
+            return
+        guild = client.get_guild(payload.guild_id)
+        if guild is not None:
+            get_member_cache().forget(guild.id, payload.user.id)
+            UsersCommand.remove_user(guild, payload.user)
+
+    @client.event
+    async def on_member_update(before: discord.Member, after: discord.Member):
+        get_member_cache().update(after)
+        if before.name != after.name:
+            UsersCommand.rename_user(after.guild, after)
 
-    CLIENT.run(envs.TOKEN)
+    @client.event
+    async def on_user_update(before: discord.User, after: discord.User):
+        # Username changes arrive here rather than in on_member_update
+        if before.name != after.name:
+            for guild in after.mutual_guilds:
+                UsersCommand.rename_user(guild, after)
+
+
+def add_bot(settings: BotSettings, client: discord.Client = None) -> discord.Client:
+    """
+    Sets up one bot identity in this process: a client of its own, registered with its settings, and a router and
+    event handlers for it. Everything else is shared with the other bots.
+    :param client: The client to use, a new one if not given.
+    """
+    client = client or envs.new_client()
+    host_bot(client, settings)
+    register_events(command_factory(client))
+    return client
+
+
+def load_bot(args):
+    if args.bots:
+        clients = [add_bot(settings) for settings in load_bot_settings(args.bots)]
+    else:
+        clients = [add_bot(default_settings(), envs.CLIENT)]
+    register_metrics()
+
+    async def start(client: discord.Client):
+        try:
+            await client.start(bot_settings(client).token)
+        except discord.LoginFailure as e:
+            # The other bots keep running
+            LOGGER.error(f"Bot {bot_settings(client).name} could not log in: {e}")
+
+    async def runner():
+        async with AsyncExitStack() as stack:
+            for client in clients:
+                await stack.enter_async_context(client)
+            try:
+                # Sharded processes each serve their own metrics, on consecutive ports
+                get_metrics().start(envs.METRICS_PORT + envs.SHARD_WORKER if envs.METRICS_PORT else 0)
+                get_startup_profile().mark('Connecting to Discord')
+                await asyncio.gather(*(start(client) for client in clients))
+            finally:
+                # Don't lose GRDN edits that are still unflushed or inside the upload debounce window
+                get_mute_scheduler().stop()
+                get_guild_lifecycle().stop()
+                get_rest_scheduler().stop()
+                await close_grdn_store()
+                await close_sync_worker()
+                get_user_store().close()
+                await get_metrics().stop()
+
+    # Stop requests (the shard launcher, service managers) shut down as cleanly as Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(runner())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,132 @@
+"""
+Plays the GRDN activation sequence to two users against fake Discord objects and counts the REST calls: the old
+fetch-user-then-send for every message, the script player with cached DM channels, and the player editing the
+progress dots into the previous message. Like discord.py, the fake client keeps DM channels once opened, so the old
+way opens each one once too. Pauses are skipped and route limits lifted so only the calls are timed.
+
+Run from the repository root: `python -m benchmarks.activation_bench --latency 0.05`
+"""
+import asyncio
+import time
+from argparse import ArgumentParser
+from collections import Counter
+
+from Bot import RestScheduler
+from Bot.Commands.AVCommand import ACTIVATION_SCRIPT
+from Bot.DirectMessages import DMChannels
+from Bot.ScriptPlayer import ScriptPlayer
+
+UIDS = (1, 2)
+
+
+class FakeMessage(object):
+    def __init__(self, client, content):
+        self.client = client
+        self.content = content
+
+    async def edit(self, content):
+        await self.client.call('edit')
+        self.content = content
+
+
+class FakeChannel(object):
+    def __init__(self, client, uid):
+        self.client = client
+        self.id = 1000 + uid
+        self.messages = []
+
+    async def send(self, content):
+        await self.client.call('send')
+        message = FakeMessage(self.client, content)
+        self.messages.append(message)
+        return message
+
+
+class FakeUser(object):
+    """Like discord.User, sending opens the user's DM channel unless the client already has it."""
+
+    def __init__(self, client, uid):
+        self.client = client
+        self.id = uid
+
+    @property
+    def dm_channel(self):
+        return self.client.private_channels.get(self.id)
+
+    async def create_dm(self):
+        return await self.client.create_dm(self)
+
+    async def send(self, content):
+        channel = self.dm_channel or await self.create_dm()
+        return await channel.send(content)
+
+
+class FakeClient(object):
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = Counter()
+        # discord.py keeps DM channels on the connection state, so every User object for the same id shares them
+        self.private_channels = {}
+
+    async def call(self, name):
+        self.calls[name] += 1
+        await asyncio.sleep(self.latency)
+
+    def get_user(self, uid):
+        return None  # Not in the member cache, so it has to be fetched
+
+    async def fetch_user(self, uid):
+        await self.call('fetch_user')
+        return FakeUser(self, uid)
+
+    async def create_dm(self, user):
+        channel = self.private_channels.get(user.id)
+        if channel is None:
+            await self.call('create_dm')
+            channel = self.private_channels[user.id] = FakeChannel(self, user.id)
+        return channel
+
+
+async def play_legacy(client: FakeClient, _edit):
+    rest = RestScheduler.get_rest_scheduler()
+    for step in ACTIVATION_SCRIPT:
+        for uid in UIDS:
+            user = await rest.submit("user:fetch", client.fetch_user, uid, key=("fetch_user", uid))
+            await RestScheduler.send(user, step.text)
+
+
+async def play_player(client: FakeClient, edit):
+    await ScriptPlayer(DMChannels(client), UIDS, edit_in_place=edit, time_scale=0).play(ACTIVATION_SCRIPT)
+
+
+async def bench(name, play, latency, edit=False, baseline: int = None) -> int:
+    client = FakeClient(latency)
+    start = time.perf_counter()
+    await play(client, edit)
+    elapsed = time.perf_counter() - start
+    total = sum(client.calls.values())
+    calls = ", ".join(f"{count} {call}" for call, count in sorted(client.calls.items()))
+    saved = f", {1 - total / baseline:4.0%} fewer" if baseline else ""
+    messages = sum(len(channel.messages) for channel in client.private_channels.values())
+    print(f"{name:>22}: {total:3d} calls ({calls}), {messages} messages, {elapsed:6.2f}s{saved}")
+    return total
+
+
+async def run(latency):
+    baseline = await bench('fetch and send', play_legacy, latency)
+    await bench('script player', play_player, latency, baseline=baseline)
+    await bench('script player, edits', play_player, latency, edit=True, baseline=baseline)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.05, help="Simulated REST round trip in seconds")
+    args = parser.parse_args()
+
+    for route in RestScheduler.ROUTE_LIMITS:
+        RestScheduler.ROUTE_LIMITS[route] = (10 ** 6, 1.0)
+    asyncio.run(run(args.latency))
+
+
+if __name__ == '__main__':
+    main()
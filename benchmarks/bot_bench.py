@@ -0,0 +1,321 @@
+"""
+Drives the bot's event handlers offline with the stand-ins in benchmarks/fake_discord.py, no token or network needed.
+
+Scenarios, in order:
+- startup: downloading every guild's members (unless `--member-cache lazy`) and on_ready, including reconciling
+  every guild's member records (a full write on the first run)
+- messages: on_message with a mix of chatter and commands
+- flood: one member spamming `vote` while others use `help`, reporting the others' latency
+- voice: on_voice_state_update joins, `--muted` of them by members with a saved mute
+- expiry: those saved mutes running out
+- join: on_member_join
+- reload: `users reload` of every guild
+
+Each reports throughput, p50/p99 latency per event, the REST calls made and the process's peak RSS so far. Events are
+sent at `--rate` per second, or as fast as `--concurrency` concurrent senders allow if the rate is 0. Discord's route
+limits in RestScheduler and the command throttle are lifted unless `--discord-limits` and `--throttle` are given, so
+the numbers are the bot's own cost.
+
+Member state goes to a temporary database. Run from the repository root:
+`python -m benchmarks.bot_bench --guilds 3 --members 20000 --events 5000`
+
+With `--processes P` the scenarios run in P processes at once, each with its own guilds like a shard worker, sharing
+one database. Their combined throughput is printed at the end.
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, SUPPRESS
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from benchmarks import fake_discord
+from benchmarks.fake_discord import FakeClient, FakeMember, FakeMessage, FakeVoiceState
+
+MESSAGE_MIX = [
+    # (weight, template), {p} is the prefix
+    (10, "anyone up for the raid tonight?"),
+    (3, "{p} vote Raid night? | Friday, Saturday, Sunday | 5 minutes"),
+    (1, "{p} help"),
+    (1, "{p} users reload safe"),
+    (1, "{p} definitely not a command"),
+    (1, "{p}"),
+]
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+async def drive(event, count: int, rate: float, concurrency: int):
+    """
+    Run `event(i)` for i in range(count) and time each call.
+    :return: Per-event latencies, the exceptions events raised and the total elapsed time.
+    """
+    latencies = []
+    errors = []
+
+    async def one(i):
+        start = time.perf_counter()
+        try:
+            await event(i)
+        except Exception as e:
+            errors.append(e)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    if rate > 0:
+        tasks = []
+        for i in range(count):
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.get_running_loop().create_task(one(i)))
+        await asyncio.gather(*tasks)
+    else:
+        counter = iter(range(count))
+
+        async def sender():
+            for i in counter:
+                await one(i)
+        await asyncio.gather(*(sender() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def report(name: str, unit: str, latencies, errors, elapsed: float, client: FakeClient, calls_before) -> Tuple:
+    """Print a scenario's line and return its (count, elapsed) for --processes."""
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) if latencies else 0.0
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0.0
+    calls = client.calls - calls_before
+    print(f"{name:>9}: {len(latencies):7d} {unit:<8} {len(latencies) / elapsed:10.0f}/s  "
+          f"p50 {p50 * 1000:8.3f}ms  p99 {p99 * 1000:8.3f}ms  {sum(calls.values()):6d} REST calls  "
+          f"peak RSS {peak_rss_mb():7.1f}MB" + (f"  {len(errors)} errors ({errors[0]!r})" if errors else ""))
+    return len(latencies), elapsed
+
+
+async def run(args, client: FakeClient):
+    import envs
+    from Bot.bot import command_factory, expiry_handler, register_events, register_metrics
+    from Bot.Commands.UsersCommand import UsersCommand
+    from Bot.Metrics import get_metrics
+    from Bot.UserStore import get_user_store
+    from Bot.UserYml import UserYml
+
+    rng = random.Random(args.seed)
+    register_metrics()
+    register_events(command_factory())
+    handlers = client.handlers
+    for _ in range(args.guilds):
+        client.add_guild(args.members)
+    weights = [weight for weight, _template in MESSAGE_MIX]
+    templates = [template for _weight, template in MESSAGE_MIX]
+
+    # startup
+    calls = client.calls.copy()
+    start = time.perf_counter()
+    if client.cache_members:
+        await asyncio.gather(*(guild.chunk() for guild in client.guilds))
+    before = asyncio.all_tasks()
+    await handlers['on_ready']()
+    reconciles = [task for task in asyncio.all_tasks() - before
+                  if getattr(task.get_coro(), '__qualname__', '') == 'reconcile_guild']
+    await asyncio.gather(*reconciles)
+    elapsed = time.perf_counter() - start
+    results = {'startup': report('startup', 'runs', [elapsed], [], elapsed, client, calls)}
+    if client.cache_members:
+        print(f"{'':>11}{args.guilds * args.members} members cached and reconciled, "
+              f"{args.guilds * args.members / elapsed:.0f} members/s")
+
+    # messages
+    async def message(i):
+        guild = rng.choice(client.guilds)
+        template = rng.choices(templates, weights)[0]
+        author = guild.member(rng.choice(guild.roster))
+        content = template.format(p=envs.ACTIVATION_PREFIX)
+        await handlers['on_message'](FakeMessage(rng.choice(guild.text_channels), author, content))
+    calls = client.calls.copy()
+    latencies, errors, elapsed = await drive(message, args.events, args.rate, args.concurrency)
+    results['messages'] = report('messages', 'events', latencies, errors, elapsed, client, calls)
+
+    # flood, nine in ten commands from one member in one channel. Sent at 100/s unless --rate is set, since the other
+    # members' commands would be a flood of their own as fast as possible.
+    from Bot.CommandThrottle import get_command_throttle
+    from Bot.PollRegistry import get_poll_registry
+    spam_guild = client.guilds[0]
+    spammer = spam_guild.member(spam_guild.roster[0])
+    others = []
+    rejected = sum(get_command_throttle().rejected.values())
+    polls = len(get_poll_registry())
+
+    async def flood(i):
+        if i % 10:
+            content = "{p} vote Raid night? | Friday, Saturday, Sunday | 5 minutes".format(p=envs.ACTIVATION_PREFIX)
+            await handlers['on_message'](FakeMessage(spam_guild.text_channels[0], spammer, content))
+            return
+        guild = rng.choice(client.guilds)
+        author = guild.member(rng.choice(guild.roster))
+        start = time.perf_counter()
+        message = FakeMessage(rng.choice(guild.text_channels), author, f"{envs.ACTIVATION_PREFIX} help")
+        await handlers['on_message'](message)
+        others.append(time.perf_counter() - start)
+    calls = client.calls.copy()
+    _latencies, errors, elapsed = await drive(flood, args.events, args.rate or 100, args.concurrency)
+    results['flood'] = report('flood', 'others', others, errors, elapsed, client, calls)
+    print(f"{'':>11}{args.events - len(others)} spammed, {sum(get_command_throttle().rejected.values()) - rejected} "
+          f"turned away, {len(get_poll_registry()) - polls} polls opened")
+
+    # voice, after saving mutes for some members
+    store = get_user_store()
+    muted_until = datetime.now() + timedelta(hours=1)
+    muted: List[Tuple] = []
+    for guild in client.guilds:
+        users = []
+        for uid in rng.sample(guild.roster, int(len(guild.roster) * args.muted)):
+            user = UserYml.create_user_from_member(guild.member(uid))
+            user.muted = muted_until
+            users.append(user)
+            muted.append((guild, uid))
+        store.put_many(guild.id, users)
+
+    async def voice(i):
+        guild = rng.choice(client.guilds)
+        member = guild.member(rng.choice(guild.roster))
+        guild.cache(member)  # Members in a voice channel are always cached
+        before, member.voice = FakeVoiceState(), FakeVoiceState(guild.voice_channels[0])
+        await handlers['on_voice_state_update'](member, before, member.voice)
+    calls = client.calls.copy()
+    latencies, errors, elapsed = await drive(voice, args.events, args.rate, args.concurrency)
+    results['voice'] = report('voice', 'events', latencies, errors, elapsed, client, calls)
+
+    # expiry, of mutes held by members who may since have left the cache
+    expire = expiry_handler(UserYml.expire_mute)
+
+    async def expiry(i):
+        guild, uid = muted[i]
+        await expire(guild.id, uid)
+    calls = client.calls.copy()
+    latencies, errors, elapsed = await drive(expiry, min(args.events, len(muted)), args.rate, args.concurrency)
+    results['expiry'] = report('expiry', 'mutes', latencies, errors, elapsed, client, calls)
+
+    # join
+    async def join(i):
+        guild = rng.choice(client.guilds)
+        member = FakeMember(client, guild)
+        guild.add_member(member)
+        await handlers['on_member_join'](member)
+    calls = client.calls.copy()
+    latencies, errors, elapsed = await drive(join, args.events, args.rate, args.concurrency)
+    results['join'] = report('join', 'events', latencies, errors, elapsed, client, calls)
+
+    # reload, one guild at a time
+    async def reload(i):
+        await UsersCommand.reload(client.guilds[i]).task
+    calls = client.calls.copy()
+    latencies, errors, elapsed = await drive(reload, len(client.guilds), 0, 1)
+    results['reload'] = report('reload', 'guilds', latencies, errors, elapsed, client, calls)
+    members = sum(guild.member_count for guild in client.guilds)
+    print(f"{'':>11}{members} members, {members / elapsed:.0f} members/s")
+
+    print(f"{'':>11}{sum(len(guild.members) for guild in client.guilds)} of {members} members cached")
+    if args.metrics:
+        print("\n".join(get_metrics().summary('bot_')))
+    return results
+
+
+def run_processes(args, tmp: str):
+    """Run the benchmark in `args.processes` worker processes sharing `tmp` and print their combined throughput."""
+    procs = [subprocess.Popen([sys.executable, '-m', 'benchmarks.bot_bench'] + sys.argv[1:] + ['--worker', str(i)],
+                              env=dict(os.environ, BOT_BENCH_DIR=tmp)) for i in range(args.processes)]
+    if any(proc.wait() for proc in procs):
+        raise SystemExit("A worker failed")
+    results = []
+    for i in range(args.processes):
+        with open(os.path.join(tmp, f'results-{i}.json')) as f:
+            results.append(json.load(f))
+    print(f"\n{args.processes} processes combined:")
+    for name in results[0]:
+        count = sum(result[name][0] for result in results)
+        elapsed = max(result[name][1] for result in results)
+        print(f"{name:>9}: {count:7d} in {elapsed:7.2f}s  {count / elapsed:10.0f}/s")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--guilds', type=int, default=3)
+    parser.add_argument('--members', type=int, default=20000, help="Members per guild")
+    parser.add_argument('--events', type=int, default=5000, help="Events per scenario")
+    parser.add_argument('--rate', type=float, default=0, help="Events per second, 0 for as fast as possible")
+    parser.add_argument('--concurrency', type=int, default=16, help="Concurrent senders when --rate is 0")
+    parser.add_argument('--muted', type=float, default=0.01, help="Fraction of members with a saved mute")
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated REST round trip in seconds")
+    parser.add_argument('--backend', choices=('sqlite', 'yaml'), default='sqlite', help="Member state backend")
+    parser.add_argument('--member-cache', choices=('full', 'lazy'), default='full', help="MEMBER_CACHE mode")
+    parser.add_argument('--discord-limits', action='store_true', help="Keep Discord's route limits")
+    parser.add_argument('--throttle', action='store_true', help="Keep the command throttle (THROTTLE_* settings)")
+    parser.add_argument('--metrics', action='store_true', help="Print the bot's own metrics at the end")
+    parser.add_argument('--processes', type=int, default=1, help="Worker processes sharing one database")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--worker', type=int, default=-1, help=SUPPRESS)
+    args = parser.parse_args()
+
+    shared = os.environ.get('BOT_BENCH_DIR')
+    tmp = shared or tempfile.mkdtemp(prefix='bot-bench-')
+    if args.processes > 1 and args.worker < 0:
+        try:
+            run_processes(args, tmp)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return
+    if args.worker >= 0:
+        # Like separate shards: each worker has its own guilds, with ids that don't collide in the shared database
+        fake_discord._ids = itertools.count(10 ** 17 + args.worker * 10 ** 12)
+        args.seed += args.worker
+        print(f"[worker {args.worker}]")
+    # Before anything reads envs
+    os.environ['USER_STORE_PATH'] = os.path.join(tmp, 'user_state.db')
+    os.environ['USER_STORE_BACKEND'] = args.backend
+    os.environ['MEMBER_CACHE'] = args.member_cache
+    os.environ['DRIVE_BACKEND'] = 'fake'
+    os.environ['FAKE_DRIVE_DIR'] = os.path.join(tmp, 'drive')
+    os.environ['LOG_FILE'] = os.path.join(tmp, f'bot{max(args.worker, 0)}.log')
+    os.environ.setdefault('PREFIX', '!cc')
+    if not args.throttle:
+        for name in ('THROTTLE_USER', 'THROTTLE_CHANNEL', 'THROTTLE_COMMANDS', 'THROTTLE_IN_FLIGHT'):
+            os.environ[name] = '0'
+    import envs
+    envs.start_logging()  # Logging is part of what a command costs
+    client = FakeClient(args.latency, cache_members=args.member_cache == 'full')
+    envs.CLIENT = client
+    from Bot import RestScheduler, UserStore
+    if args.backend == 'yaml':
+        # The yaml backend's directory isn't configurable, so put the process-wide store in place directly
+        UserStore._store = UserStore.CachedUserStore(UserStore.YamlUserStore(os.path.join(tmp, 'Guilds')),
+                                                     max_size=envs.USER_CACHE_SIZE, ttl=envs.USER_CACHE_TTL)
+    if not args.discord_limits:
+        for route in RestScheduler.ROUTE_LIMITS:
+            RestScheduler.ROUTE_LIMITS[route] = (10 ** 9, 1.0)
+        RestScheduler.DEFAULT_LIMIT = (10 ** 9, 1.0)
+
+    try:
+        results = asyncio.run(run(args, client))
+        if args.worker >= 0:
+            with open(os.path.join(tmp, f'results-{args.worker}.json'), 'w') as f:
+                json.dump(results, f)
+    finally:
+        UserStore.get_user_store().close()
+        if not shared:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
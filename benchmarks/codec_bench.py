@@ -0,0 +1,78 @@
+"""
+Encodes and decodes UserYml records with every available codec, plus the original `yaml.dump` / `yaml.Loader`
+path for reference.
+
+Run from the repository root: `python -m benchmarks.codec_bench --records 100000`
+"""
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+
+import yaml
+
+from envs import DATETIME_DEFAULT
+from Bot.UserYml import UserYml
+from Bot.UserCodec import CODECS, YamlCodec, get_codec
+
+
+class LegacyYaml(object):
+    """What UserYml used before codecs: pure-Python dump and the full, unsafe loader."""
+    NAME = 'yaml (legacy)'
+
+    @staticmethod
+    def encode(user):
+        return yaml.dump(user).encode('utf-8')
+
+    @staticmethod
+    def decode(data):
+        return yaml.load(data, Loader=yaml.Loader)
+
+
+class PureYaml(YamlCodec):
+    """The yaml codec without libyaml, to show how much of the win is the safe loader vs the C extension."""
+    NAME = 'yaml (pure)'
+
+    def __init__(self):
+        super().__init__(use_libyaml=False)
+
+
+def make_records(count):
+    # Every 50th member is muted, roughly what a busy guild looks like
+    muted = datetime.now().replace(microsecond=0) + timedelta(hours=1)
+    return [UserYml(f"member{i}", 100000000000000000 + i, muted if i % 50 == 0 else DATETIME_DEFAULT)
+            for i in range(count)]
+
+
+def bench(codec, records):
+    start = time.perf_counter()
+    encoded = [codec.encode(user) for user in records]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = [codec.decode(data) for data in encoded]
+    decode_time = time.perf_counter() - start
+
+    assert decoded[-1].uid == records[-1].uid and decoded[-1].muted == records[-1].muted
+    size = sum(len(data) for data in encoded)
+    print(f"{codec.NAME:>16}: encode {encode_time:7.3f}s, decode {decode_time:7.3f}s, "
+          f"{size / len(records):6.1f} bytes/record")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--records', type=int, default=100000)
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    codecs = [LegacyYaml(), PureYaml()]
+    for name in CODECS:
+        try:
+            codecs.append(get_codec(name))
+        except RuntimeError as e:
+            print(f"{name:>16}: skipped, {e}")
+    for codec in codecs:
+        bench(codec, records)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Compares blocking Drive uploads made inside coroutines with the background sync worker, using the fake Drive
+backend so no network or credentials are needed.
+
+Run from the repository root: `python -m benchmarks.drive_sync_bench --writes 20 --latency 0.2`
+"""
+import asyncio
+import os
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from Bot.DriveSync import DriveSyncWorker, FakeDriveBackend
+
+
+async def measure_lag(stop: asyncio.Event, results: list, interval=0.005):
+    """Records how late the loop wakes up a task that asks to sleep for `interval` seconds."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        results.append(time.perf_counter() - start - interval)
+
+
+async def run_blocking(backend, writes, gap):
+    for _ in range(writes):
+        backend.upload()
+        await asyncio.sleep(gap)
+
+
+async def run_worker(backend, writes, gap):
+    worker = DriveSyncWorker(backend, debounce=gap * 4)
+    for _ in range(writes):
+        worker.request_upload()
+        await asyncio.sleep(gap)
+    await worker.close()
+
+
+async def bench(name, func, backend, writes, gap):
+    stop = asyncio.Event()
+    lags = []
+    lag_task = asyncio.create_task(measure_lag(stop, lags))
+    start = time.perf_counter()
+    await func(backend, writes, gap)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await lag_task
+    print(f"{name:>10}: {elapsed:7.3f}s total, {backend.uploads:3d} uploads, "
+          f"max loop lag {max(lags) * 1000:8.1f}ms, mean loop lag {sum(lags) / len(lags) * 1000:6.2f}ms")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--writes', type=int, default=20, help="Number of GRDN writes to simulate")
+    parser.add_argument('--latency', type=float, default=0.2, help="Simulated Drive round trip in seconds")
+    parser.add_argument('--gap', type=float, default=0.01, help="Seconds between writes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        local = os.path.join(tmp, 'grdn_data.pkl')
+        with open(local, 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+        for name, func in (('blocking', run_blocking), ('worker', run_worker)):
+            backend = FakeDriveBackend(local, os.path.join(tmp, 'remote'), latency=args.latency)
+            asyncio.run(bench(name, func, backend, args.writes, args.gap))
+
+
+if __name__ == '__main__':
+    main()
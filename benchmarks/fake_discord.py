@@ -0,0 +1,224 @@
+"""
+In-process stand-ins for the parts of discord.py the bot uses, for the offline benchmarks. Every REST call sleeps
+for the client's `rest_latency` and is counted in `client.calls`.
+
+A guild's member list is kept "on Discord's side" as bare ids. Member objects only exist in the client once
+`chunk()` downloads all of them (the default member cache) or as events and fetches bring them in (MEMBER_CACHE=lazy),
+so the benchmark's memory use follows what the client caches.
+"""
+import asyncio
+import itertools
+from collections import Counter
+from typing import Dict, List, Optional
+
+_ids = itertools.count(10 ** 17)
+
+
+def next_id() -> int:
+    return next(_ids)
+
+
+class FakeClient(object):
+    def __init__(self, rest_latency: float = 0.0, cache_members: bool = True):
+        """
+        :param cache_members: Like the default member cache: `chunk()` caches every member and joins are cached.
+        Otherwise only members in a voice channel are, like MEMBER_CACHE=lazy.
+        """
+        self.rest_latency = rest_latency
+        self.cache_members = cache_members
+        self.calls = Counter()
+        self.handlers: Dict[str, object] = {}
+        self.guilds: List[FakeGuild] = []
+        self.user = FakeUser(self, "Crew Bot", bot=True)
+        self.latency = 0.05
+        self._channels: Dict[int, FakeTextChannel] = {}
+        self._users: Dict[int, FakeUser] = {}
+
+    def event(self, func):
+        self.handlers[func.__name__] = func
+        return func
+
+    async def rest(self, call: str):
+        self.calls[call] += 1
+        if self.rest_latency:
+            await asyncio.sleep(self.rest_latency)
+
+    def add_guild(self, members: int, text_channels=5) -> 'FakeGuild':
+        guild = FakeGuild(self)
+        for _ in range(text_channels):
+            channel = FakeTextChannel(self, guild)
+            guild.text_channels.append(channel)
+            self._channels[channel.id] = channel
+        guild.enroll(members)
+        self.guilds.append(guild)
+        return guild
+
+    def is_ready(self) -> bool:
+        return True
+
+    def is_closed(self) -> bool:
+        return False
+
+    def get_guild(self, guild_id: int) -> Optional['FakeGuild']:
+        return next((guild for guild in self.guilds if guild.id == guild_id), None)
+
+    def get_channel(self, channel_id: int) -> Optional['FakeTextChannel']:
+        return self._channels.get(channel_id)
+
+    def get_user(self, uid: int) -> Optional['FakeUser']:
+        return self._users.get(uid)
+
+    async def fetch_user(self, uid: int) -> 'FakeUser':
+        await self.rest('fetch_user')
+        return self._users.get(uid) or FakeUser(self, str(uid), uid=uid)
+
+
+class FakeUser(object):
+    def __init__(self, client: FakeClient, name: str, uid: int = None, bot=False):
+        self.client = client
+        self.id = uid if uid is not None else next_id()
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.mutual_guilds: List[FakeGuild] = []
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMember(FakeUser):
+    def __init__(self, client: FakeClient, guild: 'FakeGuild', name: str = None, uid: int = None):
+        uid = uid if uid is not None else next_id()
+        super().__init__(client, name or f"member{uid % 100000}", uid)
+        self.guild = guild
+        self.voice: Optional[FakeVoiceState] = None
+        self.mutual_guilds = [guild]
+
+    async def edit(self, **kwargs):
+        await self.client.rest('member.edit')
+        if self.voice is not None:
+            self.voice.mute = kwargs.get('mute', self.voice.mute)
+            self.voice.deaf = kwargs.get('deafen', self.voice.deaf)
+
+
+class FakeVoiceChannel(object):
+    def __init__(self, guild: 'FakeGuild'):
+        self.id = next_id()
+        self.guild = guild
+        self.members: List[FakeMember] = []
+
+
+class FakeVoiceState(object):
+    def __init__(self, channel: Optional[FakeVoiceChannel] = None, mute=False, deaf=False):
+        self.channel = channel
+        self.mute = mute
+        self.deaf = deaf
+
+
+class FakeGuild(object):
+    def __init__(self, client: FakeClient):
+        self.client = client
+        self.id = next_id()
+        self.name = f"guild{self.id % 100000}"
+        self.roster: List[int] = []  # Every member's id, as Discord knows them
+        self._roster = set()
+        self._members: Dict[int, FakeMember] = {}  # The client's member cache
+        self.chunked = False
+        self.text_channels: List[FakeTextChannel] = []
+        self.voice_channels = [FakeVoiceChannel(self)]
+
+    @property
+    def members(self) -> List[FakeMember]:
+        return list(self._members.values())
+
+    @property
+    def member_count(self) -> int:
+        return len(self.roster)
+
+    def enroll(self, count: int):
+        """Add members to the guild without the client knowing about them yet."""
+        uids = [next_id() for _ in range(count)]
+        self.roster += uids
+        self._roster.update(uids)
+
+    def add_member(self, member: FakeMember):
+        """A member joining while the client watches."""
+        self.roster.append(member.id)
+        self._roster.add(member.id)
+        if self.client.cache_members:
+            self._members[member.id] = member
+
+    def cache(self, member: FakeMember):
+        self._members[member.id] = member
+
+    def member(self, uid: int) -> FakeMember:
+        """The member as an event would carry them: the cached object, or one built from the event's payload."""
+        return self._members.get(uid) or FakeMember(self.client, self, uid=uid)
+
+    def get_member(self, uid: int) -> Optional[FakeMember]:
+        return self._members.get(uid)
+
+    async def chunk(self, per_request: int = 1000):
+        """Download and cache every member, like discord.py does for each guild before on_ready."""
+        for i in range(0, len(self.roster), per_request):
+            if self.client.rest_latency:
+                await asyncio.sleep(self.client.rest_latency)
+            for uid in self.roster[i:i + per_request]:
+                self._members[uid] = FakeMember(self.client, self, uid=uid)
+        self.chunked = True
+
+    async def fetch_member(self, uid: int) -> FakeMember:
+        await self.client.rest('guild.fetch_member')
+        if uid not in self._roster:
+            raise LookupError(f"Unknown member {uid}")
+        return FakeMember(self.client, self, uid=uid)
+
+    async def fetch_members(self, limit: int = None, per_request: int = 1000):
+        for i in range(0, len(self.roster), per_request):
+            await self.client.rest('guild.fetch_members')
+            for uid in self.roster[i:i + per_request]:
+                yield FakeMember(self.client, self, uid=uid)
+
+
+class FakeTextChannel(object):
+    def __init__(self, client: FakeClient, guild: FakeGuild):
+        self.client = client
+        self.id = next_id()
+        self.guild = guild
+        self.messages: Dict[int, FakeMessage] = {}
+
+    async def send(self, content: str) -> 'FakeMessage':
+        await self.client.rest('channel.send')
+        message = FakeMessage(self, self.client.user, content)
+        # Only the bot's messages are kept (polls look them up again), and only the last few hundred
+        self.messages[message.id] = message
+        if len(self.messages) > 500:
+            del self.messages[next(iter(self.messages))]
+        return message
+
+    async def fetch_message(self, message_id: int) -> 'FakeMessage':
+        await self.client.rest('channel.fetch_message')
+        return self.messages[message_id]
+
+
+class FakeMessage(object):
+    def __init__(self, channel: FakeTextChannel, author: FakeUser, content: str, mentions: List[FakeMember] = ()):
+        self.id = next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.mentions = list(mentions)
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        await self.channel.client.rest('message.add_reaction')
+
+    async def edit(self, content: str = None):
+        await self.channel.client.rest('message.edit')
+        if content is not None:
+            self.content = content
@@ -0,0 +1,127 @@
+"""
+Compares syncing GRDN changes by uploading the whole pickle with uploading a journal of changes, using the fake Drive
+backend so no network or credentials are needed. Also has two instances edit the same knowledge base and checks
+whose changes survive.
+
+Run from the repository root: `python -m benchmarks.grdn_journal_bench --entries 5000 --changes 200`
+"""
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from Bot.DriveSync import FakeDriveBackend, FakeRemoteFile
+from Bot.GrdnJournal import JournalBackend, journal_path
+from Bot.GrdnStore import GrdnStore, DATA_KEY, KNOWN_DATA_KEY
+
+WORDS = "alpha beta gamma delta epsilon zeta theta kappa lambda sigma omega garden root leaf stem seed".split()
+
+
+def make_snapshot(path: str, entries: int, rng: random.Random):
+    data = {f"key{i}": " ".join(rng.choices(WORDS, k=30)) for i in range(entries)}
+    with open(path, 'wb') as f:
+        pickle.dump({DATA_KEY: data, KNOWN_DATA_KEY: sorted(data)}, f)
+
+
+class Instance(object):
+    """One bot's local copy and the backend it syncs with."""
+
+    def __init__(self, root: str, name: str, seed_path: str, remote_dir: str, mode: str, latency: float,
+                 compact_ops: int):
+        local = os.path.join(root, name, 'grdn_data.pkl')
+        os.makedirs(os.path.dirname(local))
+        shutil.copyfile(seed_path, local)
+        self.journal = mode == 'journal'
+        self.store = GrdnStore(local, journal=self.journal)
+        if self.journal:
+            self.remotes = (FakeRemoteFile(remote_dir, 'grdn_data.pkl', latency),
+                            FakeRemoteFile(remote_dir, os.path.basename(journal_path(local)), latency))
+            self.backend = JournalBackend(*self.remotes, local, compact_ops)
+        else:
+            self.backend = FakeDriveBackend(local, remote_dir, latency)
+            self.uploaded = 0
+
+    @property
+    def bytes_uploaded(self) -> int:
+        return sum(remote.bytes_uploaded for remote in self.remotes) if self.journal else self.uploaded
+
+    def sync(self):
+        if self.store.flush():
+            if not self.journal:
+                self.uploaded += os.path.getsize(self.store.path)
+            if self.backend.upload():
+                self.store.reload()
+
+    def refresh(self):
+        if self.backend.download():
+            self.store.reload()
+
+
+def change(store: GrdnStore, i: int, rng: random.Random):
+    if i % 4 == 0:
+        store.add(f"new{i}", " ".join(rng.choices(WORDS, k=10)))
+    else:
+        store.append(rng.choice(list(store.data)), f"note{i}")
+
+
+def bench_cost(mode: str, args, seed_path: str):
+    with tempfile.TemporaryDirectory() as tmp:
+        rng = random.Random(1)
+        instance = Instance(tmp, 'a', seed_path, os.path.join(tmp, 'remote'), mode, args.latency, args.compact_ops)
+        start = time.perf_counter()
+        for i in range(args.changes):
+            change(instance.store, i, rng)
+            instance.sync()
+        elapsed = time.perf_counter() - start
+        print(f"{mode:>9}: {elapsed / args.changes * 1000:7.2f}ms and {instance.bytes_uploaded / args.changes:10.0f} "
+              f"bytes uploaded per change")
+
+
+def bench_conflict(mode: str, args, seed_path: str):
+    """Two instances take turns making a change and syncing, then both refresh."""
+    with tempfile.TemporaryDirectory() as tmp:
+        rng = random.Random(2)
+        remote = os.path.join(tmp, 'remote')
+        instances = [Instance(tmp, name, seed_path, remote, mode, args.latency, args.compact_ops)
+                     for name in ('a', 'b')]
+        for instance in instances:
+            instance.store.reload()
+        expected = set()
+        for i in range(args.conflict_changes):
+            instance = instances[i % 2]
+            key = f"{'ab'[i % 2]}{i}"
+            instance.store.add(key, " ".join(rng.choices(WORDS, k=10)))
+            expected.add(key)
+            instance.sync()
+        for instance in instances:
+            instance.refresh()
+        kept = [len(expected & set(instance.store.data)) for instance in instances]
+        same = instances[0].store.data == instances[1].store.data
+        print(f"{mode:>9}: {kept[0]}/{len(expected)} and {kept[1]}/{len(expected)} changes kept by the two instances, "
+              f"{'identical' if same else 'different'} copies")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--entries', type=int, default=5000, help="Keys in the knowledge base")
+    parser.add_argument('--changes', type=int, default=200, help="Changes to make, each flushed and synced")
+    parser.add_argument('--conflict-changes', type=int, default=20, help="Changes made by two instances in turn")
+    parser.add_argument('--compact-ops', type=int, default=500, help="Journal entries folded into a snapshot at once")
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated Drive round trip in seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_path = os.path.join(tmp, 'seed.pkl')
+        make_snapshot(seed_path, args.entries, random.Random(0))
+        print(f"Knowledge base of {args.entries} keys, {os.path.getsize(seed_path)} bytes")
+        for mode in ('snapshot', 'journal'):
+            bench_cost(mode, args, seed_path)
+        for mode in ('snapshot', 'journal'):
+            bench_conflict(mode, args, seed_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Times GRDN search, key completion and index maintenance on a synthetic knowledge base, next to a linear scan over
+every entry (the only way to find anything before the index) and the old list-based `hidden_keys`.
+
+Run from the repository root: `python -m benchmarks.grdn_search_bench --entries 5000`
+"""
+import random
+import statistics
+import time
+from argparse import ArgumentParser
+
+from Bot.GrdnIndex import GrdnIndex
+
+SYLLABLES = [onset + vowel + coda for onset in ("", "b", "br", "c", "d", "g", "h", "l", "m", "n", "r", "s", "th", "v")
+             for vowel in "aeiou" for coda in ("", "l", "n", "r", "x")]
+
+
+def make_vocabulary(size: int, rng: random.Random):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_data(entries: int, words, rng: random.Random):
+    # Word frequencies in real notes are heavily skewed, so draw text words from a Zipf-like distribution
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    data = {}
+    while len(data) < entries:
+        key = "-".join(rng.sample(words, 2))
+        data[key] = " ".join(rng.choices(words, weights, k=rng.randint(10, 60)))
+    return data
+
+
+def timed(func, args_list):
+    times = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return statistics.median(times), times[int(len(times) * 0.99)]
+
+
+def report(name, result):
+    median, p99 = result
+    print(f"{name:>28}: median {median * 1e6:9.1f}us, p99 {p99 * 1e6:9.1f}us")
+
+
+def linear_search(data, query):
+    words = query.lower().split()
+    return [key for key, value in data.items() if any(word in key or word in value for word in words)]
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--entries', type=int, default=5000)
+    parser.add_argument('--vocabulary', type=int, default=5000, help="Distinct words in the synthetic text")
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = make_vocabulary(args.vocabulary, rng)
+    data = make_data(args.entries, words, rng)
+    keys = list(data)
+    known = set(rng.sample(keys, len(keys) // 2))
+
+    start = time.perf_counter()
+    index = GrdnIndex.build(data)
+    print(f"{'build (on load)':>28}: {(time.perf_counter() - start) * 1000:9.1f}ms for {len(data)} entries")
+
+    queries = [(" ".join(rng.sample(words, 2)), known) for _ in range(args.queries)]
+    prefixes = [(rng.choice(keys)[:rng.randint(2, 8)], known) for _ in range(args.queries)]
+    typos = []
+    for _ in range(args.queries):
+        key = rng.choice(keys)
+        i = rng.randrange(len(key))
+        typos.append((key[:i] + key[i + 1:], known))
+
+    report('search', timed(index.search, queries))
+    report('linear scan', timed(linear_search, [(data, query) for query, _known in queries[:100]]))
+    report('complete (prefix)', timed(index.complete, prefixes))
+    report('fuzzy (one char missing)', timed(index.fuzzy, typos))
+
+    updates = [(key, data[key] + " " + rng.choice(words)) for key in rng.sample(keys, min(args.queries, len(keys)))]
+    report('put (append a word)', timed(index.put, updates))
+    report('remove + re-add', timed(lambda key, value: (index.remove(key), index.put(key, value)), updates))
+
+    known_list = list(known)
+    report('hidden_keys, old list', timed(lambda: [key for key in data if key not in known_list], [()] * 5))
+    report('hidden_keys, set', timed(lambda: [key for key in data if key not in known], [()] * 5))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Floods a logger from an event loop and times the calls: a plain FileHandler (the old `basicConfig` setup), and the
+queued pipeline in Bot/LogPipeline.py with and without sampling. Each record carries the fields a command log does.
+`--disk-latency` makes every write that much slower, like a busy disk or a network filesystem.
+
+Run from the repository root: `python -m benchmarks.log_bench --records 20000 --disk-latency 0.0002`
+"""
+import asyncio
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from Bot.LogPipeline import LogPipeline
+
+FIELDS = dict(category='command', guild=123456789012345678, channel=234567890123456789, author=345678901234567890,
+              command='vote', subcommand='poll', outcome='ok', latency_ms=1.234)
+
+
+def slow_down(handler: logging.Handler, latency: float):
+    if latency:
+        emit = handler.emit
+
+        def slow_emit(record):
+            time.sleep(latency)
+            emit(record)
+        handler.emit = slow_emit
+
+
+async def flood(logger: logging.Logger, records: int):
+    """Log `records` records, yielding to the loop every 100 like a busy bot would."""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(records):
+        before = time.perf_counter()
+        logger.info("!cc vote poll Raid night? | Friday | Saturday ran in 1.2ms", extra=FIELDS)
+        latencies.append(time.perf_counter() - before)
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    return latencies, time.perf_counter() - start
+
+
+def lines(path: str) -> int:
+    total = 0
+    for name in os.listdir(os.path.dirname(path)):
+        if name.startswith(os.path.basename(path)):
+            with open(os.path.join(os.path.dirname(path), name), 'rb') as f:
+                total += sum(1 for _ in f)
+    return total
+
+
+def report(name: str, latencies, elapsed: float, written: int, drain: float):
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)]
+    p50 = statistics.median(latencies)
+    print(f"{name:>18}: {len(latencies) / elapsed:9.0f} records/s on the loop  p50 {p50 * 1e6:7.1f}us  "
+          f"p99 {p99 * 1e6:8.1f}us  {written:6d} written  {drain:5.2f}s to drain")
+
+
+def run(name: str, tmp: str, records: int, disk_latency: float, **options):
+    path = os.path.join(tmp, name.replace(' ', '_') + '.log')
+    logger = logging.getLogger(f'bench.{name}')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if options.pop('plain', False):
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
+        slow_down(handler, disk_latency)
+        logger.addHandler(handler)
+        latencies, elapsed = asyncio.run(flood(logger, records))
+        start = time.perf_counter()
+        handler.close()
+    else:
+        pipeline = LogPipeline(path, **options)
+        slow_down(pipeline.file_handler, disk_latency)
+        logger.addHandler(pipeline.handler)
+        pipeline.listener.start()
+        latencies, elapsed = asyncio.run(flood(logger, records))
+        start = time.perf_counter()
+        pipeline.listener.stop()
+        pipeline.file_handler.close()
+    report(name, latencies, elapsed, lines(path), time.perf_counter() - start)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--disk-latency', type=float, default=0.0002, help="Seconds added to every write")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='log-bench-')
+    try:
+        run('file handler', tmp, args.records, args.disk_latency, plain=True)
+        run('pipeline', tmp, args.records, args.disk_latency, sample_rate=0, queue_size=args.records)
+        run('pipeline, sampled', tmp, args.records, args.disk_latency)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
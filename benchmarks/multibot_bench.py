@@ -0,0 +1,98 @@
+"""
+Compares the memory of running several bots as separate processes with hosting them all in one process
+(Bot/BotHost.py), using the stand-ins in benchmarks/fake_discord.py so no tokens or network are needed.
+
+Each bot gets its own guilds, connects (on_ready), and runs a few commands so their modules are loaded. The
+separate-process run starts one process per bot and adds up their peak RSS.
+
+Run from the repository root: `python -m benchmarks.multibot_bench --bots 4 --members 2000`
+"""
+import asyncio
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser, SUPPRESS
+
+from benchmarks.fake_discord import FakeClient, FakeMessage
+
+COMMANDS = ("help", "vote mute @someone 1", "users", "av grdn help", "metrics")
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+async def host(args):
+    from Bot.BotHost import BotSettings
+    from Bot.bot import add_bot, register_metrics
+
+    clients = []
+    for i in range(args.child):
+        client = FakeClient()
+        for _ in range(args.guilds):
+            client.add_guild(args.members)
+        add_bot(BotSettings(f"bot{i}", "token", f"!b{i}"), client)
+        clients.append(client)
+    register_metrics()
+    for client in clients:
+        await asyncio.gather(*(guild.chunk() for guild in client.guilds))
+        await client.handlers['on_ready']()
+        channel = client.guilds[0].text_channels[0]
+        author = client.guilds[0].members[0]
+        for command in COMMANDS:
+            await client.handlers['on_message'](FakeMessage(channel, author, f"!b{clients.index(client)} {command}"))
+    await asyncio.sleep(0.1)
+
+
+def run_child(args):
+    tmp = tempfile.mkdtemp(prefix='multibot-bench-')
+    # Before anything reads envs
+    os.environ['USER_STORE_PATH'] = os.path.join(tmp, 'user_state.db')
+    os.environ['DRIVE_BACKEND'] = 'fake'
+    os.environ['FAKE_DRIVE_DIR'] = os.path.join(tmp, 'drive')
+    os.environ['LOG_FILE'] = os.path.join(tmp, 'bot.log')
+    os.environ.setdefault('PREFIX', '!cc')
+    import envs
+    envs.start_logging()
+    try:
+        asyncio.run(host(args))
+        from Bot.UserStore import get_user_store
+        get_user_store().close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    print(f"{peak_rss_mb():.1f}")
+
+
+def measure(args, bots: int) -> float:
+    """Peak RSS in MB of a process hosting `bots` bots."""
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.multibot_bench', '--child', str(bots),
+                             '--guilds', str(args.guilds), '--members', str(args.members)],
+                            check=True, capture_output=True, text=True).stdout
+    return float(output.split()[-1])
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--bots', type=int, default=4, help="Bots to run")
+    parser.add_argument('--guilds', type=int, default=1, help="Guilds each bot is in")
+    parser.add_argument('--members', type=int, default=2000, help="Members of each guild")
+    parser.add_argument('--child', type=int, default=0, help=SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args)
+        return
+
+    one = measure(args, 1)
+    separate = sum(measure(args, 1) for _ in range(args.bots))
+    hosted = measure(args, args.bots)
+    print(f"one bot:                {one:7.1f}MB")
+    print(f"{args.bots} bots, {args.bots} processes: {separate:7.1f}MB, {separate / args.bots:6.1f}MB per bot")
+    extra = (hosted - one) / max(args.bots - 1, 1)
+    print(f"{args.bots} bots, one process: {hosted:7.1f}MB, {extra:6.1f}MB per extra bot")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Routes synthetic command messages with the command router and with the old split-and-dict dispatch, without
+executing the commands, to compare the cost of finding the command and its arguments.
+
+Run from the repository root: `python -m benchmarks.router_bench --messages 1000000`
+"""
+import time
+from argparse import ArgumentParser
+from types import SimpleNamespace
+
+from envs import ACTIVATION_PREFIX
+from Bot.bot import command_factory
+
+TEMPLATES = [
+    "{p} vote What should we play tonight? | Valorant, League, Minecraft, Stardew | 5 minutes",
+    "{p} vote mute <@123456789012345678> for 10 minutes | 2 minutes",
+    "{p} vote unmute <@123456789012345678>",
+    "{p} av grdn get gauntlight",
+    "{p} av grdn add belcorra -h The last of the Haruvex line, sealed away beneath the lighthouse for centuries.",
+    "{p} av grdn list -all",
+    "{p} help",
+    "{p} users reload safe",
+    "{p} definitely not a command",
+]
+
+
+class LegacyDispatch(object):
+    """
+    What bot.message_handler, VoteCommand.execute and AVCommand.execute did before the router, plus the argument
+    extraction GrdnData's handlers did. Bad commands were also logged as errors, which isn't counted here.
+    """
+
+    def __init__(self, commands):
+        self.commands = commands
+
+    def route(self, msg):
+        word_list = msg.content.split()
+        try:
+            cmd = self.commands[word_list[1]]
+        except (KeyError, IndexError):
+            return self.commands['default'], None
+        if cmd.ID in ('vote', 'av'):
+            sub_string = ' '.join(msg.content.split(' ')[2:])
+            try:
+                sub = cmd.cmd_dict[sub_string.split(' ')[0]]
+            except KeyError:
+                if cmd.ID == 'av':
+                    return self.commands['default'], None
+                sub = cmd.cmd_dict['poll']
+            if sub.ID == 'grdn':
+                # GrdnData split the string again for its own subcommand, and each handler picked its arguments out
+                cmd_list = sub_string.split(' ')
+                if len(cmd_list) < 3:
+                    return sub, cmd_list
+                return sub, (cmd_list[1], cmd_list[2].lower(), "-h" in cmd_list, ' '.join(cmd_list[3:]))
+            return sub, sub_string
+        return cmd, None
+
+
+def bench(name, route, messages):
+    start = time.perf_counter()
+    for msg in messages:
+        route(msg)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>8}: {elapsed:7.3f}s, {len(messages) / elapsed:10.0f} messages/s, "
+          f"{elapsed / len(messages) * 1e6:6.2f}us/message")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1000000)
+    args = parser.parse_args()
+
+    router = command_factory()
+    legacy = LegacyDispatch(router.commands)
+    samples = [SimpleNamespace(content=template.format(p=ACTIVATION_PREFIX)) for template in TEMPLATES]
+    for msg in samples:
+        # Both paths have to land on the same command for the comparison to mean anything
+        assert type(router.route(msg).command) is type(legacy.route(msg)[0]), msg.content
+    messages = [samples[i % len(samples)] for i in range(args.messages)]
+
+    bench('legacy', legacy.route, messages)
+    bench('router', router.route, messages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Parses synthetic vote commands with the shared vote grammar (Bot/VoteParser.py) and with the string splitting
+VotePoll / VoteMute and `interpret_time` did before it, with the duration memo cold and warm.
+
+`--check` first runs randomized round trips: random durations are written out in every supported style and must
+parse back to the same number of seconds, and random junk must either parse or raise VoteSyntaxError.
+
+Run from the repository root: `python -m benchmarks.vote_parser_bench --commands 200000 --check`
+"""
+import random
+import string
+import time
+from argparse import ArgumentParser
+
+from Bot.VoteParser import UNITS, MAX_DURATION, MAX_DURATION_LENGTH, VoteSyntaxError, parse_duration, parse_mute, \
+    parse_poll
+
+LONG_NAMES = {'y': 'year', 'mo': 'month', 'w': 'week', 'd': 'day', 'h': 'hour', 'm': 'minute', 's': 'second'}
+ISO_ORDER = (('y', 'Y'), ('mo', 'M'), ('w', 'W'), ('d', 'D'))
+ISO_TIME_ORDER = (('h', 'H'), ('m', 'M'), ('s', 'S'))
+
+
+def legacy_interpret_time(duration: str) -> int:
+    """VoteCommand.interpret_time before the shared grammar."""
+    duration = duration.strip().split(' ')
+    if len(duration) == 1 and duration[0].isdigit():
+        return int(duration[0])
+    times = {"year": 31536000, "month": 2628288, "week": 604800, "day": 86400, "hour": 3600, "minute": 60,
+             "second": 1}
+    result = 0
+    for i, interval in enumerate(duration):
+        if not interval.isdigit():
+            for unit in times.keys():
+                if unit in interval:
+                    interval = unit
+                    break
+            try:
+                result += int(duration[i - 1]) * times[interval]
+            except KeyError:
+                pass
+    return result if result != 0 else 60
+
+
+def legacy_poll(vote_string: str):
+    vote_string = vote_string.split('|')
+    question = vote_string[0].strip()
+    answers = vote_string[1].strip().split(', ')
+    try:
+        duration = legacy_interpret_time(vote_string[2].strip())
+    except IndexError:
+        duration = 60
+    return question, answers, duration
+
+
+def legacy_mute(vote_string: str):
+    mute_duration = 60
+    poll_duration = 60
+    if "for" in vote_string:
+        durations = vote_string.split('for')[1]
+        if "|" in vote_string:
+            durations = durations.split('|')
+            mute_duration = legacy_interpret_time(durations[0])
+            poll_duration = legacy_interpret_time(durations[1])
+        else:
+            mute_duration = legacy_interpret_time(durations)
+    elif "|" in vote_string:
+        poll_duration = legacy_interpret_time(vote_string.split('|')[1])
+    return mute_duration, poll_duration
+
+
+def random_parts(rng: random.Random, longest: int = MAX_DURATION):
+    """A random duration of 1 to 3 units, no longer than `longest` seconds."""
+    while True:
+        units = rng.sample(list(UNITS), rng.randint(1, 3))
+        parts = {unit: rng.randint(1, 59) for unit in units}
+        if sum(value * UNITS[unit] for unit, value in parts.items()) <= longest:
+            return parts
+
+
+def render(parts, style: str) -> str:
+    ordered = [unit for unit in UNITS if unit in parts]
+    if style == 'compact':
+        return "".join(f"{parts[unit]}{unit}" for unit in ordered)
+    if style == 'long':
+        return ", ".join(f"{parts[unit]} {LONG_NAMES[unit]}{'s' if parts[unit] != 1 else ''}" for unit in ordered)
+    if style == 'and':
+        return " and ".join(f"{parts[unit]} {LONG_NAMES[unit]}" for unit in ordered)
+    date = "".join(f"{parts[unit]}{letter}" for unit, letter in ISO_ORDER if unit in parts)
+    clock = "".join(f"{parts[unit]}{letter}" for unit, letter in ISO_TIME_ORDER if unit in parts)
+    return "P" + date + ("T" + clock if clock else "")
+
+
+def check(rounds: int, seed: int):
+    rng = random.Random(seed)
+    for _ in range(rounds):
+        parts = random_parts(rng)
+        expected = sum(value * UNITS[unit] for unit, value in parts.items())
+        for style in ('compact', 'long', 'and', 'iso'):
+            text = render(parts, style)
+            assert parse_duration(text) == expected, (text, parse_duration(text), expected)
+        seconds = rng.randint(0, 10 ** 6)
+        assert parse_duration(str(seconds)) == seconds
+        try:
+            parse_duration(f"{rng.randint(2, 10 ** 8)} years")
+        except VoteSyntaxError:
+            pass
+        else:
+            raise AssertionError("Accepted a duration over MAX_DURATION")
+
+        junk = "".join(rng.choice(string.ascii_letters + string.digits + " ,|") for _ in range(rng.randint(0, 80)))
+        try:
+            parse_duration(junk)
+        except VoteSyntaxError:
+            pass
+        else:
+            assert len(junk.strip()) <= MAX_DURATION_LENGTH, junk
+        for parse in (parse_poll, parse_mute):
+            try:
+                parse(junk)
+            except VoteSyntaxError:
+                pass
+    print(f"check: {rounds} rounds of round trips and junk input passed")
+
+
+def make_commands(count: int, distinct: int, rng: random.Random):
+    # The old parser only handles the long style
+    durations = [render(random_parts(rng), 'long') for _ in range(distinct)]
+    commands = []
+    for i in range(count):
+        duration = durations[i % distinct]
+        if i % 2:
+            commands.append(('poll', f"What should we play tonight? | Valorant, League, Minecraft | {duration}"))
+        else:
+            commands.append(('mute', f"<@123456789012345678> for {duration} | 2 minutes"))
+    return commands
+
+
+def bench(name, poll, mute, commands):
+    start = time.perf_counter()
+    for kind, text in commands:
+        if kind == 'poll':
+            poll(text)
+        else:
+            mute(text)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>16}: {elapsed:7.3f}s, {elapsed / len(commands) * 1e6:6.2f}us/command")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--commands', type=int, default=200000)
+    parser.add_argument('--distinct', type=int, default=50, help="Distinct duration strings in the workload")
+    parser.add_argument('--check', action='store_true')
+    parser.add_argument('--check-rounds', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.check:
+        check(args.check_rounds, args.seed)
+
+    commands = make_commands(args.commands, args.distinct, random.Random(args.seed))
+    bench('legacy', legacy_poll, legacy_mute, commands)
+    parse_duration.cache_clear()
+    bench('grammar (cold)', parse_poll, parse_mute, commands)
+    bench('grammar (warm)', parse_poll, parse_mute, commands)
+    print(f"duration memo: {parse_duration.cache_info()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,8 @@ import logging
 import datetime
 from dotenv import load_dotenv
 
+from Bot.LogPipeline import setup_logging
+
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 ACTIVATION_PREFIX = os.getenv('PREFIX')
@@ -15,11 +17,116 @@ intents.messages = True
 intents.members = True
 intents.guilds = True
 
-CLIENT = discord.Client(intents=intents)  # type: discord.Client
-LOGGER_FORMAT = '%(asctime)s:%(levelname)s:%(name)s: %(message)s'  # Message log format
-logging.basicConfig(filename='discord_bot.log', level=logging.INFO, format=LOGGER_FORMAT)
+# Sharding. With SHARD_COUNT set this process runs the shards in SHARD_IDS (all of them if empty) on an
+# AutoShardedClient. `main.py --shards N --processes P` starts P processes and sets these for each of them.
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id.strip()]
+SHARD_WORKER = int(os.getenv('SHARD_WORKER', '0'))
+
+# Member caching. 'full' downloads every guild's member list at startup and keeps it. 'lazy' only keeps members who
+# are in a voice channel, and fetches the rest when they're needed into an LRU of MEMBER_CACHE_SIZE members kept for
+# MEMBER_CACHE_TTL seconds.
+MEMBER_CACHE = os.getenv('MEMBER_CACHE', 'full')
+MEMBER_CACHE_SIZE = int(os.getenv('MEMBER_CACHE_SIZE', '5000'))
+MEMBER_CACHE_TTL = float(os.getenv('MEMBER_CACHE_TTL', '900'))
+client_options = {}
+if MEMBER_CACHE == 'lazy':
+    member_cache_flags = discord.MemberCacheFlags.none()
+    member_cache_flags.voice = True  # Vote quorums count the members of a voice channel
+    client_options = dict(chunk_guilds_at_startup=False, member_cache_flags=member_cache_flags)
+
+
+def new_client() -> discord.Client:
+    """A client with the intents, member caching and sharding set here. Each bot a process hosts has its own."""
+    if SHARD_COUNT:
+        return discord.AutoShardedClient(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS or None,
+                                         **client_options)
+    return discord.Client(intents=intents, **client_options)
+
+
+CLIENT: discord.Client = new_client()
+
+LOGGER_FORMAT = '%(asctime)s:%(levelname)s:%(name)s: %(message)s'  # Message log format for LOG_FORMAT=text
+# Logging. Records are sampled, queued and written to LOG_FILE by a background thread (Bot/LogPipeline.py). The file
+# is rotated at LOG_MAX_BYTES, or every LOG_ROTATE_WHEN (e.g. 'midnight') if set, keeping LOG_BACKUPS old files.
+LOG_FILE = os.getenv('LOG_FILE', 'discord_bot.log')
+if SHARD_COUNT:
+    # Shard workers can't share one file and rotate it
+    LOG_FILE = '{0}.{2}{1}'.format(*os.path.splitext(LOG_FILE), SHARD_WORKER)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' or 'text'
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', '5'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Records per second kept for each category (e.g. 'command') below WARNING, after bursts of LOG_SAMPLE_BURST
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '20'))
+LOG_SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', '100'))
 LOGGER = logging.getLogger('discord')
+
+
+def start_logging():
+    """Starts writing log records to LOG_FILE. Called by main.py, so importing the settings doesn't create the file."""
+    setup_logging(LOG_FILE, logging.INFO, fmt=LOG_FORMAT, max_bytes=LOG_MAX_BYTES, rotate_when=LOG_ROTATE_WHEN,
+                  backups=LOG_BACKUPS, queue_size=LOG_QUEUE_SIZE, sample_rate=LOG_SAMPLE_RATE,
+                  sample_burst=LOG_SAMPLE_BURST, text_format=LOGGER_FORMAT)
+
+
 DATETIME_DEFAULT = datetime.datetime(2020, 1, 1)
 
 WENRITH_UID = os.getenv('WENRITH_UID')
 DARKFYRE_UID = os.getenv('DARKFYRE_UID')
+
+# Google Drive sync settings for the GRDN knowledge base. Set DRIVE_BACKEND=fake to use a local directory instead.
+DRIVE_BACKEND = os.getenv('DRIVE_BACKEND', 'google')
+DRIVE_SYNC_DEBOUNCE = float(os.getenv('DRIVE_SYNC_DEBOUNCE', '2'))
+FAKE_DRIVE_DIR = os.getenv('FAKE_DRIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_drive'))
+FAKE_DRIVE_LATENCY = float(os.getenv('FAKE_DRIVE_LATENCY', '0.5'))
+GRDN_FLUSH_INTERVAL = float(os.getenv('GRDN_FLUSH_INTERVAL', '5'))
+GRDN_REFRESH_SECONDS = float(os.getenv('GRDN_REFRESH_SECONDS', '3600'))
+# 'journal' uploads each change as an entry of a journal kept next to the pickle on Drive, folded into the pickle every
+# GRDN_JOURNAL_COMPACT_OPS entries. 'snapshot' uploads the whole pickle every time. On Google Drive the journal is the
+# file GRDN_JOURNAL_FILE_ID, and without it the whole pickle is uploaded.
+GRDN_SYNC = os.getenv('GRDN_SYNC', 'journal')
+GRDN_JOURNAL_FILE_ID = os.getenv('GRDN_JOURNAL_FILE_ID', '')
+GRDN_JOURNAL_COMPACT_OPS = int(os.getenv('GRDN_JOURNAL_COMPACT_OPS', '500'))
+
+# Per-member state storage. 'sqlite' (default) or 'yaml' for the legacy one-file-per-member layout in Bot/Guilds.
+USER_STORE_BACKEND = os.getenv('USER_STORE_BACKEND', 'sqlite')
+USER_STORE_PATH = os.getenv('USER_STORE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            'Bot', 'data', 'user_state.db'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '600'))
+# File format for the yaml backend: 'yaml' (libyaml accelerated when available), 'struct' or 'msgpack'
+USER_CODEC = os.getenv('USER_CODEC', 'yaml')
+
+# Guild lifecycle. A guild the bot leaves is archived into GUILD_ARCHIVE_DIR and the archive deleted after
+# GUILD_ARCHIVE_DAYS. Every GUILD_LIFECYCLE_INTERVAL seconds, guilds left while offline are archived, departed members'
+# records dropped and the member state storage compacted.
+GUILD_ARCHIVE_DIR = os.getenv('GUILD_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                'Bot', 'data', 'archive'))
+GUILD_ARCHIVE_DAYS = float(os.getenv('GUILD_ARCHIVE_DAYS', '30'))
+GUILD_LIFECYCLE_INTERVAL = float(os.getenv('GUILD_LIFECYCLE_INTERVAL', '86400'))
+
+# Command throttling. Each user and each channel may run THROTTLE_USER and THROTTLE_CHANNEL commands per so many
+# seconds ('5/10'), and each user the commands in THROTTLE_COMMANDS ('vote=2/60,...') that often. Beyond
+# THROTTLE_IN_FLIGHT commands running at once new ones are dropped. Empty or 0 turns a limit off. Users whose commands
+# are dropped are told at most every THROTTLE_NOTICE_SECONDS.
+THROTTLE_USER = os.getenv('THROTTLE_USER', '5/10')
+THROTTLE_CHANNEL = os.getenv('THROTTLE_CHANNEL', '15/10')
+THROTTLE_COMMANDS = os.getenv('THROTTLE_COMMANDS', 'vote=2/60,av=5/30,users=2/60')
+THROTTLE_IN_FLIGHT = int(os.getenv('THROTTLE_IN_FLIGHT', '64'))
+THROTTLE_NOTICE_SECONDS = float(os.getenv('THROTTLE_NOTICE_SECONDS', '30'))
+
+# Votes about a member in a voice channel close before their deadline once most of the people in that channel agree,
+# if VOTE_EARLY_CLOSE is set, and only once the leading answer has at least VOTE_EARLY_CLOSE_MIN_VOTES votes.
+VOTE_EARLY_CLOSE = os.getenv('VOTE_EARLY_CLOSE', '').lower() in ('1', 'true', 'yes')
+VOTE_EARLY_CLOSE_MIN_VOTES = int(os.getenv('VOTE_EARLY_CLOSE_MIN_VOTES', '3'))
+
+# Maximum number of Discord REST requests in flight at once
+REST_CONCURRENCY = int(os.getenv('REST_CONCURRENCY', '4'))
+
+# Metrics. Set METRICS_PORT to serve them in the Prometheus text format at http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# Seconds between event loop lag samples
+METRICS_LOOP_INTERVAL = float(os.getenv('METRICS_LOOP_INTERVAL', '0.5'))
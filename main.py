@@ -1,6 +1,10 @@
+import time
+START = time.perf_counter()
 
+import os
+import sys
 from argparse import ArgumentParser
-from Bot.bot import load_bot
+from Bot.StartupProfile import get_startup_profile
 
 
 def arg_setup():
@@ -13,14 +17,56 @@ def arg_setup():
     parser.add_argument('-v', '--version', action='version', version='%(prog)s version 0.0.2')
     parser.add_argument('-c', '--custom', action='store_true', help="Activates custom mode for the bot to test "
                                                                     "new functions")
+    parser.add_argument('-p', '--profile-startup', action='store_true', help="Print how long each import phase, "
+                                                                             "connecting and the first dispatch of "
+                                                                             "each command take")
+    parser.add_argument('--shards', type=int, default=0, help="Run the bot as this many shards, split across "
+                                                              "--processes worker processes")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help="Worker processes for --shards "
+                                                                                  "(default: one per core)")
+    parser.add_argument('--bots', default=os.getenv('BOTS_FILE', ''), help="YAML file of bots to run in this "
+                                                                          "process (default: $BOTS_FILE, or the one "
+                                                                          "bot set up by the environment)")
 
     return parser.parse_args()
 
 
+def launch_shards(args):
+    """
+    Starts a worker process for each range of shards. Each one runs this script again with the same options, minus
+    the sharding ones, and finds its shards in the environment.
+    """
+    from Bot.Sharding import ShardLauncher
+    command = [sys.executable, os.path.abspath(__file__)]
+    if args.custom:
+        command.append('--custom')
+    if args.profile_startup:
+        command.append('--profile-startup')
+    ShardLauncher(command, args.shards, min(args.processes, args.shards)).run()
+
+
+def start_logging():
+    import envs
+    envs.start_logging()
+
+
 def main(args):
+    if args.shards:
+        if args.bots:
+            sys.exit("--bots can't be combined with --shards")
+        start_logging()
+        launch_shards(args)
+        return
+    profile = get_startup_profile()
+    if args.profile_startup:
+        profile.enable(START)
+        # Import the bot's dependencies one phase at a time so the report can break them down
+        profile.import_modules()
+    start_logging()
+    from Bot.bot import load_bot
     load_bot(args)
 
 
 if __name__ == "__main__":
     args = arg_setup()
-    main(args)
\ No newline at end of file
+    main(args)
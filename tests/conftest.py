@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Before anything imports envs: keep the log and member state out of the working tree
+_tmp = tempfile.mkdtemp(prefix='crew-bot-tests-')
+os.environ.setdefault('LOG_FILE', os.path.join(_tmp, 'bot.log'))
+os.environ.setdefault('USER_STORE_PATH', os.path.join(_tmp, 'user_state.db'))
+os.environ.setdefault('PREFIX', '!cc')
@@ -0,0 +1,27 @@
+import pytest
+
+from Bot.CommandRouter import Arg, ArgumentError, Flag, Rest, parse_args
+
+LIST = (Flag('all', '-all'), Flag('hidden', '-h'))
+ADD = (Arg('key', str.lower), Flag('hidden', '-h'), Rest('data'))
+
+
+@pytest.mark.parametrize('rest', ['-all -h', '-h -all'])
+def test_flags_in_any_order(rest):
+    assert parse_args(LIST, rest) == ({'all': True, 'hidden': True}, '')
+
+
+def test_missing_and_repeated_flags():
+    assert parse_args(LIST, '') == ({'all': False, 'hidden': False}, '')
+    assert parse_args(LIST, '-h') == ({'all': False, 'hidden': True}, '')
+    assert parse_args(LIST, '-h -h') == ({'all': False, 'hidden': True}, '-h')
+
+
+def test_flags_stop_at_the_next_argument():
+    assert parse_args(ADD, 'Key -h some -h data') == ({'key': 'key', 'hidden': True, 'data': 'some -h data'}, '')
+    assert parse_args(ADD, 'key data -h') == ({'key': 'key', 'hidden': False, 'data': 'data -h'}, '')
+
+
+def test_missing_argument():
+    with pytest.raises(ArgumentError):
+        parse_args(ADD, '')
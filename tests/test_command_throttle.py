@@ -0,0 +1,20 @@
+from Bot.CommandThrottle import CommandThrottle, CHANNEL, USER
+
+
+def test_turned_away_command_takes_no_tokens():
+    throttle = CommandThrottle((2, 60), (1, 60), {})
+    assert throttle.admit(1, 10, 'help') is None
+    throttle.release()
+    # The channel is out of tokens, so the user's second token is left for another channel
+    assert throttle.admit(1, 10, 'help') == CHANNEL
+    assert throttle.admit(1, 11, 'help') is None
+    throttle.release()
+    assert throttle.admit(1, 12, 'help') == USER
+
+
+def test_command_limit_is_per_user():
+    throttle = CommandThrottle(None, None, {'vote': (1, 60)})
+    assert throttle.admit(1, 10, 'vote') is None
+    assert throttle.admit(1, 10, 'vote') is not None
+    assert throttle.admit(2, 10, 'vote') is None
+    assert throttle.admit(1, 10, 'help') is None
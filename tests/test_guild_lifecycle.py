@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from benchmarks.fake_discord import FakeClient
+from Bot import BotHost
+from Bot.BotHost import BotSettings, host_bot
+from Bot.GuildLifecycle import GuildLifecycle, left_markers
+from Bot.UserCodec import make_user
+from Bot.UserStore import get_user_store
+from envs import DATETIME_DEFAULT
+
+GONE = 424242
+
+
+class Client(FakeClient):
+    ready = True
+
+    def is_ready(self) -> bool:
+        return self.ready
+
+
+@pytest.fixture
+def client():
+    client = Client()
+    client.add_guild(3)
+    host_bot(client, BotSettings('test', 'token', '!t'))
+    store = get_user_store()
+    store.put_many(GONE, [make_user('left', 1, DATETIME_DEFAULT, DATETIME_DEFAULT)])
+    yield client
+    del BotHost._bots[client]
+    store.delete_guild(GONE)
+
+
+def test_missing_guild_needs_two_ready_passes(client, tmp_path):
+    lifecycle = GuildLifecycle(archive_dir=str(tmp_path))
+    client.ready = False
+    assert asyncio.run(lifecycle.run_once())['archived'] == 0
+    assert left_markers(str(tmp_path)) == {}
+
+    client.ready = True
+    summary = asyncio.run(lifecycle.run_once())
+    assert (summary['missing'], summary['archived']) == (1, 0)
+    assert get_user_store().users(GONE)
+
+    client.ready = False  # e.g. a bad token on the next start
+    assert asyncio.run(lifecycle.run_once())['archived'] == 0
+
+    client.ready = True
+    assert asyncio.run(lifecycle.run_once())['archived'] == 1
+    assert get_user_store().backend.users(GONE) == []
+    assert left_markers(str(tmp_path)) == {}
+
+
+def test_guild_that_comes_back_is_kept(client, tmp_path):
+    lifecycle = GuildLifecycle(archive_dir=str(tmp_path))
+    asyncio.run(lifecycle.run_once())
+    client.guilds[0].id = GONE
+    assert asyncio.run(lifecycle.run_once())['archived'] == 0
+    assert left_markers(str(tmp_path)) == {}
@@ -0,0 +1,33 @@
+import asyncio
+
+from benchmarks.fake_discord import FakeClient, FakeMember
+from Bot import GuildReload
+from Bot.UserYml import UserYml
+from Bot.UserStore import get_user_store
+
+
+def test_member_who_joins_during_a_reconcile_is_kept(monkeypatch):
+    client = FakeClient()
+    guild = client.add_guild(4)
+    store = get_user_store()
+    joined = FakeMember(client, guild)
+    chunks = GuildReload.member_chunks
+
+    async def member_chunks(guild, chunk_size):
+        async for members in chunks(guild, chunk_size):
+            yield members
+            # on_member_join, between two chunks of the member list
+            guild.add_member(joined)
+            store.put(guild.id, UserYml.create_user_from_member(joined))
+
+    monkeypatch.setattr(GuildReload, 'member_chunks', member_chunks)
+
+    async def run():
+        await guild.chunk()
+        return await GuildReload._reconcile(guild, 2)
+
+    try:
+        assert asyncio.run(run()) == (4, 0)
+        assert joined.id in store.user_ids(guild.id)
+    finally:
+        store.delete_guild(guild.id)
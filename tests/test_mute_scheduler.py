@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+from benchmarks.fake_discord import FakeClient
+from Bot.MuteScheduler import MuteScheduler, UNMUTE
+from Bot.UserCodec import make_user
+from Bot.UserStore import get_user_store
+from envs import DATETIME_DEFAULT
+
+
+def test_restore_waits_for_the_client_in_the_guild():
+    first, second = FakeClient(), FakeClient()
+    first.add_guild(1)
+    guild = second.add_guild(1)
+    store = get_user_store()
+    store.put_many(guild.id, [make_user('muted', 7, datetime.now() - timedelta(minutes=1), DATETIME_DEFAULT)])
+    try:
+        scheduler = MuteScheduler()
+        scheduler.restore(first)
+        # The second bot hasn't connected, so its guild's expiry would fire with nothing to unmute
+        assert len(scheduler) == 0
+        scheduler.restore(second)
+        assert len(scheduler) == 1
+        scheduler.restore(second)
+        assert len(scheduler) == 1
+    finally:
+        store.delete_guild(guild.id)
+
+
+def test_cancelled_expiries_leave_the_heap():
+    scheduler = MuteScheduler()
+    deadline = datetime.now() + timedelta(hours=1)
+    for uid in range(100):
+        scheduler.schedule(1, uid, UNMUTE, deadline)
+    for uid in range(99):
+        scheduler.cancel(1, uid, UNMUTE)
+    scheduler.schedule(2, 1, UNMUTE, deadline)
+    scheduler.cancel_guild(2)
+    assert len(scheduler) == 1
+    assert len(scheduler._heap) <= 2
+    assert scheduler._heap[0] == (deadline.timestamp(), 1, 99, UNMUTE)
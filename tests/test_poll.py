@@ -0,0 +1,50 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from benchmarks.fake_discord import FakeClient
+from Bot.PollRegistry import Poll, PollRegistry, MUTE
+
+
+def make_poll(quorum, min_votes=3, counts=None) -> Poll:
+    return Poll(1, 2, 3, ['y', 'n'], time.time() + 60, kind=MUTE, target_id=4, mute_duration=60, quorum=quorum,
+                min_votes=min_votes, counts=counts)
+
+
+def test_no_quorum_runs_to_the_deadline():
+    assert not make_poll(None, counts=[10, 0]).decided()
+
+
+def test_one_vote_doesnt_close_a_poll_early():
+    # The target alone in voice: a single reaction is a majority, but below the minimum
+    assert not make_poll(1, counts=[1, 0]).decided()
+    assert make_poll(1, counts=[3, 0]).decided()
+
+
+def test_majority_of_the_channel():
+    assert not make_poll(8, counts=[4, 3]).decided()
+    assert make_poll(8, counts=[5, 0]).decided()
+
+
+def test_saved_polls_without_min_votes_load():
+    data = make_poll(4).to_dict()
+    del data['min_votes']
+    assert Poll.from_dict(data).min_votes == 0
+
+
+def test_votes_after_the_deciding_one_close_once():
+    client = FakeClient()
+    channel = client.add_guild(0).text_channels[0]
+    registry = PollRegistry()
+
+    async def run():
+        registry.open(client, Poll(5, channel.id, channel.guild.id, ['y', 'n'], time.time() + 60, quorum=3,
+                                   min_votes=2))
+        # Three voters in a row, before the close gets to run
+        for user_id in (11, 12, 13):
+            registry.on_reaction(SimpleNamespace(message_id=5, user_id=user_id, emoji='y'), 1)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert len(registry) == 0
+    assert [m.content for m in channel.messages.values()] == ["y wins with 3 votes."]
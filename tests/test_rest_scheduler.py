@@ -0,0 +1,64 @@
+import asyncio
+
+from Bot.RestScheduler import RestScheduler, MODERATION, COSMETIC
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_serial_requests_run_in_order():
+    async def scenario():
+        scheduler = RestScheduler(concurrency=4)
+        done = []
+
+        async def edit(mute, delay):
+            await asyncio.sleep(delay)
+            done.append(mute)
+
+        serial = ('edit', 1, 2)
+        # The slow mute would finish after the unmute if both ran at once
+        futures = [scheduler.submit('member:1', edit, True, 0.05, priority=COSMETIC, serial=serial),
+                   scheduler.submit('member:1', edit, False, 0, priority=MODERATION, serial=serial)]
+        await asyncio.gather(*futures)
+        scheduler.stop()
+        return done
+
+    assert run(scenario()) == [True, False]
+
+
+def test_no_coalescing_across_a_different_request():
+    async def scenario():
+        scheduler = RestScheduler(concurrency=1)
+        done = []
+
+        async def edit(mute):
+            done.append(mute)
+
+        serial = ('edit', 1, 2)
+        futures = [scheduler.submit('member:1', edit, mute, key=serial + (mute,), serial=serial)
+                   for mute in (True, False, True, True)]
+        await asyncio.gather(*futures)
+        scheduler.stop()
+        return done, scheduler.coalesced
+
+    # The last mute shares the third's request, not the first's, which the unmute came after
+    assert run(scenario()) == ([True, False, True], 1)
+
+
+def test_idle_buckets_are_dropped():
+    async def scenario():
+        scheduler = RestScheduler(concurrency=1, max_buckets=3)
+
+        async def react():
+            pass
+
+        for channel_id in range(10):
+            await scheduler.submit(f"reaction:{channel_id}", react)
+        # Refilled by now, except for the last route's
+        await asyncio.sleep(0.3)
+        await scheduler.submit('reaction:10', react)
+        scheduler.stop()
+        return set(scheduler._buckets)
+
+    assert len(run(scenario())) <= 3
@@ -0,0 +1,39 @@
+import os
+from datetime import datetime
+
+from Bot.UserCodec import get_codec
+from Bot.UserStore import YamlUserStore
+from Bot.UserYml import UserYml
+
+GUILD = 1
+
+
+def make_user(uid: int) -> UserYml:
+    return UserYml(f"user{uid}", uid, datetime(2030, 1, 1, 12, 30), datetime(2020, 1, 1))
+
+
+def test_switching_codecs_keeps_existing_records(tmp_path):
+    before = YamlUserStore(str(tmp_path), get_codec('struct'))
+    before.put_many(GUILD, [make_user(1), make_user(2)])
+
+    after = YamlUserStore(str(tmp_path), get_codec('yaml'))
+    user = after.get(GUILD, 1)
+    assert (user.name, user.uid, user.muted) == ("user1", 1, datetime(2030, 1, 1, 12, 30))
+    assert after.user_ids(GUILD) == {1, 2}
+    assert len(after.users(GUILD)) == 2
+
+
+def test_rewritten_record_replaces_old_format(tmp_path):
+    YamlUserStore(str(tmp_path), get_codec('struct')).put_many(GUILD, [make_user(1)])
+    store = YamlUserStore(str(tmp_path), get_codec('yaml'))
+    user = store.get(GUILD, 1)
+    user.muted = datetime(2020, 1, 1)
+    store.put_many(GUILD, [user])
+
+    assert sorted(os.listdir(store.guild_path(GUILD))) == ['1.yml']
+    # Switching back reads the newer record, not the one left from before
+    assert YamlUserStore(str(tmp_path), get_codec('struct')).get(GUILD, 1).muted == datetime(2020, 1, 1)
+
+
+def test_missing_record(tmp_path):
+    assert YamlUserStore(str(tmp_path), get_codec('yaml')).get(GUILD, 1) is None
@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+
+from benchmarks.fake_discord import FakeClient, FakeMessage
+from Bot import BotHost
+from Bot.BotHost import BotSettings
+from Bot.bot import add_bot
+
+
+@pytest.fixture
+def client():
+    client = FakeClient()
+    client.add_guild(3)
+    add_bot(BotSettings('test', 'token', '!t'), client)
+    yield client
+    del BotHost._bots[client]
+
+
+def test_vote_banish_replies(client):
+    guild = client.guilds[0]
+    channel = guild.text_channels[0]
+
+    async def run():
+        await guild.chunk()
+        await client.handlers['on_message'](FakeMessage(channel, guild.members[0], "!t vote banish"))
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert [m.content for m in channel.messages.values()] == ["Banish votes aren't available yet."]
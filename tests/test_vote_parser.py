@@ -0,0 +1,27 @@
+import pytest
+
+from Bot.VoteParser import MAX_DURATION, VoteSyntaxError, parse_duration, parse_mute
+
+
+@pytest.mark.parametrize('text, seconds', [
+    ("90", 90),
+    ("1h30m", 5400),
+    ("2 days, 3 hours", 183600),
+    ("1 hour and 5 minutes", 3900),
+    ("PT1H30M", 5400),
+    ("1 year", MAX_DURATION),
+])
+def test_durations(text, seconds):
+    assert parse_duration(text) == seconds
+
+
+@pytest.mark.parametrize('text', ["99999999 years", "366 days", "P2Y", str(MAX_DURATION + 1)])
+def test_durations_over_the_maximum(text):
+    with pytest.raises(VoteSyntaxError):
+        parse_duration(text)
+
+
+def test_mute_over_the_maximum():
+    with pytest.raises(VoteSyntaxError):
+        parse_mute("<@1> for 99999999 years")
+    assert parse_mute("<@1> for 5 minutes | 2 minutes").duration == 300